@@ -0,0 +1,158 @@
+"""
+Load test: sync (threadpool) vs async handlers for the classified-emails page.
+
+Serves both variants from one uvicorn instance against a real mongod and
+fires concurrent requests at each, reporting throughput and latency
+percentiles. Point it at a scratch database:
+
+    MONGO_DB=email_bench python -m benchmarks.bench_async_reads --seed 100000 --concurrency 50,200,500
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import random
+import statistics
+import threading
+import time
+
+import httpx
+import uvicorn
+from fastapi import FastAPI
+from pymongo import InsertOne
+
+from services import async_db_service
+from services.db_service import list_classified_emails, STATE_CLASSIFIED
+from services.mongo import get_emails_collection
+from services.migrations import run_migrations
+
+CATEGORIES = ["Work / Professional", "Personal", "Finance / Bills", "Promotions / Marketing", "Notifications / Updates"]
+
+
+def seed(count: int, chunk: int = 5000):
+    """Insert synthetic classified emails until the collection holds `count` of them."""
+    collection = get_emails_collection()
+    existing = collection.count_documents({"classification_state": STATE_CLASSIFIED})
+    rng = random.Random(7)
+    start = datetime.datetime(2024, 1, 1)
+    ops = []
+    for i in range(existing, count):
+        sender = f"sender{rng.randrange(500)}@example{rng.randrange(20)}.com"
+        ops.append(InsertOne({
+            "provider": "gmail",
+            "provider_message_id": f"bench{i:08d}",
+            "thread_id": f"thr{i:08d}",
+            "from": f"Sender <{sender}>",
+            "sender_address": sender,
+            "to": ["me@example.com"],
+            "subject": f"Benchmark subject {i}",
+            "snippet": "A short preview of the message body for the benchmark run. " * 2,
+            "body_plain": "Body text. " * 200,
+            "date": start + datetime.timedelta(seconds=i * 37),
+            "classification_state": STATE_CLASSIFIED,
+            "classifications": {"category": rng.choice(CATEGORIES), "confidence": round(rng.random(), 3),
+                                "reasoning": "seeded", "summary": "seeded", "tier": "llm"},
+        }))
+        if len(ops) >= chunk:
+            collection.bulk_write(ops, ordered=False)
+            ops = []
+    if ops:
+        collection.bulk_write(ops, ordered=False)
+    run_migrations()
+    print(f"Seeded {max(0, count - existing)} emails ({count} classified in total)")
+
+
+def build_app(page_size: int) -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/sync/classified-emails")
+    def sync_page(category: str = None):
+        emails, next_cursor = list_classified_emails(limit=page_size, category=category)
+        return {"classified_emails": emails, "next_cursor": next_cursor}
+
+    @app.get("/async/classified-emails")
+    async def async_page(category: str = None):
+        emails, next_cursor = await async_db_service.list_classified_emails(limit=page_size, category=category)
+        return {"classified_emails": emails, "next_cursor": next_cursor}
+
+    return app
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q / 100 * (len(values) - 1))))]
+
+
+async def load(url: str, concurrency: int, requests: int):
+    latencies = []
+    errors = 0
+    queue = iter(range(requests))
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(limits=limits, timeout=60) as client:
+        async def worker():
+            nonlocal errors
+            for i in queue:
+                params = {"category": CATEGORIES[i % len(CATEGORIES)]} if i % 2 else {}
+                started = time.perf_counter()
+                try:
+                    response = await client.get(url, params=params)
+                    response.raise_for_status()
+                except httpx.HTTPError:
+                    errors += 1
+                    continue
+                latencies.append((time.perf_counter() - started) * 1000)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    return {
+        "concurrency": concurrency,
+        "requests": requests,
+        "errors": errors,
+        "throughput_rps": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 50), 1),
+        "p95_ms": round(percentile(latencies, 95), 1),
+        "p99_ms": round(percentile(latencies, 99), 1),
+        "mean_ms": round(statistics.mean(latencies), 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--seed", type=int, default=0, help="ensure at least this many classified emails exist")
+    parser.add_argument("--concurrency", default="50,200,500")
+    parser.add_argument("--requests", type=int, default=2000, help="requests per run")
+    parser.add_argument("--page-size", type=int, default=50)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    args = parser.parse_args()
+
+    if args.seed:
+        seed(args.seed)
+
+    server = uvicorn.Server(uvicorn.Config(build_app(args.page_size), port=args.port, log_level="warning", backlog=4096))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.05)
+
+    results = []
+    for concurrency in [int(c) for c in args.concurrency.split(",")]:
+        for mode in ("sync", "async"):
+            url = f"http://127.0.0.1:{args.port}/{mode}/classified-emails"
+            asyncio.run(load(url, min(concurrency, 20), 100))  # warm pools and caches
+            result = {"mode": mode, **asyncio.run(load(url, concurrency, args.requests))}
+            results.append(result)
+            print(json.dumps(result))
+
+    server.should_exit = True
+    thread.join()
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+"""
+Compare LLM calls per 100 emails and wall-clock time for single-email and
+batched classification prompts, using FakeChatModel instead of Gemini.
+
+Run from the Backend directory:
+    python -m benchmarks.bench_classifier_batching --emails 100 --batch-sizes 1,5,10,20
+"""
+import argparse
+import asyncio
+import time
+
+from benchmarks.fake_llm import FakeChatModel
+from services import classifier
+
+SUBJECTS = [
+    "Invoice #{n} for your September order",
+    "Team sync moved to Thursday 3pm",
+    "Your weekly digest: {n} new updates",
+    "Re: Support ticket {n} - login issue",
+    "Flash sale: {n}% off everything this weekend",
+    "Dinner on Saturday?",
+]
+
+
+def make_emails(count: int):
+    emails = []
+    for i in range(count):
+        subject = SUBJECTS[i % len(SUBJECTS)].format(n=i)
+        emails.append({
+            "provider_message_id": f"bench{i:05d}",
+            "from": f"sender{i % 17}@example.com",
+            "subject": subject,
+            "snippet": f"{subject} - a short preview of the message body number {i}.",
+            "body_plain": ("Hello,\n\nThis is a realistic length email body for benchmarking. " * 6),
+        })
+    return emails
+
+
+def run(emails, batch_size: int, concurrency: int, drop_rate: float):
+    fake = FakeChatModel(seed=42, drop_rate=drop_rate)
+    classifier.llm = fake
+    start = time.perf_counter()
+    results = asyncio.run(classifier.classify_emails_async(
+        emails, concurrency=concurrency, requests_per_minute=0, batch_size=batch_size
+    ))
+    elapsed = time.perf_counter() - start
+    return {
+        "batch_size": batch_size,
+        "emails": len(emails),
+        "classified": sum(1 for r in results if r),
+        "llm_calls": fake.calls,
+        "llm_calls_per_100": round(fake.calls * 100 / len(emails), 1),
+        "seconds": round(elapsed, 2),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--emails", type=int, default=100)
+    parser.add_argument("--batch-sizes", default="1,5,10,20")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--drop-rate", type=float, default=0.02, help="fraction of batch entries the fake model omits")
+    args = parser.parse_args()
+
+    emails = make_emails(args.emails)
+    for size in (int(s) for s in args.batch_sizes.split(",")):
+        print(run(emails, size, args.concurrency, args.drop_rate))
@@ -0,0 +1,273 @@
+"""
+Offline load test of the main API endpoints.
+
+Runs the real FastAPI app (main.py) under uvicorn against a seeded scratch
+database, with Gmail replaced by the stub server and Gemini by FakeChatModel,
+and reports throughput and p50/p95/p99 latency per endpoint:
+
+    /fetch, /classify    POSTed one at a time; latency is until the job finishes
+    /respond             draft with the fake model, send through the stub
+    /classified-emails   first pages and follow-up pages via next_cursor
+    /responded-emails    the same
+
+Results are written as JSON with the git commit, so runs can be compared:
+
+    MONGO_DB=email_bench python -m benchmarks.bench_endpoints --seed 100000 --output before.json
+    MONGO_DB=email_bench python -m benchmarks.bench_endpoints --output after.json --compare before.json
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import threading
+import time
+
+import httpx
+import uvicorn
+
+# Nothing that imports config.settings here: GMAIL_API_ROOT_URL is set in main() first
+from benchmarks.stub_gmail import StubGmailServer, StubGmailState, StubGmailClient
+
+ENDPOINTS = ["fetch", "classify", "respond", "classified-emails", "responded-emails"]
+TERMINAL_JOB_STATUSES = {"succeeded", "failed", "cancelled"}
+CATEGORIES = ["Work / Professional", "Personal", "Finance / Bills", "Promotions / Marketing", "Notifications / Updates"]
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q / 100 * (len(values) - 1))))]
+
+
+def git_revision():
+    def git(*args):
+        return subprocess.run(["git", *args], capture_output=True, text=True).stdout.strip()
+    try:
+        return {"commit": git("rev-parse", "HEAD"), "dirty": bool(git("status", "--porcelain", "--untracked-files=no"))}
+    except OSError:
+        return {"commit": None, "dirty": None}
+
+
+def install_fakes(stub: StubGmailServer, fake):
+    """Point every Gmail and LLM client the app uses at the stub server and fake model"""
+    from services import classifier, gmail_client, responder, send_queue, thread_service
+
+    gmail_client._manager = StubGmailClient(stub)
+    classifier.llm = fake
+    responder.responder_chain = responder.prompt | fake
+    thread_service._summary_chain = thread_service.summary_prompt | fake
+    # Unthrottled, so /respond measures the app rather than the configured send rate
+    send_queue._queue = send_queue.SendQueue(rate_per_minute=0, service=stub.build_service())
+
+
+class Scenario:
+    """One endpoint: `call` performs a single logical request and raises on failure"""
+
+    def __init__(self, name, concurrency, requests, call):
+        self.name = name
+        self.concurrency = concurrency
+        self.requests = requests
+        self.call = call
+
+
+async def wait_for_job(client: httpx.AsyncClient, response: httpx.Response, timeout: float = 600):
+    response.raise_for_status()
+    job_id = response.json()["job_id"]
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = (await client.get(f"/jobs/{job_id}")).json()
+        if job["status"] in TERMINAL_JOB_STATUSES:
+            if job["status"] != "succeeded":
+                raise RuntimeError(f"job {job_id} {job['status']}: {job.get('error')}")
+            return job
+        await asyncio.sleep(0.05)
+    raise TimeoutError(f"job {job_id} did not finish in {timeout}s")
+
+
+def build_scenarios(args, state: StubGmailState, email_ids):
+    rng = random.Random(11)
+    cursors = {"classified": [], "responded": []}
+
+    async def fetch(client, i):
+        # New mail arrives between fetches, so every run inserts as well as updates
+        state.add_messages(args.fetch_size // 2)
+        await wait_for_job(client, await client.post("/fetch", json={"max_emails_to_fetch": args.fetch_size}))
+
+    async def classify(client, i):
+        await wait_for_job(client, await client.post("/classify", params={"limit": args.classify_limit}))
+
+    async def respond(client, i):
+        response = await client.post("/respond", json={"email_id": email_ids[i]})
+        response.raise_for_status()
+
+    def pager(path, key, params):
+        async def page(client, i):
+            query = dict(params(i), limit=args.page_size)
+            # Every other request continues a listing from an earlier next_cursor
+            if i % 2 and cursors[key]:
+                query["cursor"] = cursors[key].pop(rng.randrange(len(cursors[key])))
+            response = await client.get(path, params=query)
+            response.raise_for_status()
+            next_cursor = response.json().get("next_cursor")
+            if next_cursor:
+                cursors[key].append(next_cursor)
+        return page
+
+    return {
+        "fetch": Scenario("fetch", 1, args.job_requests, fetch),
+        "classify": Scenario("classify", 1, args.job_requests, classify),
+        "respond": Scenario("respond", args.respond_concurrency, min(args.respond_requests, len(email_ids)), respond),
+        "classified-emails": Scenario(
+            "classified-emails", args.concurrency, args.requests,
+            pager("/classified-emails", "classified", lambda i: {"category": CATEGORIES[i % len(CATEGORIES)]} if i % 3 == 0 else {}),
+        ),
+        "responded-emails": Scenario("responded-emails", args.concurrency, args.requests, pager("/responded-emails", "responded", lambda i: {})),
+    }
+
+
+async def run_scenario(base_url: str, scenario: Scenario):
+    latencies = []
+    errors = []
+    queue = iter(range(scenario.requests))
+    limits = httpx.Limits(max_connections=scenario.concurrency, max_keepalive_connections=scenario.concurrency)
+
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=600) as client:
+        async def worker():
+            for i in queue:
+                started = time.perf_counter()
+                try:
+                    await scenario.call(client, i)
+                except Exception as e:
+                    errors.append(str(e))
+                    continue
+                latencies.append((time.perf_counter() - started) * 1000)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(scenario.concurrency)))
+        elapsed = time.perf_counter() - started
+
+    result = {"concurrency": scenario.concurrency, "requests": len(latencies) + len(errors), "errors": len(errors)}
+    if latencies:
+        result.update({
+            "throughput_rps": round(len(latencies) / elapsed, 2),
+            "p50_ms": round(percentile(latencies, 50), 1),
+            "p95_ms": round(percentile(latencies, 95), 1),
+            "p99_ms": round(percentile(latencies, 99), 1),
+            "mean_ms": round(statistics.mean(latencies), 1),
+            "max_ms": round(max(latencies), 1),
+        })
+    if errors:
+        result["sample_errors"] = sorted(set(errors))[:3]
+    return result
+
+
+def compare(baseline: dict, current: dict):
+    """Print p50/p95/p99 and throughput changes against a previous run"""
+    print(f"\nvs {baseline['meta'].get('git', {}).get('commit', '?')[:10]} ({baseline['meta'].get('started_at')})")
+    print(f"{'endpoint':<20}{'metric':<16}{'before':>12}{'after':>12}{'change':>10}")
+    for name, result in current["endpoints"].items():
+        before = baseline.get("endpoints", {}).get(name)
+        if not before:
+            continue
+        for metric in ("throughput_rps", "p50_ms", "p95_ms", "p99_ms"):
+            if metric in before and metric in result:
+                change = (result[metric] - before[metric]) / before[metric] * 100 if before[metric] else 0.0
+                print(f"{name:<20}{metric:<16}{before[metric]:>12}{result[metric]:>12}{change:>+9.1f}%")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--seed", type=int, default=0, help="seed the database up to this many emails first")
+    parser.add_argument("--endpoints", default=",".join(ENDPOINTS))
+    parser.add_argument("--requests", type=int, default=1000, help="requests per read endpoint")
+    parser.add_argument("--concurrency", type=int, default=50, help="concurrent clients for read endpoints")
+    parser.add_argument("--page-size", type=int, default=50)
+    parser.add_argument("--job-requests", type=int, default=10, help="sequential /fetch and /classify jobs")
+    parser.add_argument("--fetch-size", type=int, default=100)
+    parser.add_argument("--classify-limit", type=int, default=50)
+    parser.add_argument("--respond-requests", type=int, default=200)
+    parser.add_argument("--respond-concurrency", type=int, default=10)
+    parser.add_argument("--mailbox", type=int, default=2000, help="messages in the stub Gmail mailbox")
+    parser.add_argument("--gmail-latency", type=float, default=0.02, help="seconds per stub Gmail request")
+    parser.add_argument("--gmail-error-rate", type=float, default=0.0, help="share of stub Gmail requests failing with 503")
+    parser.add_argument("--llm-latency", type=float, default=0.4, help="fake LLM base latency in seconds")
+    parser.add_argument("--llm-failure-rate", type=float, default=0.0)
+    parser.add_argument("--port", type=int, default=8766)
+    parser.add_argument("--gmail-port", type=int, default=0, help="stub Gmail port (default: any free port)")
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    parser.add_argument("--compare", help="earlier results JSON to diff against")
+    args = parser.parse_args()
+
+    state = StubGmailState(args.mailbox, latency=args.gmail_latency, error_rate=args.gmail_error_rate, seed=3)
+    stub = StubGmailServer(state, port=args.gmail_port).start()
+    # Settings are read at import, so the app is imported only once the stub's address is known
+    os.environ["GMAIL_API_ROOT_URL"] = stub.root_url
+    import main as app_module
+    from benchmarks.fake_llm import FakeChatModel
+    from benchmarks.seed_data import seed
+    from config.settings import MONGO_DB
+    from services.db_service import STATE_CLASSIFIED
+    from services.mongo import get_emails_collection
+    from services.migrations import run_migrations
+
+    fake = FakeChatModel(base_latency=args.llm_latency, failure_rate=args.llm_failure_rate, seed=5)
+    install_fakes(stub, fake)
+    seeded = seed(args.seed) if args.seed else None
+    run_migrations()
+
+    # Emails to reply to, each only once
+    email_ids = [str(d["_id"]) for d in get_emails_collection().find(
+        {"classification_state": STATE_CLASSIFIED}, {"_id": 1}
+    ).sort("_id", -1).limit(args.respond_requests)]
+
+    server = uvicorn.Server(uvicorn.Config(app_module.app, port=args.port, log_level="warning", backlog=4096))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.05)
+
+    base_url = f"http://127.0.0.1:{args.port}"
+    scenarios = build_scenarios(args, state, email_ids)
+    results = {
+        "meta": {
+            "started_at": datetime.datetime.utcnow().isoformat(timespec="seconds"),
+            "git": git_revision(),
+            "python": platform.python_version(),
+            "database": MONGO_DB,
+            "emails_in_db": get_emails_collection().estimated_document_count(),
+            "seeded": seeded,
+            "config": vars(args),
+        },
+        "endpoints": {},
+    }
+    try:
+        for name in args.endpoints.split(","):
+            name = name.strip()
+            if name not in scenarios:
+                raise SystemExit(f"Unknown endpoint {name!r}; choose from {', '.join(ENDPOINTS)}")
+            fake.reset()
+            round_trips = state.round_trips
+            result = asyncio.run(run_scenario(base_url, scenarios[name]))
+            result["llm_calls"] = fake.calls
+            result["gmail_round_trips"] = state.round_trips - round_trips
+            results["endpoints"][name] = result
+            print(json.dumps({"endpoint": name, **result}))
+    finally:
+        server.should_exit = True
+        thread.join()
+        stub.stop()
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2, default=str)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+"""
+Compare Gmail round trips and wall-clock time for the per-message and batched
+fetch paths of GmailService.fetch_inbox_emails, and for
+AsyncGmailService.fetch_inbox_emails, against a local stub server.
+
+One message fails in the stub. Every mode must report it and still return
+every other message with its non-ASCII subject, sender and snippet intact,
+and the batched modes must stay within one round trip per BATCH_SIZE
+messages plus the messages.list pages. Exits non-zero if any check fails.
+
+Run from the Backend directory:
+    python -m benchmarks.bench_gmail_fetch --messages 250
+"""
+import argparse
+import asyncio
+import logging
+import math
+import sys
+import time
+
+from benchmarks.stub_gmail import StubGmailServer, StubGmailState
+from services.async_gmail_service import AsyncGmailService, LIST_PAGE_SIZE
+from services.gmail_service import BATCH_SIZE, GmailService
+
+FAILING_ID = "msg000003"
+MODES = ("per-message", "batched", "async")
+
+
+class _FailureLog(logging.Handler):
+    """Collects the ids named in the per-message failure warnings"""
+
+    def __init__(self, ids):
+        super().__init__(level=logging.WARNING)
+        self.ids = ids
+        self.reported = set()
+
+    def emit(self, record):
+        message = record.getMessage()
+        self.reported.update(msg_id for msg_id in self.ids if msg_id in message)
+
+
+async def fetch_async(root_url: str, message_count: int):
+    async with AsyncGmailService(root_url=root_url, token="stub-token") as gmail:
+        return await gmail.fetch_inbox_emails(max_results=message_count)
+
+
+def _header(message, name):
+    return next(h["value"] for h in message["payload"]["headers"] if h["name"] == name)
+
+
+def run(message_count: int, mode: str):
+    # One message fails inside the batch to show partial failures are isolated
+    state = StubGmailState(message_count=message_count, failing_ids={FAILING_ID})
+    server = StubGmailServer(state).start()
+    failure_log = _FailureLog(state.failing_ids)
+    loggers = [logging.getLogger("services.gmail_service"), logging.getLogger("services.async_gmail_service")]
+    for gmail_logger in loggers:
+        gmail_logger.addHandler(failure_log)
+    try:
+        start = time.perf_counter()
+        if mode == "async":
+            emails = asyncio.run(fetch_async(server.root_url, message_count))
+        else:
+            gmail = GmailService(service=server.build_service())
+            emails = gmail.fetch_inbox_emails(max_results=message_count, batched=mode == "batched")
+        elapsed = time.perf_counter() - start
+    finally:
+        for gmail_logger in loggers:
+            gmail_logger.removeHandler(failure_log)
+        server.stop()
+    return {
+        "mode": mode,
+        "messages": message_count,
+        "fetched": len(emails),
+        "round_trips": state.round_trips,
+        "seconds": round(elapsed, 3),
+        "expected_ids": [i for i in state.order if i not in state.failing_ids],
+        "fetched_ids": [email["id"] for email in emails],
+        "expected_fields": {i: (_header(m, "Subject"), _header(m, "From"), m["snippet"])
+                            for i, m in state.messages.items() if i not in state.failing_ids},
+        "fetched_fields": {email["id"]: (email["subject"], email["from"], email["snippet"]) for email in emails},
+        "failing_ids": sorted(state.failing_ids),
+        "reported_ids": sorted(failure_log.reported),
+    }
+
+
+def check(result) -> list:
+    """Return the failed checks for one run() result"""
+    problems = []
+    if result["fetched_ids"] != result["expected_ids"]:
+        missing = set(result["expected_ids"]) - set(result["fetched_ids"])
+        extra = set(result["fetched_ids"]) - set(result["expected_ids"])
+        problems.append(f"fetched {result['fetched']} of {len(result['expected_ids'])} good messages "
+                        f"(missing {sorted(missing)[:5]}, unexpected {sorted(extra)[:5]})")
+    mangled = [msg_id for msg_id, fields in result["fetched_fields"].items() if fields != result["expected_fields"].get(msg_id)]
+    if mangled:
+        msg_id = mangled[0]
+        problems.append(f"{len(mangled)} messages with altered subject/sender/snippet, e.g. {msg_id}: "
+                        f"{result['fetched_fields'][msg_id]!r} != {result['expected_fields'].get(msg_id)!r}")
+    if result["reported_ids"] != result["failing_ids"]:
+        problems.append(f"failed messages {result['failing_ids']} reported as {result['reported_ids']}")
+    if result["mode"] != "per-message":
+        # fetch_inbox_emails reads one messages.list page (the async client one per LIST_PAGE_SIZE ids)
+        list_pages = math.ceil(result["messages"] / LIST_PAGE_SIZE) if result["mode"] == "async" else 1
+        limit = math.ceil(result["messages"] / BATCH_SIZE) + list_pages
+        if result["round_trips"] > limit:
+            problems.append(f"{result['round_trips']} round trips, expected at most {limit}")
+    return problems
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=250)
+    args = parser.parse_args()
+
+    ok = True
+    for mode in MODES:
+        result = run(args.messages, mode)
+        problems = check(result)
+        ok = ok and not problems
+        print({key: result[key] for key in ("mode", "messages", "fetched", "round_trips", "seconds")})
+        for problem in problems:
+            print(f"[FAILED] {result['mode']}: {problem}")
+    sys.exit(0 if ok else 1)
@@ -0,0 +1,115 @@
+"""
+Per-call cost of the Prometheus instrumentation in services/metrics.py.
+
+Each probe times the same call with and without its wrapper and reports the
+difference in microseconds, so it shows what /metrics costs on the hot paths:
+
+    middleware    a trivial FastAPI route with and without MetricsMiddleware
+    mongo         a no-op function with and without @timed_mongo
+    gmail_http    InstrumentedHttp around an http object that returns at once
+    llm           FakeChatModel (no latency) with and without LLMMetricsHandler
+
+Run from the Backend directory:
+    python -m benchmarks.bench_metrics_overhead --iterations 20000
+"""
+import argparse
+import asyncio
+import json
+import time
+
+import httpx
+from fastapi import FastAPI
+
+from benchmarks.fake_llm import FakeChatModel
+from services.metrics import InstrumentedHttp, LLMMetricsHandler, MetricsMiddleware, timed_mongo
+
+
+def _per_call_us(fn, iterations: int) -> float:
+    started = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    return (time.perf_counter() - started) / iterations * 1e6
+
+
+async def _per_request_us(app, iterations: int) -> float:
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        await client.get("/items/0")
+        started = time.perf_counter()
+        for i in range(iterations):
+            await client.get(f"/items/{i}")
+        return (time.perf_counter() - started) / iterations * 1e6
+
+
+def _app(instrumented: bool) -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/items/{item_id}")
+    async def item(item_id: int):
+        return {"id": item_id}
+
+    if instrumented:
+        app.add_middleware(MetricsMiddleware)
+    return app
+
+
+class _NullHttp:
+    class _Response(dict):
+        status = 200
+
+    def request(self, uri, method="GET", *args, **kwargs):
+        return self._Response(), b"{}"
+
+
+def _noop():
+    return None
+
+
+def _result(name: str, baseline_us: float, instrumented_us: float, iterations: int) -> dict:
+    return {
+        "probe": name,
+        "iterations": iterations,
+        "baseline_us": round(baseline_us, 2),
+        "instrumented_us": round(instrumented_us, 2),
+        "overhead_us": round(instrumented_us - baseline_us, 2),
+    }
+
+
+def run(iterations: int, llm_iterations: int):
+    results = [_result(
+        "middleware", asyncio.run(_per_request_us(_app(False), iterations // 10)),
+        asyncio.run(_per_request_us(_app(True), iterations // 10)), iterations // 10,
+    )]
+
+    timed = timed_mongo(_noop)
+    results.append(_result("mongo", _per_call_us(_noop, iterations), _per_call_us(timed, iterations), iterations))
+
+    http, wrapped = _NullHttp(), InstrumentedHttp(_NullHttp())
+    url = "https://gmail.googleapis.com/gmail/v1/users/me/messages/abc"
+    results.append(_result(
+        "gmail_http", _per_call_us(lambda: http.request(url), iterations),
+        _per_call_us(lambda: wrapped.request(url), iterations), iterations,
+    ))
+
+    fake = FakeChatModel(base_latency=0, per_prompt_token=0, per_output_token=0)
+    handler = LLMMetricsHandler("bench")
+    results.append(_result(
+        "llm", _per_call_us(lambda: fake.invoke("hello"), llm_iterations),
+        _per_call_us(lambda: fake.invoke("hello", config={"callbacks": [handler]}), llm_iterations), llm_iterations,
+    ))
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=20000, help="calls per probe (a tenth for the middleware)")
+    parser.add_argument("--llm-iterations", type=int, default=2000)
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    args = parser.parse_args()
+
+    results = run(args.iterations, args.llm_iterations)
+    for result in results:
+        print(json.dumps(result))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
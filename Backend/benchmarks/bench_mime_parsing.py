@@ -0,0 +1,184 @@
+"""
+MIME body extraction and prompt compaction over a corpus of .eml files.
+
+Measures messages/sec for the format=full payload walk (against the previous
+UTF-8-only recursive walk), the format=raw parser and prompt compaction, and
+the prompt body size before (raw plain-or-HTML) and after compaction. Without
+--corpus a synthetic mix of marketing, reply-chain, notification and
+non-UTF-8 messages is used.
+
+    python -m benchmarks.bench_mime_parsing --corpus ~/mail-samples --repeat 5 --output mime.json
+"""
+import argparse
+import base64
+import email
+import glob
+import json
+import os
+import statistics
+import time
+from email.mime.application import MIMEApplication
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+
+from utils.parser import b64url_decode, extract_plain_html_from_gmail_payload, parse_raw_message, compact_email_text, CHARS_PER_TOKEN
+from config.settings import CLASSIFIER_BODY_TOKEN_BUDGET
+
+
+def legacy_extract(payload: dict):
+    """The walk this benchmark replaces: recursive, += concatenation, always UTF-8"""
+    plain = ""
+    html = ""
+    def walk(part):
+        nonlocal plain, html
+        if not part:
+            return
+        mime = part.get("mimeType", "")
+        data = part.get("body", {}).get("data")
+        if data:
+            try:
+                text = b64url_decode(data).decode("utf-8", errors="replace")
+            except Exception:
+                text = ""
+            if mime == "text/plain":
+                plain += text
+            elif mime == "text/html":
+                html += text
+            elif not plain and mime.startswith("text/"):
+                plain += text
+        for p in part.get("parts", []) or []:
+            walk(p)
+    walk(payload)
+    return plain.strip(), html.strip()
+
+
+def to_gmail_payload(part) -> dict:
+    """Shape a parsed message like a messages.get(format=full) payload"""
+    payload = {
+        "mimeType": part.get_content_type(),
+        "filename": part.get_filename() or "",
+        "headers": [{"name": k, "value": str(v)} for k, v in part.items()],
+        "body": {"size": 0},
+    }
+    if part.is_multipart():
+        payload["parts"] = [to_gmail_payload(p) for p in part.get_payload()]
+    else:
+        data = part.get_payload(decode=True) or b""
+        payload["body"] = {"size": len(data), "data": base64.urlsafe_b64encode(data).decode().rstrip("=")}
+    return payload
+
+
+def synthetic_corpus(count: int):
+    tracking = "https://click.example-mail.com/ls/click?upn=" + "aB3xY9" * 30
+    marketing_html = (
+        "<html><head><style>.x{color:red}</style></head><body>"
+        "<div style='display:none'>" + "&#847;&zwnj;&nbsp;" * 80 + "</div>"
+        "<table><tr><td><h1>Autumn Sale — 40% off</h1></td></tr>"
+        "<tr><td><p>Hi Jürgen, our biggest sale of the season starts now.</p>"
+        f"<a href='{tracking}'>Shop now</a><img src='{tracking}' width=1 height=1></td></tr>"
+        "<tr><td><p>You are receiving this email because you signed up at example.com.</p>"
+        f"<p><a href='{tracking}'>Unsubscribe</a> | <a href='{tracking}'>Manage preferences</a></p>"
+        "<p>© 2024 Example Inc. All rights reserved.</p></td></tr></table></body></html>"
+    )
+    quoted = "\n".join(f"> Earlier line {i} of the thread with some detail." for i in range(40))
+    reply_plain = (
+        "Thanks, Thursday works for me. I'll bring the draft budget.\n\n"
+        "-- \nAlex Doe\nHead of Operations | Example Corp\n+1 555 0100\n\n"
+        "On Mon, 7 Oct 2024 at 09:12, Sam Roe <sam@example.com>\nwrote:\n" + quoted
+    )
+    outlook_html = (
+        "<div>Approved, please go ahead.</div><div>Regards,<br>Pat</div>"
+        "<div id=\"divRplyFwdMsg\"><b>From:</b> Ops<br><b>Sent:</b> Monday<br>"
+        + "<p>Original request text repeated for context.</p>" * 60 + "</div>"
+    )
+    notification = (
+        "Your build #4521 failed on main.\n\n"
+        f"View the logs: {tracking}\n\n"
+        "You are receiving this because you are subscribed to this repository.\n"
+        f"Unsubscribe: {tracking}"
+    )
+
+    def build(i):
+        kind = i % 5
+        if kind == 0:
+            msg = MIMEMultipart("alternative")
+            msg.attach(MIMEText(marketing_html, "html", "windows-1252" if i % 2 else "utf-8"))
+        elif kind == 1:
+            msg = MIMEText(reply_plain, "plain", "utf-8")
+        elif kind == 2:
+            msg = MIMEMultipart("alternative")
+            msg.attach(MIMEText("Approved, please go ahead.\n\nRegards,\nPat", "plain", "us-ascii"))
+            msg.attach(MIMEText(outlook_html, "html", "utf-8"))
+        elif kind == 3:
+            msg = MIMEMultipart("mixed")
+            msg.attach(MIMEText(notification, "plain", "utf-8"))
+            msg.attach(MIMEApplication(os.urandom(20000), Name="report.pdf"))
+        else:
+            msg = MIMEText("会議は木曜日の午後三時に変更になりました。よろしくお願いします。", "plain", "iso-2022-jp")
+        msg["Subject"] = f"Message {i}"
+        msg["From"] = "Sender <sender@example.com>"
+        return msg.as_bytes()
+
+    return [build(i) for i in range(count)]
+
+
+def load_corpus(path: str):
+    files = sorted(glob.glob(os.path.join(os.path.expanduser(path), "**", "*.eml"), recursive=True))
+    samples = []
+    for name in files:
+        with open(name, "rb") as f:
+            samples.append(f.read())
+    return samples
+
+
+def throughput(fn, items, repeat):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        for item in items:
+            fn(item)
+    return round(len(items) * repeat / (time.perf_counter() - started), 1)
+
+
+def tokens(text: str) -> int:
+    return len(text) // CHARS_PER_TOKEN
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--corpus", help="directory searched recursively for .eml files")
+    parser.add_argument("--synthetic", type=int, default=500, help="synthetic messages when no corpus is given")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--token-budget", type=int, default=CLASSIFIER_BODY_TOKEN_BUDGET)
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    args = parser.parse_args()
+
+    samples = load_corpus(args.corpus) if args.corpus else synthetic_corpus(args.synthetic)
+    if not samples:
+        raise SystemExit(f"No .eml files found under {args.corpus}")
+    payloads = [to_gmail_payload(email.message_from_bytes(raw)) for raw in samples]
+    raws = [base64.urlsafe_b64encode(raw).decode().rstrip("=") for raw in samples]
+    bodies = [extract_plain_html_from_gmail_payload(p) for p in payloads]
+
+    before = [tokens(plain or html) for plain, html in bodies]
+    after = [tokens(compact_email_text(plain, html, args.token_budget)) for plain, html in bodies]
+    results = {
+        "messages": len(samples),
+        "source": args.corpus or "synthetic",
+        "full_payload_legacy_msgs_per_sec": throughput(legacy_extract, payloads, args.repeat),
+        "full_payload_msgs_per_sec": throughput(extract_plain_html_from_gmail_payload, payloads, args.repeat),
+        "raw_msgs_per_sec": throughput(parse_raw_message, raws, args.repeat),
+        "compact_msgs_per_sec": throughput(lambda b: compact_email_text(b[0], b[1], args.token_budget), bodies, args.repeat),
+        "body_tokens_before_mean": round(statistics.mean(before), 1),
+        "body_tokens_after_mean": round(statistics.mean(after), 1),
+        "body_tokens_before_total": sum(before),
+        "body_tokens_after_total": sum(after),
+        "token_reduction_pct": round(100 * (1 - sum(after) / max(1, sum(before))), 1),
+    }
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
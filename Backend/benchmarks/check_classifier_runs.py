@@ -0,0 +1,64 @@
+"""
+Check that back-to-back classify_unclassified_emails() calls in one process
+both classify their emails.
+
+Gemini's async client stays bound to the event loop of its first call, so a
+run on a new loop fails every LLM call and leaves its emails pending while
+still returning normally. FakeChatModel(loop_bound=True) fails the same way.
+The check inserts its own pending emails; point it at a scratch database:
+
+    MONGO_DB=email_bench python -m benchmarks.check_classifier_runs --runs 3
+
+Exits non-zero if any run leaves emails unclassified.
+"""
+import argparse
+import datetime
+import sys
+import uuid
+
+from benchmarks.fake_llm import FakeChatModel
+from services import classifier
+from services.db_service import iter_sanitized_emails, bulk_upsert_docs
+from services.migrations import run_migrations
+
+
+def insert_pending(count: int):
+    # Unique text per email so nothing is answered from the classification cache; newest first in the pending query
+    tag = uuid.uuid4().hex[:12]
+    now = datetime.datetime.utcnow()
+    raw = [{
+        "id": f"check{tag}{i:04d}",
+        "threadId": f"checkthr{tag}{i:04d}",
+        "from": f"Check Sender <sender{i}@example.com>",
+        "to": "me@example.com",
+        "subject": f"Quarterly numbers {tag}-{i}",
+        "snippet": f"Could you confirm the figures for {tag}-{i} before Friday?",
+        "body_plain": f"Hi,\n\nCould you confirm the figures for {tag}-{i} before Friday?\n\nThanks",
+        "labels": ["INBOX"],
+        "date": now + datetime.timedelta(days=1, seconds=i),
+    } for i in range(count)]
+    bulk_upsert_docs(list(iter_sanitized_emails(raw)))
+
+
+def run(runs: int, emails: int, batch_size: int) -> bool:
+    run_migrations()
+    fake = FakeChatModel(base_latency=0.01, per_output_token=0, seed=1, loop_bound=True)
+    classifier.llm = fake
+    ok = True
+    for n in range(1, runs + 1):
+        insert_pending(emails)
+        calls = fake.calls
+        classified = classifier.classify_unclassified_emails(limit=emails, requests_per_minute=0, batch_size=batch_size)
+        passed = len(classified) == emails and fake.calls > calls
+        ok = ok and passed
+        print(f"[CHECK] run {n}: {len(classified)}/{emails} classified, {fake.calls - calls} LLM calls -> {'ok' if passed else 'FAILED'}")
+    return ok
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=2)
+    parser.add_argument("--emails", type=int, default=10, help="pending emails inserted and classified per run")
+    parser.add_argument("--batch-size", type=int, default=5)
+    args = parser.parse_args()
+    sys.exit(0 if run(args.runs, args.emails, args.batch_size) else 1)
@@ -0,0 +1,156 @@
+import asyncio
+import json
+import random
+import re
+import threading
+import time
+from typing import Any, List, Optional
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+from config.settings import CATEGORIES
+
+BATCH_MARKER = "Emails (JSON):"
+SINGLE_SUBJECT = re.compile(r"- Subject: (.*)")
+# Streamed output is emitted in word-sized pieces
+STREAM_PIECE = re.compile(r"\S+\s*")
+
+
+class FakeLLMError(Exception):
+    """Simulated provider failure (quota, 5xx, timeout)"""
+
+
+class FakeChatModel(BaseChatModel):
+    """
+    Offline stand-in for ChatGoogleGenerativeAI.
+
+    Latency is modelled as a fixed base plus per-token costs for the prompt and
+    the generated output, so batching and prompt size show up in wall-clock time
+    the same way they do against Gemini. With `loop_bound` set, async calls fail
+    once the event loop of the first one is gone, like Gemini's grpc-aio client.
+    """
+
+    base_latency: float = 0.4
+    per_prompt_token: float = 0.00005
+    per_output_token: float = 0.004
+    failure_rate: float = 0.0
+    drop_rate: float = 0.0
+    seed: Optional[int] = None
+    loop_bound: bool = False
+    calls: int = 0
+
+    _rng: Any = None
+    _lock: Any = None
+    _loop: Any = None
+
+    def model_post_init(self, __context: Any) -> None:
+        self._rng = random.Random(self.seed)
+        self._lock = threading.Lock()
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-chat"
+
+    def reset(self):
+        with self._lock:
+            self.calls = 0
+
+    def _classification(self, message_id=None, text=""):
+        category = CATEGORIES[sum(map(ord, text)) % len(CATEGORIES)] if text else CATEGORIES[0]
+        item = {
+            "category": category,
+            "confidence": round(0.6 + self._rng.random() * 0.4, 2),
+            "reasoning": "Synthetic classification from the fake model.",
+            "summary": f"Synthetic summary of: {text[:60]}",
+        }
+        if message_id is not None:
+            item = {"provider_message_id": message_id, **item}
+        return item
+
+    def _respond(self, prompt: str) -> str:
+        if BATCH_MARKER in prompt:
+            emails = json.loads(prompt.split(BATCH_MARKER, 1)[1])
+            items = [
+                self._classification(e["provider_message_id"], e.get("subject", ""))
+                for e in emails
+                if self._rng.random() >= self.drop_rate
+            ]
+            return "```json\n" + json.dumps(items) + "\n```"
+        if "classification agent" in prompt:
+            match = SINGLE_SUBJECT.search(prompt)
+            return json.dumps(self._classification(text=match.group(1) if match else ""))
+        return (
+            "Thank you for your email. I have reviewed your message and will follow up "
+            "with the requested details shortly. Please let me know if anything else is needed."
+        )
+
+    def _prepare(self, messages: List[BaseMessage]):
+        prompt = "\n".join(str(m.content) for m in messages)
+        with self._lock:
+            self.calls += 1
+            fail = self._rng.random() < self.failure_rate
+            content = None if fail else self._respond(prompt)
+        prompt_tokens = len(prompt) // 4 + 1
+        output_tokens = len(content or "") // 4 + 1
+        latency = self.base_latency + prompt_tokens * self.per_prompt_token + output_tokens * self.per_output_token
+        return content, latency, prompt_tokens, output_tokens
+
+    @staticmethod
+    def _result(content, prompt_tokens, output_tokens) -> ChatResult:
+        if content is None:
+            raise FakeLLMError("simulated LLM failure")
+        message = AIMessage(
+            content=content,
+            usage_metadata={
+                "input_tokens": prompt_tokens,
+                "output_tokens": output_tokens,
+                "total_tokens": prompt_tokens + output_tokens,
+            },
+        )
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        content, latency, prompt_tokens, output_tokens = self._prepare(messages)
+        time.sleep(latency)
+        return self._result(content, prompt_tokens, output_tokens)
+
+    def _check_loop(self):
+        if not self.loop_bound:
+            return
+        loop = asyncio.get_running_loop()
+        if self._loop is None:
+            self._loop = loop
+        elif self._loop is not loop:
+            raise RuntimeError("Event loop is closed")
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        self._check_loop()
+        content, latency, prompt_tokens, output_tokens = self._prepare(messages)
+        await asyncio.sleep(latency)
+        return self._result(content, prompt_tokens, output_tokens)
+
+    def _stream_pieces(self, messages):
+        content, latency, prompt_tokens, output_tokens = self._prepare(messages)
+        if content is None:
+            raise FakeLLMError("simulated LLM failure")
+        pieces = STREAM_PIECE.findall(content)
+        # Time to first token is the fixed and prompt cost; output tokens then arrive one piece at a time
+        first = latency - output_tokens * self.per_output_token
+        per_piece = output_tokens * self.per_output_token / max(1, len(pieces))
+        return pieces, first, per_piece
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        pieces, first, per_piece = self._stream_pieces(messages)
+        time.sleep(first)
+        for piece in pieces:
+            time.sleep(per_piece)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=piece))
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        pieces, first, per_piece = self._stream_pieces(messages)
+        await asyncio.sleep(first)
+        for piece in pieces:
+            await asyncio.sleep(per_piece)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=piece))
@@ -0,0 +1,189 @@
+"""
+Seed Mongo with synthetic but realistically shaped mail for benchmarks.
+
+Emails go through the normal ingest path (sanitize, body store, counters,
+thread marks), so a seeded database looks like one filled by /fetch: threads
+of several messages, a category mix with per-category subjects and senders,
+bodies of varying length (HTML for marketing), a share left unclassified for
+/classify and sent replies in `responses`. Point it at a scratch database:
+
+    MONGO_DB=email_bench python -m benchmarks.seed_data --count 100000
+    MONGO_DB=email_bench python -m benchmarks.seed_data --count 1000000 --drop
+"""
+import argparse
+import datetime
+import random
+import time
+from typing import Any, Dict, Iterator, Tuple
+
+from pymongo import InsertOne
+
+from services.db_service import iter_sanitized_emails, bulk_upsert_docs, STATE_CLASSIFIED
+from services.mongo import get_db, get_emails_collection, get_responses_collection
+from services.migrations import run_migrations
+from services.stats_service import record_response_sent, reconcile_stats
+from config.settings import MONGO_DB
+
+# category -> (share of mail, senders, subject templates)
+PROFILES = {
+    "Work / Professional": (0.30, ["{name} <{user}@corp.example.com>", "{name} <{user}@partner.example.io>"],
+                            ["Re: Q{n} roadmap review", "Contract draft v{n}", "Notes from Thursday's sync", "Re: Re: hiring plan ({n})"]),
+    "Personal": (0.10, ["{name} <{user}@gmail.example.com>", "{name} <{user}@family.example.org>"],
+                 ["Dinner on Saturday?", "Photos from the trip", "Re: Birthday plans"]),
+    "Finance / Bills": (0.15, ["Billing <billing@payments.example.net>", "Bank <alerts@bank.example.com>"],
+                        ["Invoice #{n} is ready", "Your statement for {month}", "Payment received: ${n}.00"]),
+    "Promotions / Marketing": (0.25, ["Deals <news@shop{k}.example.org>", "Offers <hello@brand{k}.example.com>"],
+                               ["Flash sale: {n}% off this weekend", "New arrivals picked for you", "Last chance: free shipping ends tonight"]),
+    "Notifications / Updates": (0.20, ["GitHub <notifications@github.example.com>", "Calendar <calendar@example.com>"],
+                                ["[repo] Build #{n} failed on main", "Reminder: review due tomorrow", "New sign-in from Chrome on Linux"]),
+}
+NAMES = ["Alex Doe", "Sam Roe", "Priya Shah", "Chen Wei", "Maria Garcia", "Tom Becker", "Aisha Bello", "Jonas Berg"]
+SENTENCES = [
+    "Following up on the points we discussed earlier this week.",
+    "Could you confirm the figures before Friday so we can close this out?",
+    "The attached summary covers the open items, owners and due dates.",
+    "Let me know if the proposed time works for you or suggest another slot.",
+    "We shipped the fix yesterday and are watching the error rates.",
+    "Thanks again for the quick turnaround on this.",
+    "Please review the changes and leave comments by end of day.",
+    "I have copied the finance team so they can process the invoice.",
+]
+MONTHS = ["January", "February", "March", "April", "May", "June", "July", "August", "September", "October", "November", "December"]
+
+
+def _body(rng: random.Random, category: str) -> Tuple[str, str]:
+    # Log-normal lengths: mostly short mail with a long tail of big threads and newsletters
+    sentences = max(1, min(400, int(rng.lognormvariate(2.0, 0.9))))
+    text = " ".join(rng.choice(SENTENCES) for _ in range(sentences))
+    if category == "Promotions / Marketing":
+        html = (
+            "<html><body><table><tr><td>"
+            + "".join(f"<p style='font-family:Arial'>{rng.choice(SENTENCES)}</p>" for _ in range(sentences))
+            + "<a href='https://click.example.com/ls?u=" + "x" * 120 + "'>Unsubscribe</a></td></tr></table></body></html>"
+        )
+        return "", html
+    if category == "Work / Professional" and rng.random() < 0.5:
+        text += "\n\nOn Mon, someone wrote:\n" + "\n".join(f"> {rng.choice(SENTENCES)}" for _ in range(sentences))
+    return text, ""
+
+
+def generate_emails(count: int, classified_ratio: float, thread_size: int, rng_seed: int, start_index: int = 0) -> Iterator[Dict[str, Any]]:
+    """Yield Gmail-shaped raw emails, `thread_size` consecutive messages sharing a thread on average"""
+    rng = random.Random(rng_seed + start_index)
+    categories = list(PROFILES)
+    weights = [PROFILES[c][0] for c in categories]
+    start = datetime.datetime(2024, 1, 1)
+    thread_id, category, subject = None, None, None
+    for i in range(start_index, start_index + count):
+        if thread_id is None or rng.random() < 1 / max(1, thread_size):
+            thread_id = f"seedthr{i:08d}"
+            category = rng.choices(categories, weights)[0]
+            subject = rng.choice(PROFILES[category][2]).format(n=rng.randrange(1, 999), month=rng.choice(MONTHS))
+        sender = rng.choice(PROFILES[category][1]).format(
+            name=rng.choice(NAMES), user=f"user{rng.randrange(2000)}", k=rng.randrange(40)
+        )
+        plain, html = _body(rng, category)
+        raw = {
+            "id": f"seed{i:08d}",
+            "threadId": thread_id,
+            "from": sender,
+            "to": "me@example.com",
+            "subject": subject,
+            "snippet": (plain or rng.choice(SENTENCES))[:140],
+            "body_plain": plain,
+            "body_html": html,
+            "labels": ["INBOX"] + (["UNREAD"] if rng.random() < 0.4 else []) + (["CATEGORY_PROMOTIONS"] if html else []),
+            "headers": {"List-Unsubscribe": "<https://example.com/unsubscribe>"} if html else {},
+            "date": start + datetime.timedelta(seconds=i * 31 + rng.randrange(30)),
+        }
+        if rng.random() < classified_ratio:
+            raw["classifications"] = {
+                "category": category,
+                "confidence": round(0.55 + rng.random() * 0.45, 3),
+                "reasoning": "seeded",
+                "summary": f"Seeded {category.lower()} email: {subject}",
+                "tier": rng.choice(["rules", "local", "cache", "llm"]),
+            }
+        yield raw
+
+
+def _seed_responses(count: int, start_index: int, rng_seed: int, chunk: int):
+    """Sent replies for classified emails seeded in this run, shaped like the send queue writes them"""
+    rng = random.Random(rng_seed + start_index)
+    emails = get_emails_collection().find(
+        {"provider_message_id": {"$regex": "^seed", "$gte": f"seed{start_index:08d}"}, "classification_state": STATE_CLASSIFIED},
+        {"thread_id": 1, "from": 1, "subject": 1, "date": 1}
+    ).limit(count)
+    ops = []
+    for email in emails:
+        sent_at = (email.get("date") or datetime.datetime.utcnow()) + datetime.timedelta(minutes=rng.randrange(5, 600))
+        ops.append(InsertOne({
+            "email_id": str(email["_id"]),
+            "thread_id": email.get("thread_id"),
+            "to": email.get("from"),
+            "from": "me@example.com",
+            "subject": "Re: " + (email.get("subject") or "No Subject"),
+            "body": " ".join(rng.choice(SENTENCES) for _ in range(4)),
+            "status": "sent",
+            "edited_by_human": rng.random() < 0.3,
+            "created_at": sent_at,
+            "sent_at": sent_at,
+            "gmail_response": {"id": f"seedsent{email['_id']}", "labelIds": ["SENT"]},
+        }))
+        if len(ops) >= chunk:
+            get_responses_collection().bulk_write(ops, ordered=False)
+            record_response_sent(len(ops))
+            ops = []
+    if ops:
+        get_responses_collection().bulk_write(ops, ordered=False)
+        record_response_sent(len(ops))
+
+
+def seed(count: int, classified_ratio: float = 0.7, responded_ratio: float = 0.05, thread_size: int = 3,
+         chunk: int = 5000, rng_seed: int = 7, drop: bool = False) -> Dict[str, Any]:
+    """Top the database up to `count` seeded emails; returns what was added"""
+    if drop:
+        get_db().client.drop_database(MONGO_DB)
+    # Indexes first: the ingest path upserts by (provider, provider_message_id)
+    run_migrations()
+    existing = get_emails_collection().count_documents({"provider_message_id": {"$regex": "^seed"}})
+    missing = max(0, count - existing)
+
+    started = time.perf_counter()
+    batch = []
+    added = 0
+    for doc in iter_sanitized_emails(generate_emails(missing, classified_ratio, thread_size, rng_seed, existing)):
+        batch.append(doc)
+        if len(batch) >= chunk:
+            added += bulk_upsert_docs(batch)["upserted_count"]
+            batch = []
+            print(f"[SEED] {existing + added}/{count} emails ({added / (time.perf_counter() - started):.0f}/s)")
+    if batch:
+        added += bulk_upsert_docs(batch)["upserted_count"]
+
+    responses = int(missing * classified_ratio * responded_ratio)
+    _seed_responses(responses, existing, rng_seed, chunk)
+    drift = reconcile_stats()
+    result = {
+        "database": MONGO_DB,
+        "emails_added": added,
+        "emails_total": existing + added,
+        "responses_added": responses,
+        "seconds": round(time.perf_counter() - started, 1),
+        "stats_drift": drift,
+    }
+    print(f"[SEED] {result}")
+    return result
+
+
+# Run Script
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--count", type=int, default=10000, help="seeded emails the database should hold")
+    parser.add_argument("--classified-ratio", type=float, default=0.7)
+    parser.add_argument("--responded-ratio", type=float, default=0.05, help="share of classified emails with a sent reply")
+    parser.add_argument("--thread-size", type=int, default=3, help="mean messages per thread")
+    parser.add_argument("--chunk", type=int, default=5000)
+    parser.add_argument("--drop", action="store_true", help="drop the whole MONGO_DB database first")
+    args = parser.parse_args()
+    seed(args.count, args.classified_ratio, args.responded_ratio, args.thread_size, args.chunk, drop=args.drop)
@@ -0,0 +1,384 @@
+"""
+Local HTTP server speaking the subset of the Gmail REST API the backend uses:
+messages.list (including rfc822msgid and has:attachment searches), messages.get
+in metadata, full and raw formats, messages.attachments.get, messages.send,
+users.getProfile, users.history.list and batch requests. Per-request latency and a transient error rate can be injected.
+
+Standalone, for pointing a running backend at it (GMAIL_API_ROOT_URL):
+    python -m benchmarks.stub_gmail --port 8089 --messages 5000 --latency 0.05
+"""
+import argparse
+import base64
+import email
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+import httplib2
+import requests
+from googleapiclient.discovery import build_from_document
+from googleapiclient.discovery_cache import get_static_doc
+
+MESSAGE_PATH = re.compile(r"^/gmail/v1/users/me/messages/([^/?]+)$")
+ATTACHMENT_PATH = re.compile(r"^/gmail/v1/users/me/messages/([^/?]+)/attachments/([^/?]+)$")
+API_PATH = "/gmail/v1/users/me"
+
+SENDERS = [
+    "Alex Doe <alex@example.com>", "Billing <billing@payments.example.net>", "Deals <news@shop.example.org>",
+    "GitHub <notifications@github.example.com>", "Sam Roe <sam.roe@partner.example.io>", "Zoë Müller <zoe@family.example.com>",
+]
+SUBJECTS = [
+    "Re: Q{n} planning notes", "Invoice #{n} is ready", "Flash sale: {n}% off this weekend",
+    "[repo] Build #{n} failed on main", "Contract draft v{n}", "Dîner au café samedi ?",
+]
+BODY_SENTENCES = [
+    "Following up on the points we discussed earlier this week.",
+    "Could you confirm the figures before Friday?",
+    "The attached summary covers the open items and owners.",
+    "Let me know if the proposed time works for you.",
+    "You are receiving this email because you subscribed to updates.",
+    "Thanks again for the quick turnaround on this.",
+    "Merci — à bientôt, café ☕ on me.",
+]
+
+
+class StubGmailState:
+    """In-memory mailbox served by the stub server"""
+
+    def __init__(self, message_count=250, failing_ids=None, latency=0.0, error_rate=0.0, seed=None, thread_size=3,
+                 attachment_every=0, attachment_bytes=2048):
+        self.messages = {}
+        self.order = []
+        self.failing_ids = set(failing_ids or [])
+        # Seconds added to every HTTP request, and the share of requests answered with a 503
+        self.latency = latency
+        self.error_rate = error_rate
+        self.thread_size = max(1, thread_size)
+        # Every attachment_every-th message carries one attachment; three distinct contents, so copies dedupe
+        self.attachment_every = attachment_every
+        self.attachment_bytes = attachment_bytes
+        self.attachments = {}
+        self.round_trips = 0
+        self.sent = {}
+        self.history = []
+        self.history_id = 1000
+        self.lock = threading.Lock()
+        self._rng = random.Random(seed)
+        for i in range(message_count):
+            self.add_message(f"msg{i:06d}")
+
+    def _text(self, n):
+        return " ".join(BODY_SENTENCES[(n + k) % len(BODY_SENTENCES)] for k in range(3 + n % 12))
+
+    def add_message(self, msg_id, thread_id=None, labels=None):
+        with self.lock:
+            n = len(self.messages)
+            subject = SUBJECTS[n % len(SUBJECTS)].format(n=n)
+            plain = self._text(n)
+            headers = [
+                {"name": "Subject", "value": subject},
+                {"name": "From", "value": SENDERS[n % len(SENDERS)]},
+                {"name": "To", "value": "me@example.com"},
+                {"name": "Date", "value": "Fri, 13 Sep 2024 09:20:00 +0000"},
+                {"name": "Message-ID", "value": f"<{msg_id}@stub.example.com>"},
+            ]
+            if n % len(SUBJECTS) == 2:
+                headers.append({"name": "List-Unsubscribe", "value": "<https://shop.example.org/unsubscribe>"})
+            self.messages[msg_id] = {
+                "id": msg_id,
+                "threadId": thread_id or f"thr{n // self.thread_size:06d}",
+                "labelIds": labels or ["INBOX", "UNREAD"],
+                "snippet": plain[:120],
+                "internalDate": str(1726219200000 + n * 60000),
+                "sizeEstimate": len(plain) * 2,
+                "payload": {
+                    "mimeType": "multipart/alternative",
+                    "headers": headers,
+                    "body": {"size": 0},
+                    "parts": [
+                        {"mimeType": "text/plain", "headers": [{"name": "Content-Type", "value": "text/plain; charset=UTF-8"}],
+                         "body": {"size": len(plain), "data": _b64(plain.encode())}},
+                        {"mimeType": "text/html", "headers": [{"name": "Content-Type", "value": "text/html; charset=UTF-8"}],
+                         "body": {"size": len(plain) + 13, "data": _b64(f"<div>{plain}</div>".encode())}},
+                    ],
+                },
+            }
+            if self.attachment_every and n % self.attachment_every == 0:
+                data = (f"attachment {n % 3} ".encode() * self.attachment_bytes)[:self.attachment_bytes]
+                self.attachments[(msg_id, f"att{n:06d}")] = data
+                self.messages[msg_id]["payload"]["parts"].append({
+                    "mimeType": "application/pdf", "filename": f"report-{n}.pdf",
+                    "body": {"size": len(data), "attachmentId": f"att{n:06d}"},
+                })
+            self.order.insert(0, msg_id)
+            self._record_history(msg_id, labels or ["INBOX", "UNREAD"])
+
+    def add_messages(self, count):
+        """Deliver `count` new messages, as if they arrived since the last fetch"""
+        start = len(self.messages)
+        for i in range(count):
+            self.add_message(f"msg{start + i:06d}")
+
+    def _record_history(self, msg_id, labels):
+        self.history_id += 1
+        message = {"id": msg_id, "threadId": self.messages[msg_id]["threadId"], "labelIds": labels}
+        self.history.append({"id": str(self.history_id), "messages": [message], "messagesAdded": [{"message": message}]})
+
+    def count_round_trip(self):
+        with self.lock:
+            self.round_trips += 1
+
+    def inject(self):
+        """Apply the configured latency; True if this request should fail transiently"""
+        if self.latency:
+            time.sleep(self.latency)
+        with self.lock:
+            return self.error_rate > 0 and self._rng.random() < self.error_rate
+
+    def _render(self, message, fmt):
+        if fmt == "raw":
+            payload = message["payload"]
+            mime = MIMEMultipart("alternative")
+            for header in payload["headers"]:
+                mime[header["name"]] = header["value"]
+            for part in payload["parts"]:
+                if "data" not in part["body"]:
+                    continue
+                mime.attach(MIMEText(_unb64(part["body"]["data"]).decode(), part["mimeType"].split("/")[1], "utf-8"))
+            rendered = {k: v for k, v in message.items() if k != "payload"}
+            rendered["raw"] = _b64(mime.as_bytes())
+            return rendered
+        if fmt == "metadata":
+            payload = message["payload"]
+            return {**message, "payload": {"mimeType": payload["mimeType"], "headers": payload["headers"]}}
+        return message
+
+    def _send_message(self, body):
+        raw = _unb64(json.loads(body or "{}").get("raw", ""))
+        parsed = email.message_from_bytes(raw)
+        with self.lock:
+            msg_id = f"sent{len(self.sent):06d}"
+            self.sent[msg_id] = {
+                "id": msg_id,
+                "threadId": f"thr{msg_id}",
+                "labelIds": ["SENT"],
+                "message_id": (parsed.get("Message-ID") or "").strip("<>"),
+                "to": parsed.get("To"),
+                "subject": parsed.get("Subject"),
+            }
+        return 200, {"id": msg_id, "threadId": f"thr{msg_id}", "labelIds": ["SENT"]}
+
+    def _list_history(self, query):
+        start = int(query.get("startHistoryId", ["0"])[0])
+        with self.lock:
+            oldest = int(self.history[0]["id"]) if self.history else self.history_id
+            if start < oldest - 1:
+                return 404, {"error": {"code": 404, "message": "Requested entity was not found."}}
+            records = [r for r in self.history if int(r["id"]) > start]
+            return 200, {"history": records, "historyId": str(self.history_id)}
+
+    def handle(self, method, path, query, body=None):
+        """Return (status, json body) for a single Gmail API call"""
+        if method == "GET" and path == f"{API_PATH}/messages":
+            search = query.get("q", [""])[0]
+            if search.startswith("rfc822msgid:"):
+                wanted = search.split(":", 1)[1]
+                found = [{"id": m["id"], "threadId": m["threadId"]} for m in self.sent.values() if m["message_id"] == wanted]
+                return 200, {"messages": found, "resultSizeEstimate": len(found)} if found else {"resultSizeEstimate": 0}
+            max_results = int(query.get("maxResults", ["100"])[0])
+            start = int(query.get("pageToken", ["0"])[0])
+            order = self.order
+            if search == "has:attachment":
+                with_attachments = {msg_id for msg_id, _ in self.attachments}
+                order = [i for i in self.order if i in with_attachments]
+            ids = order[start:start + max_results]
+            body = {"messages": [{"id": i, "threadId": self.messages[i]["threadId"]} for i in ids]}
+            if start + max_results < len(order):
+                body["nextPageToken"] = str(start + max_results)
+            return 200, body
+
+        if method == "POST" and path == f"{API_PATH}/messages/send":
+            return self._send_message(body)
+
+        if method == "GET" and path == f"{API_PATH}/profile":
+            return 200, {"emailAddress": "me@example.com", "messagesTotal": len(self.messages), "historyId": str(self.history_id)}
+
+        if method == "GET" and path == f"{API_PATH}/history":
+            return self._list_history(query)
+
+        match = ATTACHMENT_PATH.match(path)
+        if method == "GET" and match:
+            data = self.attachments.get(match.groups())
+            if data is None or match.group(1) in self.failing_ids:
+                return 404, {"error": {"code": 404, "message": "Requested entity was not found."}}
+            return 200, {"size": len(data), "data": _b64(data)}
+
+        match = MESSAGE_PATH.match(path)
+        if method == "GET" and match:
+            msg_id = match.group(1)
+            if msg_id in self.failing_ids or msg_id not in self.messages:
+                return 404, {"error": {"code": 404, "message": "Requested entity was not found."}}
+            return 200, self._render(self.messages[msg_id], query.get("format", ["full"])[0])
+
+        return 404, {"error": {"code": 404, "message": f"No stub for {method} {path}"}}
+
+
+def _b64(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).decode().rstrip("=")
+
+
+def _unb64(data: str) -> bytes:
+    return base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))
+
+
+def _split_batch(body, boundary):
+    """Yield (content_id, method, path, query) for every part of a batch request"""
+    for part in body.split("--" + boundary):
+        part = part.strip()
+        if not part or part == "--":
+            continue
+        part_headers, _, http_request = part.partition("\n\n")
+        content_id = re.search(r"Content-ID: <(.*)>", part_headers, re.IGNORECASE).group(1)
+        request_line = http_request.strip().splitlines()[0]
+        method, url, _ = request_line.split(" ", 2)
+        parsed = urlparse(url)
+        yield content_id, method, parsed.path, parse_qs(parsed.query)
+
+
+def make_handler(state):
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def _send(self, status, payload, content_type="application/json"):
+            data = payload if isinstance(payload, bytes) else json.dumps(payload, ensure_ascii=False).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _unavailable(self):
+            self._send(503, {"error": {"code": 503, "message": "The service is currently unavailable."}})
+
+        def do_GET(self):
+            state.count_round_trip()
+            if state.inject():
+                return self._unavailable()
+            parsed = urlparse(self.path)
+            status, body = state.handle("GET", parsed.path, parse_qs(parsed.query))
+            self._send(status, body)
+
+        def do_POST(self):
+            state.count_round_trip()
+            length = int(self.headers.get("Content-Length", 0))
+            raw = self.rfile.read(length).decode("utf-8")
+            if state.inject():
+                return self._unavailable()
+            parsed = urlparse(self.path)
+
+            if parsed.path not in ("/batch", "/batch/gmail/v1"):
+                status, body = state.handle("POST", parsed.path, parse_qs(parsed.query), raw)
+                return self._send(status, body)
+
+            boundary = re.search(r'boundary="?([^";]+)"?', self.headers["Content-Type"]).group(1)
+            raw = raw.replace("\r\n", "\n")
+            out_boundary = f"batch_{uuid.uuid4().hex}"
+            parts = []
+            for content_id, method, path, query in _split_batch(raw, boundary):
+                status, body = state.handle(method, path, query)
+                reason = "OK" if status == 200 else "Not Found"
+                parts.append(
+                    f"--{out_boundary}\r\n"
+                    f"Content-Type: application/http\r\n"
+                    f"Content-ID: <response-{content_id}>\r\n\r\n"
+                    f"HTTP/1.1 {status} {reason}\r\n"
+                    f"Content-Type: application/json; charset=UTF-8\r\n\r\n"
+                    f"{json.dumps(body, ensure_ascii=False)}\r\n"
+                )
+            payload = ("".join(parts) + f"--{out_boundary}--\r\n").encode()
+            self._send(200, payload, content_type=f"multipart/mixed; boundary={out_boundary}")
+
+    return Handler
+
+
+class StubGmailServer:
+    """Local HTTP server speaking the subset of the Gmail REST API we use"""
+
+    def __init__(self, state=None, host="127.0.0.1", port=0):
+        self.state = state or StubGmailState()
+        self.httpd = ThreadingHTTPServer((host, port), make_handler(self.state))
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    @property
+    def root_url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/"
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def build_service(self):
+        """Build a googleapiclient Gmail service whose rootUrl (and batch URI) is this server"""
+        doc = json.loads(get_static_doc("gmail", "v1"))
+        doc["rootUrl"] = self.root_url
+        doc["baseUrl"] = self.root_url + doc["servicePath"]
+        return build_from_document(json.dumps(doc), http=httplib2.Http())
+
+
+class _StubCredentials:
+    token = "stub-token"
+    valid = True
+
+
+class StubGmailClient:
+    """
+    Stand-in for GmailClientManager that talks to a StubGmailServer without
+    OAuth; install it as services.gmail_client._manager.
+    """
+
+    def __init__(self, server: StubGmailServer):
+        self.server = server
+        self._local = threading.local()
+
+    def credentials(self):
+        return _StubCredentials()
+
+    def service(self):
+        # Like the real manager, one service per thread (httplib2 is not thread-safe)
+        service = getattr(self._local, "service", None)
+        if service is None:
+            service = self._local.service = self.server.build_service()
+        return service
+
+    def session(self):
+        return requests.Session()
+
+
+# Run Script
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Stub Gmail API server")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--messages", type=int, default=1000)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every request")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of requests answered with a 503")
+    args = parser.parse_args()
+
+    stub = StubGmailServer(StubGmailState(args.messages, latency=args.latency, error_rate=args.error_rate), port=args.port).start()
+    print(f"Stub Gmail API at {stub.root_url} ({args.messages} messages); set GMAIL_API_ROOT_URL to use it")
+    try:
+        stub.thread.join()
+    except KeyboardInterrupt:
+        stub.stop()
@@ -5,8 +5,105 @@ load_dotenv()
 MONGO_URI = os.getenv("MONGO_URI")
 MONGO_DB = os.getenv("MONGO_DB", "smart_email_db")
 MONGO_COLLECTION = os.getenv("MONGO_COLLECTION", "emails")
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", "50"))
+MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", "0"))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", "5000"))
+MONGO_CONNECT_TIMEOUT_MS = int(os.getenv("MONGO_CONNECT_TIMEOUT_MS", "5000"))
+MONGO_SOCKET_TIMEOUT_MS = int(os.getenv("MONGO_SOCKET_TIMEOUT_MS", "30000"))
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 
+# Gmail OAuth files and per-request HTTP timeout (seconds)
+GMAIL_TOKEN_PATH = os.getenv("GMAIL_TOKEN_PATH", "./services/token.json")
+GMAIL_CREDENTIALS_PATH = os.getenv("GMAIL_CREDENTIALS_PATH", "./services/credentials.json")
+GMAIL_HTTP_TIMEOUT = int(os.getenv("GMAIL_HTTP_TIMEOUT", "30"))
+
+# Gmail REST root for the async client, and how many batch requests it keeps in flight
+GMAIL_API_ROOT_URL = os.getenv("GMAIL_API_ROOT_URL", "https://gmail.googleapis.com/")
+GMAIL_ASYNC_CONCURRENCY = int(os.getenv("GMAIL_ASYNC_CONCURRENCY", "4"))
+
+# messages.get format for fetches: "metadata" (headers only), "full" (parsed MIME parts) or "raw" (RFC 822)
+GMAIL_MESSAGE_FORMAT = os.getenv("GMAIL_MESSAGE_FORMAT", "metadata")
+
+# Upper bound on messages re-listed when incremental sync has to fall back to a full resync
+GMAIL_FULL_RESYNC_LIMIT = int(os.getenv("GMAIL_FULL_RESYNC_LIMIT", "500"))
+
+# Mailbox backfill: messages per messages.list page and per bulk_write chunk
+BACKFILL_PAGE_SIZE = int(os.getenv("BACKFILL_PAGE_SIZE", "500"))
+BACKFILL_CHUNK_SIZE = int(os.getenv("BACKFILL_CHUNK_SIZE", "250"))
+
+# Classification engine: parallel LLM calls and Gemini request budget (replaces the fixed 6 s sleep)
+CLASSIFIER_CONCURRENCY = int(os.getenv("CLASSIFIER_CONCURRENCY", "4"))
+CLASSIFIER_REQUESTS_PER_MINUTE = int(os.getenv("CLASSIFIER_REQUESTS_PER_MINUTE", "10"))
+# Emails packed into one classification prompt (1 = one prompt per email) and the prompt token budget per batch
+CLASSIFIER_BATCH_SIZE = int(os.getenv("CLASSIFIER_BATCH_SIZE", "10"))
+CLASSIFIER_BATCH_TOKEN_BUDGET = int(os.getenv("CLASSIFIER_BATCH_TOKEN_BUDGET", "6000"))
+# Body tokens sent per email after quotes, signatures and footers are stripped
+CLASSIFIER_BODY_TOKEN_BUDGET = int(os.getenv("CLASSIFIER_BODY_TOKEN_BUDGET", "400"))
+# Failed LLM classifications an email gets before runs stop picking it up (it stays pending)
+CLASSIFIER_MAX_ATTEMPTS = int(os.getenv("CLASSIFIER_MAX_ATTEMPTS", "5"))
+
+# Deterministic pre-classification rules run before the LLM (empty path disables them)
+CLASSIFIER_RULES_PATH = os.getenv("CLASSIFIER_RULES_PATH", "./config/classification_rules.json")
+
+# Local first-tier model: persisted artifact and the probability needed to skip the LLM
+LOCAL_CLASSIFIER_PATH = os.getenv("LOCAL_CLASSIFIER_PATH", "./models/local_classifier.npz")
+LOCAL_CLASSIFIER_THRESHOLD = float(os.getenv("LOCAL_CLASSIFIER_THRESHOLD", "0.85"))
+
+# Classification cache: in-process LRU entries and lifetime of the Mongo-backed tier
+CLASSIFICATION_CACHE_SIZE = int(os.getenv("CLASSIFICATION_CACHE_SIZE", "10000"))
+CLASSIFICATION_CACHE_TTL_SECONDS = int(os.getenv("CLASSIFICATION_CACHE_TTL_SECONDS", str(30 * 24 * 3600)))
+
+# Write-behind buffers flush when this many writes are queued or the oldest has waited this long
+WRITE_BUFFER_MAX_OPS = int(os.getenv("WRITE_BUFFER_MAX_OPS", "500"))
+WRITE_BUFFER_MAX_DELAY_SECONDS = float(os.getenv("WRITE_BUFFER_MAX_DELAY_SECONDS", "1.0"))
+
+# Exports: documents per Mongo cursor batch and bytes per streamed chunk
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "1000"))
+EXPORT_CHUNK_BYTES = int(os.getenv("EXPORT_CHUNK_BYTES", "65536"))
+
+# Background jobs: worker threads per process, queued jobs allowed, and when an unfinished job counts as abandoned
+JOB_MAX_WORKERS = int(os.getenv("JOB_MAX_WORKERS", "2"))
+JOB_MAX_QUEUED = int(os.getenv("JOB_MAX_QUEUED", "20"))
+JOB_STALE_SECONDS = int(os.getenv("JOB_STALE_SECONDS", "900"))
+# How often a process refreshes updated_at on its queued and running jobs; keep well under JOB_STALE_SECONDS
+JOB_HEARTBEAT_SECONDS = float(os.getenv("JOB_HEARTBEAT_SECONDS", "60"))
+JOB_PROGRESS_INTERVAL_SECONDS = float(os.getenv("JOB_PROGRESS_INTERVAL_SECONDS", "1.0"))
+
+# Cold body storage: codec ("zlib", or "zstd" when the zstandard package is installed), level, and the
+# compressed size above which a body goes to GridFS instead of an inline blob
+BODY_STORE_CODEC = os.getenv("BODY_STORE_CODEC", "zlib")
+BODY_STORE_COMPRESSION_LEVEL = int(os.getenv("BODY_STORE_COMPRESSION_LEVEL", "6"))
+BODY_STORE_GRIDFS_THRESHOLD = int(os.getenv("BODY_STORE_GRIDFS_THRESHOLD", str(1024 * 1024)))
+
+# Attachment ingestion: larger attachments are deferred, not downloaded; download chunk size and the
+# size up to which a download is spooled in memory before spilling to a temporary file
+ATTACHMENT_MAX_BYTES = int(os.getenv("ATTACHMENT_MAX_BYTES", str(10 * 1024 * 1024)))
+ATTACHMENT_CHUNK_BYTES = int(os.getenv("ATTACHMENT_CHUNK_BYTES", str(256 * 1024)))
+ATTACHMENT_SPOOL_BYTES = int(os.getenv("ATTACHMENT_SPOOL_BYTES", str(1024 * 1024)))
+# Messages per has:attachment listing page when scanning for attachments to ingest
+ATTACHMENT_LIST_PAGE_SIZE = int(os.getenv("ATTACHMENT_LIST_PAGE_SIZE", "100"))
+
+# Responder: parallel draft generations per batch, and how long /respond waits for the send queue
+RESPONDER_CONCURRENCY = int(os.getenv("RESPONDER_CONCURRENCY", "4"))
+RESPOND_BATCH_MAX = int(os.getenv("RESPOND_BATCH_MAX", "100"))
+RESPOND_SEND_WAIT_SECONDS = float(os.getenv("RESPOND_SEND_WAIT_SECONDS", "30"))
+# Reply prompt budget (thread summary + message being answered), summary length, per-message text folded
+# into a summary, and the message tokens per summarizer call
+RESPONDER_PROMPT_TOKEN_BUDGET = int(os.getenv("RESPONDER_PROMPT_TOKEN_BUDGET", "1500"))
+THREAD_SUMMARY_MAX_TOKENS = int(os.getenv("THREAD_SUMMARY_MAX_TOKENS", "300"))
+THREAD_SUMMARY_MESSAGE_TOKENS = int(os.getenv("THREAD_SUMMARY_MESSAGE_TOKENS", "400"))
+THREAD_FOLD_TOKEN_BUDGET = int(os.getenv("THREAD_FOLD_TOKEN_BUDGET", "3000"))
+# Intermediate summaries kept per thread, so replies to earlier messages get a summary that ends before them
+THREAD_SUMMARY_CHECKPOINTS = int(os.getenv("THREAD_SUMMARY_CHECKPOINTS", "8"))
+
+# Outbound send queue: Gmail sends per minute, attempts before giving up, exponential backoff bounds,
+# and how long a claimed send may stay in flight before another worker takes it over
+SEND_RATE_PER_MINUTE = int(os.getenv("SEND_RATE_PER_MINUTE", "20"))
+SEND_MAX_ATTEMPTS = int(os.getenv("SEND_MAX_ATTEMPTS", "5"))
+SEND_BACKOFF_BASE_SECONDS = float(os.getenv("SEND_BACKOFF_BASE_SECONDS", "2"))
+SEND_BACKOFF_MAX_SECONDS = float(os.getenv("SEND_BACKOFF_MAX_SECONDS", "300"))
+SEND_LOCK_SECONDS = int(os.getenv("SEND_LOCK_SECONDS", "120"))
+
 CATEGORIES = [
     "Work / Professional",
     "Personal",
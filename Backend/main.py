@@ -97,18 +97,38 @@
 #         print("Usage: python main.py [fetch|classify|all]")
 
 
-from fastapi import FastAPI, HTTPException, Query
+from fastapi import FastAPI, Header, HTTPException, Query
 from pydantic import BaseModel
-from typing import Optional
+from typing import List, Optional
+from datetime import datetime
 from bson import ObjectId
+import asyncio
+import json
 
 from services.gmail_service import GmailService
-from services.db_service import bulk_upsert_emails, get_all_emails, get_all_classified_emails
+from services.async_gmail_service import AsyncGmailService
+from services.db_service import bulk_upsert_emails
+from services import async_db_service
+from services.mongo import close_async_client
+from services.pagination import InvalidCursorError
+from services.export_service import export_classified_emails, export_responded_emails, export_stream
+from services.stats_service import get_email_stats, reconcile_stats
+from services.sync_service import sync_mailbox, backfill_mailbox
 from services.classifier import classify_unclassified_emails
-from services.responder import generate_response
+from services.classification_cache import get_classification_cache
+from services.local_classifier import load_local_classifier
+from services.write_buffer import close_all_buffers
+from services.job_service import get_job_manager, cancel_job, JobQueueFullError
+from services.attachment_service import ingest_pending_attachments
+from services.thread_service import refresh_stale_threads
+from services.responder import generate_response, generate_drafts_async, queue_drafts, load_reply_context, astream_draft, send_reply
+from services.send_queue import get_send_queue, get_outbound
 from utils.parser import clean_email_text
 from services.logger import get_logger
+from services.metrics import MetricsMiddleware, render as render_metrics, CONTENT_TYPE_LATEST
+from config.settings import RESPOND_BATCH_MAX
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse, Response
 logger = get_logger(__name__)
 
 app = FastAPI(title="Smart Email Assistant API")
@@ -120,15 +140,56 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# Added last, so it runs outermost and the timing includes CORS handling
+app.add_middleware(MetricsMiddleware)
+
+
+# Load the local classifier artifact once per worker instead of on the first /classify
+@app.on_event("startup")
+def load_models():
+    load_local_classifier()
+
+# Drain sends left queued by a previous process
+@app.on_event("startup")
+def start_send_queue():
+    get_send_queue().start()
+
+# Flush buffered Mongo writes before the worker exits
+@app.on_event("shutdown")
+def flush_write_buffers():
+    get_job_manager().shutdown()
+    get_send_queue().stop()
+    close_all_buffers()
+
+@app.on_event("shutdown")
+async def close_async_mongo():
+    await close_async_client()
 
 
 # Pydantic models
 class FetchRequest(BaseModel):
     max_emails_to_fetch: Optional[int] = 10
+    incremental: Optional[bool] = False  # apply Gmail history since the last sync instead of re-listing
+
+class BackfillRequest(BaseModel):
+    restart: Optional[bool] = False  # ignore the saved checkpoint
+    max_messages: Optional[int] = None
     
 class RespondRequest(BaseModel):
     email_id: str
     draft: Optional[str] = None  # optional edited draft
+    idempotency_key: Optional[str] = None  # resend-safe key (or the Idempotency-Key header); without one every request is a new reply
+
+class SendReplyRequest(BaseModel):
+    email_id: str
+    body: str  # final reply text, sent as-is
+    edited_by_human: Optional[bool] = True
+    idempotency_key: Optional[str] = None
+
+class RespondBatchRequest(BaseModel):
+    email_ids: List[str]
+    send: Optional[bool] = False  # queue the generated drafts for sending
+    concurrency: Optional[int] = None
 
 class AllTasksRequest(BaseModel):
     fetch_limit: Optional[int] = 10
@@ -141,21 +202,37 @@ class AllTasksRequest(BaseModel):
 def root():
     return {"message": "Smart Email Assistant API is running"}
 
-# Fetch emails and store in MongoDB
-@app.post("/fetch")
-def fetch_emails(request: FetchRequest):
-    gmail = GmailService()
-    logger.info(f"Fetching up to {request.max_emails_to_fetch} emails from Gmail...")
-    gmail_emails = gmail.fetch_inbox_emails(max_results=request.max_emails_to_fetch)
-    logger.info(f"Fetched {len(gmail_emails)} emails from Gmail")
-
-    if not gmail_emails:
-        logger.warning("No emails fetched")
-        return {"fetched": 0, "message": "No emails fetched"}
-
-    # Store in DB
-    result = bulk_upsert_emails(gmail_emails, provider="gmail")
-    stored_emails = get_all_emails()
+# Latest inbox messages over the async Gmail client (batches fetched concurrently)
+async def fetch_inbox_async(max_results: int):
+    async with AsyncGmailService() as gmail:
+        return await gmail.fetch_inbox_emails(max_results=max_results)
+
+# Fetch emails and store in MongoDB (runs as a background job)
+def run_fetch_job(ctx, max_emails_to_fetch: int = 10, incremental: bool = False):
+    sync_info = None
+    ctx.update_progress(force=True, stage="fetching")
+    if incremental:
+        logger.info("Syncing mailbox changes from Gmail history...")
+        sync_result = sync_mailbox(GmailService())
+        gmail_emails = sync_result.pop("emails")
+        result = sync_result.pop("upsert_result")
+        sync_info = sync_result
+        logger.info(f"Fetched {len(gmail_emails)} emails from Gmail")
+    else:
+        logger.info(f"Fetching up to {max_emails_to_fetch} emails from Gmail...")
+        gmail_emails = asyncio.run(fetch_inbox_async(max_emails_to_fetch))
+        logger.info(f"Fetched {len(gmail_emails)} emails from Gmail")
+
+        if not gmail_emails:
+            logger.warning("No emails fetched")
+            return {"fetched": 0, "message": "No emails fetched"}
+
+        # Store in DB
+        ctx.update_progress(force=True, stage="storing", fetched=len(gmail_emails))
+        result = bulk_upsert_emails(gmail_emails, provider="gmail")
+
+    # Counter read instead of loading every stored email
+    total_stored = get_email_stats()["total"]
 
     # Build structured JSON response
     emails_json = []
@@ -170,18 +247,35 @@ def fetch_emails(request: FetchRequest):
             "thread_id": e.get("thread_id"),
         })
 
-    return {
+    response = {
         "fetched": len(gmail_emails),
         "upsert_result": result,
-        "total_stored": len(stored_emails),
+        "total_stored": total_stored,
         "emails": emails_json
     }
-
-
-# Classify unclassified emails
-@app.post("/classify")
-def classify_emails(limit: int = Query(5, description="Number of emails to classify")):
-    classified = classify_unclassified_emails(limit=limit, delay=6)
+    if sync_info is not None:
+        response["sync"] = sync_info
+    if result.get("upserted_count"):
+        # Fold the new messages into their thread summaries in the background
+        try:
+            jobs.submit("threads", {}, dedup_key="threads")
+        except JobQueueFullError:
+            logger.warning("Job queue full; thread summaries will refresh on the next run")
+    ctx.update_progress(force=True, stage="done", processed=len(gmail_emails))
+    return response
+
+# Stream the whole mailbox in, checkpointed so a cancelled or failed run resumes
+def run_backfill_job(ctx, restart: bool = False, max_messages: Optional[int] = None):
+    return backfill_mailbox(
+        GmailService(),
+        resume=not restart,
+        max_messages=max_messages,
+        progress_callback=lambda progress: ctx.update_progress(**progress),
+    )
+
+# Classify pending emails (runs as a background job)
+def run_classify_job(ctx, limit: int = 5):
+    classified = classify_unclassified_emails(limit=limit, progress_callback=lambda progress: ctx.update_progress(**progress))
     return {
         "status": "Classification completed",
         "classified_count": len(classified),
@@ -196,18 +290,102 @@ def classify_emails(limit: int = Query(5, description="Number of emails to class
                 "category": email.get("category"),
                 "confidence": email.get("confidence"),
                 "reasoning": email.get("reasoning"),
-                "summary": email.get("summary")
+                "summary": email.get("summary"),
+                "tier": email.get("tier")
             }
         } for email in classified] if classified else []
     }
 
+# Download attachments of stored emails into GridFS
+def run_attachments_job(ctx, limit: int = 50):
+    return ingest_pending_attachments(GmailService(), limit=limit, progress_callback=lambda progress: ctx.update_progress(**progress))
+
+# Refresh summaries of threads that received messages
+def run_threads_job(ctx, limit: int = 100):
+    return refresh_stale_threads(limit=limit, progress_callback=lambda progress: ctx.update_progress(**progress))
+
+jobs = get_job_manager()
+jobs.register("fetch", run_fetch_job)
+jobs.register("backfill", run_backfill_job)
+jobs.register("classify", run_classify_job)
+jobs.register("attachments", run_attachments_job)
+jobs.register("threads", run_threads_job)
+
+def _enqueue(job_type: str, params: dict, dedup_key: str):
+    try:
+        job = jobs.submit(job_type, params, dedup_key=dedup_key)
+    except JobQueueFullError as e:
+        raise HTTPException(status_code=429, detail=str(e))
+    return {"job_id": job["_id"], "status": job["status"], "deduplicated": job["deduplicated"]}
+
+# Mailbox-changing jobs share one dedup key so fetch and backfill never overlap
+@app.post("/fetch", status_code=202)
+def fetch_emails(request: FetchRequest):
+    return _enqueue("fetch", {"max_emails_to_fetch": request.max_emails_to_fetch, "incremental": request.incremental}, "mailbox:gmail:me")
+
+@app.post("/backfill", status_code=202)
+def backfill_emails(request: BackfillRequest):
+    return _enqueue("backfill", {"restart": request.restart, "max_messages": request.max_messages}, "mailbox:gmail:me")
+
+@app.post("/classify", status_code=202)
+def classify_emails(limit: int = Query(5, description="Number of emails to classify")):
+    return _enqueue("classify", {"limit": limit}, "classify")
+
+@app.post("/attachments/ingest", status_code=202)
+def ingest_attachments(limit: int = Query(50, description="Maximum number of messages to ingest attachments for")):
+    return _enqueue("attachments", {"limit": limit}, "attachments")
+
+@app.post("/threads/refresh", status_code=202)
+def refresh_threads(limit: int = Query(100, description="Number of stale threads to summarize")):
+    return _enqueue("threads", {"limit": limit}, "threads")
+
+# Poll a job for status, progress counters, throughput and result
+@app.get("/jobs/{job_id}")
+async def job_status(job_id: str):
+    job = await async_db_service.get_job(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+@app.post("/jobs/{job_id}/cancel")
+def job_cancel(job_id: str):
+    job = cancel_job(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+@app.get("/jobs")
+async def recent_jobs(job_type: Optional[str] = None, limit: int = Query(20, ge=1, le=100)):
+    return {"jobs": await async_db_service.list_jobs(job_type, limit)}
+
+# Prometheus scrape endpoint
+@app.get("/metrics", include_in_schema=False)
+def metrics():
+    return Response(render_metrics(), media_type=CONTENT_TYPE_LATEST)
+
+# Classification cache hit/miss counters for this process
+@app.get("/classification-cache/stats")
+def classification_cache_stats():
+    return get_classification_cache().stats()
+
+# Mailbox counters: total, unclassified, per category, responded
+@app.get("/stats")
+async def email_stats():
+    return await async_db_service.get_email_stats()
+
+# Recompute the counters from the collections and report the corrected drift
+@app.post("/stats/reconcile")
+def reconcile_email_stats():
+    return {"drift": reconcile_stats(), "stats": get_email_stats()}
+
 @app.post("/respond")
-def respond_email(request: RespondRequest):
+def respond_email(request: RespondRequest, idempotency_key: Optional[str] = Header(None)):
     try:
         result = generate_response(
             email_id=request.email_id,
             human_input=request.draft,
-            send_email_flag=True
+            send_email_flag=True,
+            idempotency_key=request.idempotency_key or idempotency_key
         )
         return {
             "status": result["status"],
@@ -216,15 +394,101 @@ def respond_email(request: RespondRequest):
             "from": result["from"],
             "subject": result["subject"],
             "draft": result["draft"],
+            "outbound_id": result["outbound_id"],
             "gmail_response": result["gmail_response"],
         }
     except ValueError as ve:
         raise HTTPException(status_code=400, detail=str(ve))
+
+def _sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+# Stream a reply draft over server-sent events: "meta", a "delta" per token chunk, then "done" (or "draft_error")
+@app.get("/respond/draft/stream")
+async def stream_reply_draft(email_id: str):
+    try:
+        context = await asyncio.to_thread(load_reply_context, email_id)
+    except ValueError as ve:
+        raise HTTPException(status_code=400, detail=str(ve))
+
+    async def events():
+        yield _sse("meta", {"email_id": email_id, "to": context["sender"], "from": context["recipient"], "subject": context["subject"]})
+        parts = []
+        try:
+            async for text in astream_draft(context):
+                parts.append(text)
+                yield _sse("delta", {"text": text})
+        except Exception as e:
+            logger.error(f"Draft stream failed for {email_id}: {e}")
+            yield _sse("draft_error", {"detail": str(e)})
+            return
+        yield _sse("done", {"draft": "".join(parts)})
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+# Send the final (possibly edited) reply text; no LLM call
+@app.post("/respond/send")
+def send_reply_text(request: SendReplyRequest, idempotency_key: Optional[str] = Header(None)):
+    try:
+        return send_reply(
+            email_id=request.email_id,
+            body=request.body,
+            edited_by_human=request.edited_by_human,
+            idempotency_key=request.idempotency_key or idempotency_key
+        )
+    except ValueError as ve:
+        raise HTTPException(status_code=400, detail=str(ve))
+
+# Draft replies for many emails concurrently; optionally queue them for sending
+@app.post("/respond/batch")
+async def respond_batch(request: RespondBatchRequest, idempotency_key: Optional[str] = Header(None)):
+    email_ids = list(dict.fromkeys(request.email_ids))
+    if not email_ids:
+        raise HTTPException(status_code=400, detail="email_ids is empty")
+    if len(email_ids) > RESPOND_BATCH_MAX:
+        raise HTTPException(status_code=400, detail=f"At most {RESPOND_BATCH_MAX} emails per batch")
+    kwargs = {"concurrency": request.concurrency} if request.concurrency else {}
+    results = await generate_drafts_async(email_ids, **kwargs)
+    if request.send:
+        results = await asyncio.to_thread(queue_drafts, results, idempotency_key)
+    return {
+        "results": results,
+        "generated": sum(1 for r in results if r["status"] != "error"),
+        "failed": sum(1 for r in results if r["status"] == "error"),
+    }
+
+# Delivery status of a queued reply
+@app.get("/outbound/{outbound_id}")
+def outbound_status(outbound_id: str):
+    item = get_outbound(outbound_id)
+    if not item:
+        raise HTTPException(status_code=404, detail="Outbound email not found")
+    return item
     
 # Endpoint to get all classified emails
 @app.get("/classified-emails")
-def get_classified_emails():
-    classified_emails = get_all_classified_emails()
+async def get_classified_emails(
+    limit: int = Query(50, ge=1, le=500, description="Page size"),
+    cursor: Optional[str] = Query(None, description="next_cursor from the previous page"),
+    category: Optional[str] = None,
+    min_confidence: Optional[float] = Query(None, ge=0, le=1),
+    max_confidence: Optional[float] = Query(None, ge=0, le=1),
+    sender: Optional[str] = Query(None, description="Sender email address"),
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None,
+):
+    try:
+        classified_emails, next_cursor = await async_db_service.list_classified_emails(
+            limit=limit, cursor=cursor, category=category,
+            min_confidence=min_confidence, max_confidence=max_confidence,
+            sender=sender, date_from=date_from, date_to=date_to,
+        )
+    except InvalidCursorError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     emails_json = []
     for email in classified_emails:
         emails_json.append({
@@ -242,14 +506,24 @@ def get_classified_emails():
         })
     classified_emails = emails_json
         
-    return {"classified_emails": classified_emails}
+    return {"classified_emails": classified_emails, "next_cursor": next_cursor}
 
-# Endpoint for getting all responded emails
+# Endpoint for getting responded emails, one page at a time
 
 @app.get("/responded-emails")
-def get_responded_emails():
-    from services.db_service import get_responded_emails
-    responded_emails = get_responded_emails()
+async def get_responded_emails(
+    limit: int = Query(50, ge=1, le=500, description="Page size"),
+    cursor: Optional[str] = Query(None, description="next_cursor from the previous page"),
+    recipient: Optional[str] = None,
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None,
+):
+    try:
+        responded_emails, next_cursor = await async_db_service.list_responded_emails(
+            limit=limit, cursor=cursor, recipient=recipient, date_from=date_from, date_to=date_to,
+        )
+    except InvalidCursorError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     emails_json = []
     for r in responded_emails:
         emails_json.append({
@@ -266,4 +540,40 @@ def get_responded_emails():
             "gmail_response": r.get("gmail_response"),
         })
     responded_emails = emails_json
-    return {"responded_emails": responded_emails}
+    return {"responded_emails": responded_emails, "next_cursor": next_cursor}
+
+
+# NDJSON exports streamed from a Mongo cursor; gzip=true compresses on the fly
+def _export_response(rows, name: str, gzip: bool) -> StreamingResponse:
+    filename = f"{name}.ndjson.gz" if gzip else f"{name}.ndjson"
+    return StreamingResponse(
+        export_stream(rows, compress=gzip),
+        media_type="application/gzip" if gzip else "application/x-ndjson",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+@app.get("/export/classified-emails")
+def export_classified(
+    gzip: bool = False,
+    category: Optional[str] = None,
+    min_confidence: Optional[float] = Query(None, ge=0, le=1),
+    max_confidence: Optional[float] = Query(None, ge=0, le=1),
+    sender: Optional[str] = Query(None, description="Sender email address"),
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None,
+):
+    rows = export_classified_emails(
+        category=category, min_confidence=min_confidence, max_confidence=max_confidence,
+        sender=sender, date_from=date_from, date_to=date_to,
+    )
+    return _export_response(rows, "classified-emails", gzip)
+
+@app.get("/export/responded-emails")
+def export_responded(
+    gzip: bool = False,
+    recipient: Optional[str] = None,
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None,
+):
+    rows = export_responded_emails(recipient=recipient, date_from=date_from, date_to=date_to)
+    return _export_response(rows, "responded-emails", gzip)
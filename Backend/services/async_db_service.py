@@ -0,0 +1,75 @@
+"""
+Async counterparts of the db_service read paths, for `async def` handlers.
+
+Same queries, projections and row shapes as db_service, issued through the
+AsyncMongoClient so an in-flight request holds no worker thread.
+"""
+import asyncio
+from typing import List, Dict, Any, Optional, Tuple
+
+from services.mongo import get_async_collection, get_async_emails_collection, get_async_responses_collection
+from services.db_service import (
+    UNCLASSIFIED_QUERY, UNCLASSIFIED_SORT, CLASSIFICATION_PROJECTION, CLASSIFIED_LIST_PROJECTION, RESPONDED_LIST_PROJECTION,
+    _classified_query, _classified_row, _responded_query, _responded_row,
+)
+from services.pagination import async_keyset_page
+from services.stats_service import STATS_COLLECTION, EMAIL_STATS_ID, reconcile_stats
+from services.job_service import JOBS_COLLECTION
+from services.logger import get_logger
+from services.metrics import timed_mongo
+
+logger = get_logger(__name__)
+
+
+@timed_mongo
+async def get_unclassified_emails(limit: int = 0) -> List[Dict[str, Any]]:
+    cursor = get_async_emails_collection().find(UNCLASSIFIED_QUERY, CLASSIFICATION_PROJECTION).sort(UNCLASSIFIED_SORT).limit(limit)
+    return await cursor.to_list(length=limit or None)
+
+
+@timed_mongo
+async def list_classified_emails(limit: int = 50, cursor: str = None, **filters) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """One page of classified emails, newest first. Returns (emails, next_cursor)"""
+    emails, next_cursor = await async_keyset_page(
+        get_async_emails_collection(), _classified_query(**filters), CLASSIFIED_LIST_PROJECTION, "date", limit, cursor
+    )
+    return [_classified_row(e) for e in emails], next_cursor
+
+
+@timed_mongo
+async def list_responded_emails(limit: int = 50, cursor: str = None, **filters) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """One page of sent responses, newest first. Returns (responses, next_cursor)"""
+    responses, next_cursor = await async_keyset_page(
+        get_async_responses_collection(), _responded_query(**filters), RESPONDED_LIST_PROJECTION, "created_at", limit, cursor
+    )
+    return [_responded_row(r) for r in responses], next_cursor
+
+
+@timed_mongo
+async def get_email_stats() -> Dict[str, Any]:
+    stats_collection = get_async_collection(STATS_COLLECTION)
+    stats = await stats_collection.find_one({"_id": EMAIL_STATS_ID}, {"_id": 0})
+    if stats is None:
+        # Seeding scans the collections; keep it off the event loop
+        await asyncio.to_thread(reconcile_stats)
+        stats = await stats_collection.find_one({"_id": EMAIL_STATS_ID}, {"_id": 0})
+    return {
+        "total": stats.get("total", 0),
+        "unclassified": stats.get("unclassified", 0),
+        "categories": {k: v for k, v in stats.get("categories", {}).items() if v},
+        "responded": stats.get("responded", 0),
+        "updated_at": stats.get("updated_at"),
+        "reconciled_at": stats.get("reconciled_at"),
+    }
+
+
+@timed_mongo
+async def get_job(job_id: str) -> Optional[Dict[str, Any]]:
+    return await get_async_collection(JOBS_COLLECTION).find_one({"_id": job_id})
+
+
+@timed_mongo
+async def list_jobs(job_type: Optional[str] = None, limit: int = 20) -> List[Dict[str, Any]]:
+    query = {"type": job_type} if job_type else {}
+    cursor = get_async_collection(JOBS_COLLECTION).find(query, {"result": 0}).sort("created_at", -1).limit(limit)
+    return await cursor.to_list(length=limit)
@@ -0,0 +1,158 @@
+"""
+Gmail REST calls over httpx.AsyncClient.
+
+Mirrors the GmailService read path without holding a thread per call: one
+pooled keep-alive client per service, and batch requests of up to 100
+messages.get sub-requests kept in flight concurrently.
+"""
+import asyncio
+import json
+import time
+from email.message import Message
+from email.parser import BytesHeaderParser
+from typing import Any, Dict, List, Optional
+from urllib.parse import urlencode
+from uuid import uuid4
+
+import httpx
+
+from services.gmail_client import get_gmail_client
+from services.gmail_service import GmailService, BATCH_SIZE, METADATA_HEADERS
+from services.logger import get_logger
+from services.metrics import EMAILS_FETCHED, observe_gmail
+from config.settings import GMAIL_API_ROOT_URL, GMAIL_HTTP_TIMEOUT, GMAIL_ASYNC_CONCURRENCY, GMAIL_MESSAGE_FORMAT
+
+logger = get_logger(__name__)
+
+API_PATH = "gmail/v1/users/me"
+# messages.list returns at most this many ids per page
+LIST_PAGE_SIZE = 500
+
+
+class AsyncGmailService:
+    def __init__(self, root_url: str = GMAIL_API_ROOT_URL, token: Optional[str] = None,
+                 concurrency: int = GMAIL_ASYNC_CONCURRENCY, client: Optional[httpx.AsyncClient] = None,
+                 message_format: str = GMAIL_MESSAGE_FORMAT):
+        self.root_url = root_url.rstrip("/") + "/"
+        self.message_format = message_format
+        # A fixed token (e.g. for a stub server) skips OAuth
+        self._token = token
+        self._semaphore = asyncio.Semaphore(max(1, concurrency))
+        self._client = client or httpx.AsyncClient(timeout=GMAIL_HTTP_TIMEOUT)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.aclose()
+
+    async def aclose(self):
+        await self._client.aclose()
+
+    async def _headers(self) -> Dict[str, str]:
+        token = self._token
+        if token is None:
+            # May refresh the token over the network; keep it off the event loop
+            creds = await asyncio.to_thread(get_gmail_client().credentials)
+            token = creds.token
+        return {"Authorization": f"Bearer {token}"}
+
+    async def _request(self, method: str, url: str, **kwargs) -> httpx.Response:
+        started = time.perf_counter()
+        response = None
+        try:
+            response = await self._client.request(method, url, **kwargs)
+        finally:
+            observe_gmail(url, started, response.status_code if response is not None else None)
+        response.raise_for_status()
+        return response
+
+    async def _get(self, path: str, params: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        response = await self._request("GET", f"{self.root_url}{API_PATH}/{path}", params=params, headers=await self._headers())
+        return response.json()
+
+    async def list_message_ids(self, max_results: int = 10, label_ids=("INBOX",)) -> List[str]:
+        """Page through messages.list until `max_results` ids are read or the label runs out"""
+        message_ids: List[str] = []
+        page_token = None
+        while len(message_ids) < max_results:
+            params = [("labelIds", label) for label in label_ids]
+            params.append(("maxResults", min(LIST_PAGE_SIZE, max_results - len(message_ids))))
+            if page_token:
+                params.append(("pageToken", page_token))
+            results = await self._get("messages", params)
+            message_ids.extend(msg["id"] for msg in results.get("messages", []))
+            page_token = results.get("nextPageToken")
+            if not page_token:
+                break
+        return message_ids[:max_results]
+
+    async def get_history_id(self) -> str:
+        profile = await self._get("profile")
+        return profile["historyId"]
+
+    async def _batch_get(self, message_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        """One Gmail batch request of messages.get sub-requests in the service's message format"""
+        boundary = f"batch_{uuid4().hex}"
+        params = [("format", self.message_format)]
+        if self.message_format == "metadata":
+            params += [("metadataHeaders", h) for h in METADATA_HEADERS]
+        query = urlencode(params)
+        parts = [
+            f"--{boundary}\r\n"
+            f"Content-Type: application/http\r\n"
+            f"Content-ID: <{msg_id}>\r\n\r\n"
+            f"GET /{API_PATH}/messages/{msg_id}?{query} HTTP/1.1\r\n\r\n"
+            for msg_id in message_ids
+        ]
+        body = "".join(parts) + f"--{boundary}--\r\n"
+
+        async with self._semaphore:
+            response = await self._request(
+                "POST",
+                f"{self.root_url}batch/gmail/v1",
+                content=body.encode("utf-8"),
+                headers={**await self._headers(), "Content-Type": f"multipart/mixed; boundary={boundary}"},
+            )
+        return self._parse_batch_response(response)
+
+    @staticmethod
+    def _parse_batch_response(response: httpx.Response) -> Dict[str, Dict[str, Any]]:
+        """Map Content-ID -> decoded body for every successful sub-response"""
+        content_type = Message()
+        content_type["Content-Type"] = response.headers["Content-Type"]
+        delimiter = b"--" + content_type.get_param("boundary").encode()
+        fetched = {}
+        # Split on bytes: the JSON bodies are UTF-8 and must reach json.loads undecoded
+        for part in response.content.replace(b"\r\n", b"\n").split(delimiter)[1:]:
+            if part.startswith(b"--"):
+                break
+            part_headers, _, http_response = part.lstrip(b"\n").partition(b"\n\n")
+            content_id = (BytesHeaderParser().parsebytes(part_headers).get("Content-ID") or "").strip("<>")
+            if content_id.startswith("response-"):
+                content_id = content_id[len("response-"):]
+            status_line, _, rest = http_response.partition(b"\n")
+            status = int(status_line.split(b" ")[1])
+            _, _, payload = rest.partition(b"\n\n")
+            if status == 200:
+                fetched[content_id] = json.loads(payload)
+            else:
+                logger.warning(f"Failed to fetch message {content_id} in batch: HTTP {status}")
+        return fetched
+
+    async def fetch_messages_batched(self, message_ids: List[str], batch_size: int = BATCH_SIZE) -> List[Dict[str, Any]]:
+        """Fetch messages with concurrent batch requests"""
+        chunks = [message_ids[i:i + batch_size] for i in range(0, len(message_ids), batch_size)]
+        fetched: Dict[str, Dict[str, Any]] = {}
+        for result in await asyncio.gather(*(self._batch_get(chunk) for chunk in chunks)):
+            fetched.update(result)
+        # Keep the order returned by messages.list
+        emails = [GmailService._parse_message(fetched[msg_id]) for msg_id in message_ids if msg_id in fetched]
+        EMAILS_FETCHED.inc(len(emails))
+        return emails
+
+    async def fetch_inbox_emails(self, max_results: int = 10) -> List[Dict[str, Any]]:
+        logger.info(f"Fetching {max_results} emails from Gmail inbox (async)...")
+        emails = await self.fetch_messages_batched(await self.list_message_ids(max_results))
+        logger.info(f"Fetched {len(emails)} emails successfully")
+        return emails
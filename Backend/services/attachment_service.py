@@ -0,0 +1,293 @@
+"""
+Attachment ingestion from Gmail into GridFS.
+
+attachments.get returns the file as one base64url JSON string. The response
+is streamed, the string is decoded chunk by chunk, and the bytes are spooled
+while hashed so no whole file sits in memory. Blobs are keyed by SHA-256 in
+`attachment_blobs`, so the same file attached to many messages is stored
+once; `ref_count` tracks the emails that reference a blob, and the blob is
+removed with its last email. Attachments above ATTACHMENT_MAX_BYTES are
+recorded as deferred. Ingestion walks Gmail's has:attachment listing with a
+checkpointed page token, so each run continues where the previous one
+stopped; when the scan passes a message again, failed attachments and
+deferred ones that now fit the limit are fetched again.
+
+    python -m services.attachment_service ingest --limit 50
+"""
+import argparse
+import base64
+import datetime
+import hashlib
+import re
+import tempfile
+import time
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional
+
+from gridfs import GridFSBucket
+from pymongo.errors import DuplicateKeyError
+
+from services.gmail_service import GmailService
+from services.mongo import get_db, get_collection, get_emails_collection
+from services.logger import get_logger
+from services.metrics import observe_gmail
+from config.settings import (
+    GMAIL_API_ROOT_URL, ATTACHMENT_MAX_BYTES, ATTACHMENT_CHUNK_BYTES, ATTACHMENT_SPOOL_BYTES, ATTACHMENT_LIST_PAGE_SIZE
+)
+
+logger = get_logger(__name__)
+
+BLOBS_COLLECTION = "attachment_blobs"
+ATTACHMENTS_BUCKET = "attachments"
+# Checkpoint of the has:attachment scan, kept with the other sync state
+SYNC_STATE_COLLECTION = "sync_state"
+ATTACHMENTS_SYNC_KEY = "gmail:me:attachments"
+
+STATUS_STORED = "stored"
+STATUS_DEFERRED = "deferred"
+STATUS_FAILED = "failed"
+
+# Stored emails whose attachments still need a download
+NEEDS_INGEST = {"$or": [
+    {"attachments_ingested_at": {"$exists": False}},
+    {"attachments": {"$elemMatch": {"status": STATUS_FAILED}}},
+    {"attachments": {"$elemMatch": {"status": STATUS_DEFERRED, "size": {"$lte": ATTACHMENT_MAX_BYTES}}}},
+]}
+
+
+def attachment_parts(payload: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Attachment descriptors from a format=full message payload, depth first"""
+    found = []
+    for part in payload.get("parts", []) or []:
+        body = part.get("body", {})
+        if part.get("filename") and body.get("attachmentId"):
+            found.append({
+                "filename": part["filename"],
+                "mimeType": part.get("mimeType"),
+                "size": body.get("size"),
+                "attachmentId": body["attachmentId"],
+            })
+        found.extend(attachment_parts(part))
+    return found
+
+
+def iter_json_string_field(chunks: Iterable[bytes], field: str) -> Iterator[str]:
+    """
+    Yield the value of a top-level string field from a streamed JSON object
+    without buffering it. Only valid for values without escapes, such as base64url.
+    """
+    opener = re.compile(r'"%s"\s*:\s*"' % re.escape(field))
+    buffer = ""
+    inside = False
+    for chunk in chunks:
+        buffer += chunk.decode("ascii")
+        if not inside:
+            match = opener.search(buffer)
+            if not match:
+                buffer = buffer[-(len(field) + 16):]  # keep enough to match across a chunk edge
+                continue
+            inside = True
+            buffer = buffer[match.end():]
+        end = buffer.find('"')
+        if end != -1:
+            yield buffer[:end]
+            return
+        yield buffer
+        buffer = ""
+    if inside:
+        raise ValueError(f"Unterminated JSON string for field {field!r}")
+    raise ValueError(f"Field {field!r} not found in response")
+
+
+def iter_base64url_decoded(pieces: Iterable[str]) -> Iterator[bytes]:
+    """Decode base64url text arriving in arbitrary pieces, four characters at a time"""
+    pending = ""
+    for piece in pieces:
+        pending += piece
+        usable = len(pending) - len(pending) % 4
+        if usable:
+            yield base64.urlsafe_b64decode(pending[:usable])
+            pending = pending[usable:]
+    if pending:
+        yield base64.urlsafe_b64decode(pending + "=" * (-len(pending) % 4))
+
+
+def download_attachment(provider_message_id: str, attachment_id: str, session,
+                        root_url: str = GMAIL_API_ROOT_URL) -> Iterator[bytes]:
+    """Stream the decoded bytes of one Gmail attachment over `session` (see GmailService.session)"""
+    url = f"{root_url.rstrip('/')}/gmail/v1/users/me/messages/{provider_message_id}/attachments/{attachment_id}"
+    started = time.perf_counter()
+    with session.get(url, params={"fields": "data"}, stream=True) as response:
+        # Timed to the response headers; the body streams straight into GridFS
+        observe_gmail(url, started, response.status_code)
+        response.raise_for_status()
+        yield from iter_base64url_decoded(iter_json_string_field(response.iter_content(ATTACHMENT_CHUNK_BYTES), "data"))
+
+
+def store_attachment_stream(chunks: Iterable[bytes], filename: str, content_type: str = None) -> Dict[str, Any]:
+    """
+    Hash and spool the chunks, then store the blob once per SHA-256.
+    Returns storage_id (GridFS file id), sha256, size and whether it was a duplicate.
+    """
+    sha256 = hashlib.sha256()
+    size = 0
+    with tempfile.SpooledTemporaryFile(max_size=ATTACHMENT_SPOOL_BYTES) as spool:
+        for chunk in chunks:
+            sha256.update(chunk)
+            spool.write(chunk)
+            size += len(chunk)
+        digest = sha256.hexdigest()
+
+        blobs = get_collection(BLOBS_COLLECTION)
+        existing = blobs.find_one_and_update({"_id": digest}, {"$inc": {"ref_count": 1}})
+        if existing:
+            return {"storage_id": str(existing["gridfs_id"]), "sha256": digest, "size": size, "deduplicated": True}
+
+        spool.seek(0)
+        bucket = GridFSBucket(get_db(), bucket_name=ATTACHMENTS_BUCKET)
+        gridfs_id = bucket.upload_from_stream(
+            filename, spool, chunk_size_bytes=ATTACHMENT_CHUNK_BYTES,
+            metadata={"sha256": digest, "contentType": content_type}
+        )
+
+    try:
+        blobs.insert_one({
+            "_id": digest,
+            "gridfs_id": gridfs_id,
+            "size": size,
+            "content_type": content_type,
+            "ref_count": 1,
+            "created_at": datetime.datetime.utcnow(),
+        })
+    except DuplicateKeyError:
+        # Another worker stored the same bytes meanwhile; keep theirs
+        bucket.delete(gridfs_id)
+        existing = blobs.find_one_and_update({"_id": digest}, {"$inc": {"ref_count": 1}})
+        return {"storage_id": str(existing["gridfs_id"]), "sha256": digest, "size": size, "deduplicated": True}
+
+    logger.info(f"Stored attachment {filename} ({size} bytes) in GridFS with id {gridfs_id}")
+    return {"storage_id": str(gridfs_id), "sha256": digest, "size": size, "deduplicated": False}
+
+
+def release_attachments(attachments: Iterable[Dict[str, Any]]) -> int:
+    """Drop one reference per stored attachment; a blob left without references is deleted. Returns blobs deleted."""
+    blobs = get_collection(BLOBS_COLLECTION)
+    bucket = None
+    deleted = 0
+    for attachment in attachments:
+        if attachment.get("status") != STATUS_STORED or not attachment.get("sha256"):
+            continue
+        blobs.update_one({"_id": attachment["sha256"]}, {"$inc": {"ref_count": -1}})
+        # Only removed while still unreferenced; a concurrent store re-increments first or uploads anew
+        blob = blobs.find_one_and_delete({"_id": attachment["sha256"], "ref_count": {"$lte": 0}})
+        if blob:
+            bucket = bucket or GridFSBucket(get_db(), bucket_name=ATTACHMENTS_BUCKET)
+            bucket.delete(blob["gridfs_id"])
+            deleted += 1
+    return deleted
+
+
+def ingest_message_attachments(gmail: GmailService, provider_message_id: str, provider: str = "gmail",
+                               previous: Optional[List[Dict[str, Any]]] = None) -> List[Dict[str, Any]]:
+    """
+    Download (per size policy) and store every attachment of one message, then record them on the email.
+    Attachments already stored in `previous` (an earlier run's record) are kept rather than fetched again.
+    """
+    message = gmail.service.users().messages().get(
+        userId="me", id=provider_message_id, format="full", fields="payload(parts)"
+    ).execute()
+
+    # attachmentId changes between messages.get calls, so earlier results are matched by name and size
+    stored_before: Dict[Any, List[Dict[str, Any]]] = {}
+    for attachment in previous or []:
+        if attachment.get("status") == STATUS_STORED:
+            stored_before.setdefault((attachment.get("filename"), attachment.get("size")), []).append(attachment)
+
+    attachments = []
+    for attachment in attachment_parts(message.get("payload", {})):
+        earlier = stored_before.get((attachment["filename"], attachment.get("size")))
+        if earlier:
+            attachments.append({**attachment, **{k: v for k, v in earlier.pop(0).items() if k != "attachmentId"}})
+            continue
+        if (attachment.get("size") or 0) > ATTACHMENT_MAX_BYTES:
+            attachments.append({**attachment, "storage_id": None, "status": STATUS_DEFERRED})
+            continue
+        try:
+            stored = store_attachment_stream(
+                download_attachment(provider_message_id, attachment["attachmentId"], gmail.session(), gmail.root_url),
+                attachment["filename"], attachment.get("mimeType")
+            )
+        except Exception as e:
+            logger.warning(f"Failed to ingest attachment {attachment['filename']} of {provider_message_id}: {e}")
+            attachments.append({**attachment, "storage_id": None, "status": STATUS_FAILED, "error": str(e)})
+            continue
+        attachments.append({**attachment, "storage_id": stored["storage_id"], "sha256": stored["sha256"], "status": STATUS_STORED})
+
+    get_emails_collection().update_one(
+        {"provider": provider, "provider_message_id": provider_message_id},
+        {"$set": {"attachments": attachments, "attachments_ingested_at": datetime.datetime.utcnow()}}
+    )
+    return attachments
+
+
+def _save_checkpoint(**fields):
+    get_collection(SYNC_STATE_COLLECTION).update_one({"_id": ATTACHMENTS_SYNC_KEY}, {"$set": fields}, upsert=True)
+
+
+def ingest_pending_attachments(gmail: GmailService, limit: int = 50, page_size: int = ATTACHMENT_LIST_PAGE_SIZE,
+                               progress_callback: Optional[Callable[[Dict[str, Any]], None]] = None) -> Dict[str, Any]:
+    """
+    Ingest attachments of up to `limit` stored emails that Gmail reports as having
+    attachments and that were not ingested yet, or have failed attachments or
+    deferred ones within ATTACHMENT_MAX_BYTES. The listing is paged from the saved
+    checkpoint, so older messages are reached across runs; after the last page the
+    scan starts again from the newest mail.
+    """
+    state = get_collection(SYNC_STATE_COLLECTION).find_one({"_id": ATTACHMENTS_SYNC_KEY}) or {}
+    page_token = state.get("page_token")
+    counts = {"processed": 0, "pages": 0, STATUS_STORED: 0, STATUS_DEFERRED: 0, STATUS_FAILED: 0, "completed": False}
+
+    while counts["processed"] < limit:
+        listed = gmail.service.users().messages().list(
+            userId="me", q="has:attachment", maxResults=page_size, pageToken=page_token
+        ).execute()
+        counts["pages"] += 1
+        if progress_callback:
+            # Also reported per page, so a scan over already-ingested messages can still be cancelled
+            progress_callback(dict(counts))
+        ids = [m["id"] for m in listed.get("messages", [])]
+        found = {
+            doc["provider_message_id"]: doc.get("attachments")
+            for doc in get_emails_collection().find(
+                {"provider": "gmail", "provider_message_id": {"$in": ids}, **NEEDS_INGEST},
+                {"_id": 0, "provider_message_id": 1, "attachments": 1}
+            )
+        }
+        pending = [msg_id for msg_id in ids if msg_id in found]
+
+        budget = limit - counts["processed"]
+        for msg_id in pending[:budget]:
+            for attachment in ingest_message_attachments(gmail, msg_id, previous=found[msg_id]):
+                counts[attachment["status"]] += 1
+            counts["processed"] += 1
+            if progress_callback:
+                progress_callback(dict(counts))
+        if len(pending) > budget:
+            # Stopped inside this page: the next run lists it again and skips what was ingested
+            break
+
+        # Page done: later runs start after it
+        page_token = listed.get("nextPageToken")
+        _save_checkpoint(page_token=page_token, updated_at=datetime.datetime.utcnow())
+        if not page_token:
+            counts["completed"] = True
+            break
+    return counts
+
+
+# Run Script
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Gmail attachment ingestion")
+    parser.add_argument("task", choices=["ingest"])
+    parser.add_argument("--limit", type=int, default=50)
+    args = parser.parse_args()
+    print(ingest_pending_attachments(GmailService(), limit=args.limit))
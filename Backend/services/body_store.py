@@ -0,0 +1,159 @@
+"""
+Cold storage for email bodies and raw headers.
+
+The emails collection keeps only the fields that list, filter and
+classification queries read. body_plain, body_html and headers are
+compressed into one blob per message in the `email_bodies` collection, or
+in GridFS when the compressed blob is larger than BODY_STORE_GRIDFS_THRESHOLD,
+and are loaded only where the full text is needed.
+"""
+import datetime
+import json
+import zlib
+from typing import Any, Dict, Iterable, List, Tuple
+
+from bson import Binary
+from gridfs import GridFSBucket
+from pymongo import ReplaceOne
+
+from services.mongo import get_db, get_collection
+from services.logger import get_logger
+from config.settings import BODY_STORE_CODEC, BODY_STORE_COMPRESSION_LEVEL, BODY_STORE_GRIDFS_THRESHOLD
+
+try:
+    import zstandard
+except ImportError:  # optional; zlib is always available
+    zstandard = None
+
+logger = get_logger(__name__)
+
+BODIES_COLLECTION = "email_bodies"
+BODIES_BUCKET = "email_bodies_fs"
+# Fields that live in the body store rather than on the email document
+COLD_FIELDS = ("body_plain", "body_html", "headers")
+
+
+def body_key(provider: str, provider_message_id: str) -> str:
+    return f"{provider}:{provider_message_id}"
+
+
+def _codec() -> str:
+    if BODY_STORE_CODEC == "zstd" and zstandard is None:
+        logger.warning("BODY_STORE_CODEC=zstd but zstandard is not installed; using zlib")
+        return "zlib"
+    return BODY_STORE_CODEC
+
+
+def compress(data: bytes, codec: str) -> bytes:
+    if codec == "zstd":
+        return zstandard.ZstdCompressor(level=BODY_STORE_COMPRESSION_LEVEL).compress(data)
+    return zlib.compress(data, BODY_STORE_COMPRESSION_LEVEL)
+
+
+def decompress(data: bytes, codec: str) -> bytes:
+    if codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError("Body was stored with zstd but zstandard is not installed")
+        return zstandard.ZstdDecompressor().decompress(data)
+    return zlib.decompress(data)
+
+
+def split_email(doc: Dict[str, Any]) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """Return (hot document, cold fields). The hot side keeps a has_list_unsubscribe flag for the rules."""
+    hot = {k: v for k, v in doc.items() if k not in COLD_FIELDS}
+    cold = {k: doc[k] for k in COLD_FIELDS if doc.get(k)}
+    hot["has_list_unsubscribe"] = bool((doc.get("headers") or {}).get("List-Unsubscribe"))
+    return hot, cold
+
+
+def put_bodies(docs: Iterable[Dict[str, Any]]) -> int:
+    """
+    Compress and upsert the cold fields of sanitized email documents; returns how many were written.
+    A stored body is only replaced by a larger one (e.g. a full fetch after a metadata-only fetch),
+    so re-fetching the same messages does not rewrite their blobs.
+    """
+    codec = _codec()
+    collection = get_collection(BODIES_COLLECTION)
+    bucket = None
+    ops = []
+
+    pending = []
+    for doc in docs:
+        _, cold = split_email(doc)
+        if cold:
+            pending.append((body_key(doc["provider"], doc["provider_message_id"]), cold))
+    if not pending:
+        return 0
+    existing = {r["_id"]: r for r in collection.find({"_id": {"$in": [key for key, _ in pending]}}, {"size": 1, "gridfs_id": 1})}
+
+    for key, cold in pending:
+        raw = json.dumps(cold, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        previous = existing.get(key)
+        if previous and previous.get("size", 0) >= len(raw):
+            continue
+        blob = compress(raw, codec)
+        record = {
+            "_id": key,
+            "codec": codec,
+            "size": len(raw),
+            "stored_size": len(blob),
+            "updated_at": datetime.datetime.utcnow(),
+        }
+        if len(blob) > BODY_STORE_GRIDFS_THRESHOLD or (previous and "gridfs_id" in previous):
+            bucket = bucket or GridFSBucket(get_db(), bucket_name=BODIES_BUCKET)
+        if previous and "gridfs_id" in previous:
+            bucket.delete(previous["gridfs_id"])
+        if len(blob) > BODY_STORE_GRIDFS_THRESHOLD:
+            record["gridfs_id"] = bucket.upload_from_stream(key, blob)
+        else:
+            record["blob"] = Binary(blob)
+        ops.append(ReplaceOne({"_id": key}, record, upsert=True))
+
+    if ops:
+        collection.bulk_write(ops, ordered=False)
+    return len(ops)
+
+
+def _decode(record: Dict[str, Any]) -> Dict[str, Any]:
+    if "gridfs_id" in record:
+        blob = GridFSBucket(get_db(), bucket_name=BODIES_BUCKET).open_download_stream(record["gridfs_id"]).read()
+    else:
+        blob = bytes(record["blob"])
+    return json.loads(decompress(blob, record.get("codec", "zlib")))
+
+
+def get_bodies(keys: List[Tuple[str, str]]) -> Dict[Tuple[str, str], Dict[str, Any]]:
+    """Cold fields for many (provider, provider_message_id) keys in one query"""
+    by_id = {body_key(*key): key for key in keys}
+    if not by_id:
+        return {}
+    return {
+        by_id[record["_id"]]: _decode(record)
+        for record in get_collection(BODIES_COLLECTION).find({"_id": {"$in": list(by_id)}})
+    }
+
+
+def get_body(provider: str, provider_message_id: str) -> Dict[str, Any]:
+    return get_bodies([(provider, provider_message_id)]).get((provider, provider_message_id), {})
+
+
+def attach_bodies(emails: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Load the cold fields onto hot email dicts in place (one round trip for the whole list)"""
+    keys = [(e.get("provider", "gmail"), e["provider_message_id"]) for e in emails if not any(f in e for f in COLD_FIELDS)]
+    bodies = get_bodies(keys)
+    for e in emails:
+        e.update(bodies.get((e.get("provider", "gmail"), e["provider_message_id"]), {}))
+    return emails
+
+
+def delete_bodies(keys: List[Tuple[str, str]]) -> int:
+    ids = [body_key(*key) for key in keys]
+    if not ids:
+        return 0
+    collection = get_collection(BODIES_COLLECTION)
+    stored_in_gridfs = [r["gridfs_id"] for r in collection.find({"_id": {"$in": ids}, "gridfs_id": {"$exists": True}}, {"gridfs_id": 1})]
+    if stored_in_gridfs:
+        bucket = GridFSBucket(get_db(), bucket_name=BODIES_BUCKET)
+        for file_id in stored_in_gridfs:
+            bucket.delete(file_id)
+    return collection.delete_many({"_id": {"$in": ids}}).deleted_count
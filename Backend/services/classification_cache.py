@@ -0,0 +1,129 @@
+import datetime
+import hashlib
+import re
+import threading
+from collections import OrderedDict
+from email.utils import parseaddr
+from typing import Dict, Any, List, Optional
+
+from services.mongo import get_collection
+from services.logger import get_logger
+from services.metrics import CLASSIFICATION_CACHE_HITS, CLASSIFICATION_CACHE_MISSES
+from config.settings import CLASSIFICATION_CACHE_SIZE
+
+logger = get_logger(__name__)
+
+CACHE_COLLECTION = "classification_cache"
+
+_URL = re.compile(r"https?://\S+")
+_DIGITS = re.compile(r"\d+")
+_SPACES = re.compile(r"\s+")
+_REPLY_PREFIX = re.compile(r"^((re|fwd?|aw|wg)\s*:\s*)+", re.IGNORECASE)
+
+# Only the start of the body is fingerprinted; trailing footers vary per copy
+BODY_FINGERPRINT_CHARS = 2000
+# Copies differ in amounts, dates and order numbers, so only the label is shared; summary and reasoning are per email
+CACHED_FIELDS = ("category", "confidence")
+
+
+def _normalize(text: str) -> str:
+    text = _URL.sub(" ", text or "")
+    text = _DIGITS.sub("#", text)
+    return _SPACES.sub(" ", text).strip().lower()
+
+
+def shareable(classification: Dict[str, Any]) -> Dict[str, Any]:
+    """The part of a classification that holds for every email with the same fingerprint"""
+    return {field: classification[field] for field in CACHED_FIELDS if field in classification}
+
+
+def fingerprint(email: Dict[str, Any], version: str) -> str:
+    """
+    Content fingerprint of subject, sender and body plus the prompt/model version.
+    Numbers, URLs, case, whitespace and reply prefixes are normalized away so
+    copies of the same newsletter or notification map to one key. Copies can
+    still differ in those details, so a hit only carries CACHED_FIELDS.
+    """
+    subject = _normalize(_REPLY_PREFIX.sub("", email.get("subject") or ""))
+    sender = parseaddr(email.get("from") or "")[1].lower()
+    body = email.get("body_plain") or email.get("body_html") or email.get("snippet") or ""
+    body = _normalize(body[:BODY_FINGERPRINT_CHARS])
+    key = "\x1f".join([version, subject, sender, body])
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+
+class ClassificationCache:
+    """Two-tier cache: in-process LRU in front of a Mongo collection with a TTL index."""
+
+    def __init__(self, max_size: int = CLASSIFICATION_CACHE_SIZE):
+        self.max_size = max_size
+        self._lru: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._counters = {"memory_hits": 0, "persistent_hits": 0, "misses": 0}
+
+    def _remember(self, key: str, classification: Dict[str, Any]):
+        with self._lock:
+            self._lru[key] = classification
+            self._lru.move_to_end(key)
+            while len(self._lru) > self.max_size:
+                self._lru.popitem(last=False)
+
+    def get_many(self, keys: List[str]) -> Dict[str, Dict[str, Any]]:
+        """Look up several fingerprints; the persistent tier is queried once for all LRU misses."""
+        found: Dict[str, Dict[str, Any]] = {}
+        pending = []
+        with self._lock:
+            for key in dict.fromkeys(keys):
+                if key in self._lru:
+                    self._lru.move_to_end(key)
+                    found[key] = self._lru[key]
+                    self._counters["memory_hits"] += 1
+                else:
+                    pending.append(key)
+        CLASSIFICATION_CACHE_HITS.labels("memory").inc(len(found))
+
+        if pending:
+            for doc in get_collection(CACHE_COLLECTION).find({"_id": {"$in": pending}}):
+                # Entries written before CACHED_FIELDS may still hold another email's summary
+                found[doc["_id"]] = shareable(doc["classification"])
+                self._remember(doc["_id"], found[doc["_id"]])
+            with self._lock:
+                persistent_hits = sum(1 for key in pending if key in found)
+                self._counters["persistent_hits"] += persistent_hits
+                self._counters["misses"] += len(pending) - persistent_hits
+            CLASSIFICATION_CACHE_HITS.labels("persistent").inc(persistent_hits)
+            CLASSIFICATION_CACHE_MISSES.inc(len(pending) - persistent_hits)
+        return found
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        return self.get_many([key]).get(key)
+
+    def put(self, key: str, classification: Dict[str, Any]):
+        classification = shareable(classification)
+        self._remember(key, classification)
+        get_collection(CACHE_COLLECTION).update_one(
+            {"_id": key},
+            {"$set": {"classification": classification, "created_at": datetime.datetime.utcnow()}},
+            upsert=True
+        )
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            counters = dict(self._counters)
+            counters["memory_entries"] = len(self._lru)
+        lookups = counters["memory_hits"] + counters["persistent_hits"] + counters["misses"]
+        counters["hit_rate"] = round((lookups - counters["misses"]) / lookups, 3) if lookups else 0.0
+        return counters
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_classification_cache() -> ClassificationCache:
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = ClassificationCache()
+    return _cache
@@ -1,7 +1,20 @@
 import os
-from typing import List, Dict, Any
+import json
+import asyncio
+import threading
+from typing import List, Dict, Any, Optional, Callable, Awaitable
 from datetime import datetime
-from services.db_service import get_unclassified_emails, update_email_classification
+from config.settings import (
+    CLASSIFIER_CONCURRENCY, CLASSIFIER_REQUESTS_PER_MINUTE, CLASSIFIER_BATCH_SIZE, CLASSIFIER_BATCH_TOKEN_BUDGET,
+    CLASSIFIER_BODY_TOKEN_BUDGET
+)
+from services.db_service import get_unclassified_emails, buffer_email_classification, get_classification_buffer, record_classification_attempts
+from services.classification_cache import get_classification_cache, fingerprint, shareable
+from services.body_store import attach_bodies
+from services.rules import get_rule_engine
+from services.local_classifier import get_local_classifier
+from services.metrics import LLMMetricsHandler, EMAILS_CLASSIFIED, RATE_LIMIT_WAIT_SECONDS
+from utils.parser import compact_email_text
 from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain.prompts import ChatPromptTemplate
 
@@ -19,9 +32,15 @@ CATEGORIES = [
 
 os.environ["GOOGLE_API_KEY"] = os.getenv("GEMINI_API_KEY", "")
 
+CLASSIFIER_MODEL = "gemini-2.5-flash"
+# Bump whenever the prompts change so cached classifications from older prompts are not reused
+PROMPT_VERSION = "2"
+CACHE_VERSION = f"{CLASSIFIER_MODEL}:{PROMPT_VERSION}"
+
 llm = ChatGoogleGenerativeAI(
-    model="gemini-2.5-flash",
-    temperature=0.2
+    model=CLASSIFIER_MODEL,
+    temperature=0.2,
+    callbacks=[LLMMetricsHandler("classifier")]
 )
 
 classifier_prompt = ChatPromptTemplate.from_template(
@@ -60,72 +79,377 @@ Email Details:
 """
 )
 
-# 🔹 Classify Function (updated for reasoning)
-def classify_email(email: Dict[str, Any]) -> Dict[str, Any]:
-    """Classify a single email using Gemini with reasoning + confidence."""
-    chain = classifier_prompt | llm
-    result = chain.invoke({
+batch_classifier_prompt = ChatPromptTemplate.from_template(
+"""
+You are a highly accurate email classification agent.
+
+Classify EACH of the emails below into ONE of the following categories:
+{categories}
+
+Guidelines:
+- Always choose the BEST possible category, even if the email is ambiguous.
+- Use ALL available context (subject, snippet, body, sender, labels, etc.).
+- Be consistent across similar emails.
+- Confidence should reflect how strongly the text fits the chosen category (0.0 = guess, 1.0 = very certain).
+
+Return ONLY a JSON array with exactly one object per email, each with the fields:
+- provider_message_id: copied unchanged from the input email
+- category: the chosen category (string, must be from the provided list)
+- confidence: a number between 0 and 1
+- reasoning: a short sentence explaining why you chose this category
+- summary: a brief summary of the email content (1-2 sentences)
+
+Emails (JSON):
+{emails}
+"""
+)
+
+def _prompt_body(email: Dict[str, Any]) -> str:
+    # Compact text instead of raw markup, quotes and footers
+    return compact_email_text(email.get("body_plain", ""), email.get("body_html", ""), CLASSIFIER_BODY_TOKEN_BUDGET,
+                              bulk=bool(email.get("has_list_unsubscribe")))
+
+def _prompt_inputs(email: Dict[str, Any]) -> Dict[str, Any]:
+    return {
         "categories": CATEGORIES,
         "subject": email.get("subject", ""),
         "sender": email.get("from", ""),   # ✅ added sender
         "snippet": email.get("snippet", ""),
-        "body": email.get("body_plain", "") or email.get("body_html", "")
-    })
+        "body": _prompt_body(email)
+    }
 
-    raw_output = result.content.strip()
+def _strip_code_fence(raw_output: str) -> str:
+    raw_output = raw_output.strip()
 
     # Clean markdown wrappers like ```json ... ```
     if raw_output.startswith("```"):
         raw_output = raw_output.strip("`").replace("json", "", 1).strip()
+    return raw_output
+
+def _parse_classification(email: Dict[str, Any], raw_output: str) -> Optional[Dict[str, Any]]:
+    """None when the output is not a valid classification; it must not be cached or stored."""
+    raw_output = _strip_code_fence(raw_output)
 
     try:
-        import json
-        classification = json.loads(raw_output)
+        classification = _coerce_classification(json.loads(raw_output))
+    except Exception:
+        classification = None
+    if classification is None:
+        print(f"[ERROR] Failed to parse classification result: {raw_output[:200]}")
+        return None
+
+    # Print confirmation (for logs/debugging)
+    print(f"[CLASSIFIED] {email.get('subject', '')[:40]}... → {classification['category']} "
+          f"(confidence: {classification['confidence']:.2f}) | reason: {classification['reasoning']} | summary: {classification['summary']}")
+    return classification
 
-        category = classification.get("category", "Other")
-        confidence = float(classification.get("confidence", 0.5))
-        reasoning = classification.get("reasoning", "No reasoning provided")
-        summary = classification.get("summary", "")
+# 🔹 Classify Function (updated for reasoning)
+def classify_email(email: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Classify a single email using Gemini with reasoning + confidence (None if the reply did not parse)."""
+    chain = classifier_prompt | llm
+    result = chain.invoke(_prompt_inputs(email))
+    return _parse_classification(email, result.content)
 
-    except Exception as e:
-        print(f"[ERROR] Failed to parse classification result: {raw_output}")
-        category, confidence, reasoning, summary = "Other", 0.5, "Parsing error", ""
+async def classify_email_async(email: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Async variant of classify_email using the LLM's ainvoke."""
+    chain = classifier_prompt | llm
+    result = await chain.ainvoke(_prompt_inputs(email))
+    return _parse_classification(email, result.content)
 
-    # Print confirmation (for logs/debugging)
-    print(f"[CLASSIFIED] {email.get('subject', '')[:40]}... → {category} "
-          f"(confidence: {confidence:.2f}) | reason: {reasoning} | summary: {summary}")
+# 🔹 Batched classification (K emails per prompt)
+def _estimate_tokens(text: str) -> int:
+    # ~4 characters per token is close enough for budgeting prompts
+    return len(text) // 4 + 1
 
+def _batch_entry(email: Dict[str, Any]) -> Dict[str, Any]:
     return {
-        "category": category,
+        "provider_message_id": email.get("provider_message_id"),
+        "subject": email.get("subject", ""),
+        "from": email.get("from", ""),
+        "snippet": email.get("snippet", ""),
+        "body": _prompt_body(email),
+    }
+
+def pack_batches(emails: List[Dict[str, Any]], batch_size: int, token_budget: int) -> List[List[int]]:
+    """Greedily group email indexes into batches of at most `batch_size` emails and `token_budget` prompt tokens."""
+    batches: List[List[int]] = []
+    current: List[int] = []
+    current_tokens = 0
+    for i, email in enumerate(emails):
+        tokens = _estimate_tokens(json.dumps(_batch_entry(email), ensure_ascii=False))
+        if current and (len(current) >= batch_size or current_tokens + tokens > token_budget):
+            batches.append(current)
+            current, current_tokens = [], 0
+        current.append(i)
+        current_tokens += tokens
+    if current:
+        batches.append(current)
+    return batches
+
+def _coerce_classification(item: Any) -> Optional[Dict[str, Any]]:
+    """Validate one entry of a batch response; None means it must be retried."""
+    if not isinstance(item, dict) or item.get("category") not in CATEGORIES:
+        return None
+    try:
+        confidence = float(item.get("confidence"))
+    except (TypeError, ValueError):
+        return None
+    return {
+        "category": item["category"],
         "confidence": confidence,
-        "reasoning": reasoning,
-        "summary": summary
+        "reasoning": item.get("reasoning", "No reasoning provided"),
+        "summary": item.get("summary", ""),
     }
 
+def _parse_batch_classification(raw_output: str) -> Dict[str, Dict[str, Any]]:
+    try:
+        items = json.loads(_strip_code_fence(raw_output))
+    except Exception:
+        print(f"[ERROR] Failed to parse batch classification result: {raw_output[:200]}")
+        return {}
+    if not isinstance(items, list):
+        return {}
+
+    parsed = {}
+    for item in items:
+        classification = _coerce_classification(item)
+        if classification is not None:
+            parsed[str(item.get("provider_message_id"))] = classification
+    return parsed
+
+async def classify_batch_async(emails: List[Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+    """Classify several emails with one LLM call. Returns {provider_message_id: classification} for the entries that parsed."""
+    chain = batch_classifier_prompt | llm
+    result = await chain.ainvoke({
+        "categories": CATEGORIES,
+        "emails": json.dumps([_batch_entry(e) for e in emails], ensure_ascii=False, indent=1),
+    })
+    parsed = _parse_batch_classification(result.content)
+    for email in emails:
+        classification = parsed.get(str(email.get("provider_message_id")))
+        if classification:
+            print(f"[CLASSIFIED] {email.get('subject', '')[:40]}... → {classification['category']} "
+                  f"(confidence: {classification['confidence']:.2f}) [batch of {len(emails)}]")
+    return parsed
+
+# 🔹 Rate limiting
+class RateLimiter:
+    """Spaces out acquisitions so at most `requests_per_minute` start per minute."""
+
+    def __init__(self, requests_per_minute: int):
+        self.interval = 60.0 / requests_per_minute if requests_per_minute > 0 else 0.0
+        self._next_slot = 0.0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        if not self.interval:
+            return
+        async with self._lock:
+            loop = asyncio.get_running_loop()
+            now = loop.time()
+            wait = self._next_slot - now
+            self._next_slot = max(now, self._next_slot) + self.interval
+        RATE_LIMIT_WAIT_SECONDS.labels("classifier").observe(max(0.0, wait))
+        if wait > 0:
+            await asyncio.sleep(wait)
+
 # 🔹 Main Agent Function
-import time
+async def classify_emails_async(
+    emails: List[Dict[str, Any]],
+    concurrency: int = CLASSIFIER_CONCURRENCY,
+    requests_per_minute: int = CLASSIFIER_REQUESTS_PER_MINUTE,
+    batch_size: int = CLASSIFIER_BATCH_SIZE,
+    token_budget: int = CLASSIFIER_BATCH_TOKEN_BUDGET,
+    on_result: Optional[Callable[[Dict[str, Any], Dict[str, Any]], Awaitable[None]]] = None,
+) -> List[Optional[Dict[str, Any]]]:
+    """
+    Classify `emails` with bounded concurrency and a shared rate limit.
+    Returns classifications aligned with `emails` (None where classification failed).
+    `on_result(email, classification)` is awaited as each email completes.
+    """
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+    limiter = RateLimiter(requests_per_minute)
+    results: List[Optional[Dict[str, Any]]] = [None] * len(emails)
+
+    async def finish(i: int, classification: Dict[str, Any]):
+        results[i] = classification
+        if on_result:
+            await on_result(emails[i], classification)
 
-def classify_unclassified_emails(limit: int = 5, delay: int = 6):
-    emails = get_unclassified_emails()
-    classified = []
+    async def classify_one(i: int):
+        async with semaphore:
+            await limiter.acquire()
+            email = emails[i]
+            print(f"\n[PROCESSING {i+1}/{len(emails)}] From: {email.get('from')} | Subject: {email.get('subject', '')[:50]}")
+            try:
+                classification = await classify_email_async(email)
+            except Exception as e:
+                # Leave the email unclassified so the next run picks it up
+                print(f"[ERROR] Classification failed for {email.get('provider_message_id')}: {e}")
+                return
+        if classification is None:
+            # Unparseable output: nothing is cached or written, so the email stays pending for a retry
+            return
+        # Write back as soon as this email is done, outside the LLM slot
+        await finish(i, classification)
+
+    async def classify_group(indexes: List[int]):
+        async with semaphore:
+            await limiter.acquire()
+            print(f"\n[PROCESSING BATCH] {len(indexes)} emails")
+            try:
+                parsed = await classify_batch_async([emails[i] for i in indexes])
+            except Exception as e:
+                print(f"[ERROR] Batch classification failed: {e}")
+                parsed = {}
+        retry = []
+        for i in indexes:
+            classification = parsed.get(str(emails[i].get("provider_message_id")))
+            if classification:
+                await finish(i, classification)
+            else:
+                retry.append(i)
+        # Only entries the model dropped or garbled go back through the single-email path
+        await asyncio.gather(*(classify_one(i) for i in retry))
+
+    if batch_size <= 1:
+        await asyncio.gather(*(classify_one(i) for i in range(len(emails))))
+    else:
+        await asyncio.gather(*(classify_group(group) for group in pack_batches(emails, batch_size, token_budget)))
+    return results
+
+async def classify_unclassified_emails_async(
+    limit: int = 5,
+    concurrency: int = CLASSIFIER_CONCURRENCY,
+    requests_per_minute: int = CLASSIFIER_REQUESTS_PER_MINUTE,
+    batch_size: int = CLASSIFIER_BATCH_SIZE,
+    progress_callback: Optional[Callable[[Dict[str, Any]], None]] = None,
+) -> List[Dict[str, Any]]:
+    """
+    Classify up to `limit` pending emails through the rules, local, cache and LLM tiers.
+    `progress_callback(progress)` is called after every classified email; an exception
+    it raises (e.g. a cancellation) aborts the run.
+    """
+    emails = await asyncio.to_thread(get_unclassified_emails, limit)
     if not emails:
         print("[INFO] No unclassified emails found ✅")
         return []
 
-    for i, email in enumerate(emails[:limit]):
-        print(f"\n[PROCESSING {i+1}/{limit}] From: {email.get('from')} | Subject: {email.get('subject', '')[:50]}")
-        classification = classify_email(email)
-        update_email_classification(
-            provider_message_id=email["provider_message_id"],
+    results: List[Optional[Dict[str, Any]]] = [None] * len(emails)
+    tier_counts: Dict[str, int] = {}
+
+    async def write_back(i: int, classification: Dict[str, Any]):
+        results[i] = classification
+        # Queued in memory; flushed in bulk by the write-behind buffer
+        buffer_email_classification(
+            provider_message_id=emails[i]["provider_message_id"],
             category=classification["category"],
             confidence=classification["confidence"],
             reasoning=classification["reasoning"],
-            summary=classification["summary"]
+            summary=classification["summary"],
+            tier=classification["tier"],
+            provider=emails[i].get("provider", "gmail")
         )
-        classified.append({**email, **classification})
-        time.sleep(delay)  # prevent hitting quota
+        tier_counts[classification["tier"]] = tier_counts.get(classification["tier"], 0) + 1
+        EMAILS_CLASSIFIED.labels(classification["tier"]).inc()
+        if progress_callback:
+            progress_callback({"total": len(emails), "processed": sum(tier_counts.values()), "tiers": dict(tier_counts)})
+
+    # Tier 1: deterministic rules on labels and headers, then the local model above its threshold
+    rules = get_rule_engine(CATEGORIES)
+    local_model = get_local_classifier()
+    undecided = []
+    for i, email in enumerate(emails):
+        decision = rules.classify(email) if rules else None
+        if decision is None and local_model:
+            decision = local_model.classify(email)
+        if decision:
+            await write_back(i, decision)
+        else:
+            undecided.append(i)
+
+    # Bodies are only needed from here on (fingerprints and prompts); load them in one query
+    await asyncio.to_thread(attach_bodies, [emails[i] for i in undecided])
+
+    # Tier 2: cache hits are written back without an LLM call
+    cache = get_classification_cache()
+    keys = {i: fingerprint(emails[i], CACHE_VERSION) for i in undecided}
+    cached = await asyncio.to_thread(cache.get_many, list(keys.values()))
+
+    # Identical uncached copies share one LLM call
+    pending: Dict[str, List[int]] = {}
+    for i, key in keys.items():
+        if key not in cached:
+            pending.setdefault(key, []).append(i)
+
+    def reuse(i: int, classification: Dict[str, Any], tier: str) -> Dict[str, Any]:
+        # Label from the matching email; summary from this email, as the rule and local tiers do
+        return {**shareable(classification), "reasoning": "Same content as an earlier classified email",
+                "summary": (emails[i].get("snippet") or "")[:200], "tier": tier}
+
+    await asyncio.gather(*(write_back(i, reuse(i, cached[key], "cache")) for i, key in keys.items() if key in cached))
+
+    # Tier 3: LLM for everything still ambiguous
+    representatives = [indexes[0] for indexes in pending.values()]
+    key_by_message_id = {emails[i]["provider_message_id"]: keys[i] for i in representatives}
+
+    async def on_llm_result(email: Dict[str, Any], classification: Dict[str, Any]):
+        key = key_by_message_id[email["provider_message_id"]]
+        await asyncio.to_thread(cache.put, key, classification)
+        await asyncio.gather(*(
+            write_back(i, {**classification, "tier": "llm"} if i == pending[key][0] else reuse(i, classification, "llm"))
+            for i in pending[key]
+        ))
+
+    await classify_emails_async(
+        [emails[i] for i in representatives],
+        concurrency=concurrency,
+        requests_per_minute=requests_per_minute,
+        batch_size=batch_size,
+        on_result=on_llm_result,
+    )
+    # Emails the LLM failed on stay pending; counting the attempt moves them behind untried ones
+    failed = [emails[i] for indexes in pending.values() for i in indexes if results[i] is None]
+    if failed:
+        await asyncio.to_thread(record_classification_attempts, failed)
+    # Persist this run's results before reporting them
+    flush_result = await asyncio.to_thread(get_classification_buffer().flush)
+    if flush_result["failures"]:
+        print(f"[ERROR] {len(flush_result['failures'])} classification writes failed")
+
+    tiers = [r["tier"] for r in results if r]
+    print(f"[TIERS] rules: {tiers.count('rules')}, local: {tiers.count('local')}, cache: {tiers.count('cache')}, llm: {tiers.count('llm')} "
+          f"({len(representatives)} emails sent to the LLM)")
     print("\n[FINISHED] Classification batch completed ✅")
-    return classified
+    return [{**email, **classification} for email, classification in zip(emails, results) if classification is not None]
+
+# 🔹 Event loop for synchronous callers
+# The Gemini client keeps its grpc-aio channel bound to the loop of its first async call,
+# so every run goes through one long-lived loop instead of a fresh asyncio.run() loop
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_loop_lock = threading.Lock()
+
+def get_classifier_loop() -> asyncio.AbstractEventLoop:
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="classifier-loop", daemon=True).start()
+    return _loop
+
+def classify_unclassified_emails(
+    limit: int = 5,
+    concurrency: int = CLASSIFIER_CONCURRENCY,
+    requests_per_minute: int = CLASSIFIER_REQUESTS_PER_MINUTE,
+    batch_size: int = CLASSIFIER_BATCH_SIZE,
+    progress_callback: Optional[Callable[[Dict[str, Any]], None]] = None,
+) -> List[Dict[str, Any]]:
+    """Synchronous entry point; runs the async engine to completion on the classifier loop."""
+    future = asyncio.run_coroutine_threadsafe(
+        classify_unclassified_emails_async(limit, concurrency, requests_per_minute, batch_size, progress_callback),
+        get_classifier_loop()
+    )
+    return future.result()
 
 # 🔹 Run Script
 if __name__ == "__main__":
@@ -1,38 +1,23 @@
-import os
 import datetime
-from typing import List, Dict, Any
-from email.utils import parsedate_to_datetime
+import threading
+import uuid
+from typing import List, Dict, Any, Iterable, Iterator, Optional, Tuple
+from email.utils import parsedate_to_datetime, parseaddr
 
-from pymongo import MongoClient, UpdateOne
-from pymongo.errors import ServerSelectionTimeoutError
-from gridfs import GridFS
+from pymongo import UpdateOne
 from pydantic import BaseModel, Field
 from services.logger import get_logger
-from config.settings import MONGO_URI as SETTINGS_MONGO_URI, MONGO_DB as SETTINGS_MONGO_DB, MONGO_COLLECTION as SETTINGS_MONGO_COLLECTION
-
-MONGO_URI = SETTINGS_MONGO_URI
-MONGO_DB = SETTINGS_MONGO_DB
-MONGO_COLLECTION = SETTINGS_MONGO_COLLECTION
-
-try:
-    client = MongoClient(MONGO_URI, serverSelectionTimeoutMS=5000)
-    client.server_info()  # verify connection
-    db = client[MONGO_DB]
-    emails_collection = db[MONGO_COLLECTION]
-    print("Mongodb connected")
-except ServerSelectionTimeoutError as e:
-    print("Mongodb connection failed")
-    raise e
-
-# Ensure indexes
-emails_collection.create_index(
-    [("provider", 1), ("provider_message_id", 1)],
-    unique=True,
-    name="provider_msgid_unique"
-)
-emails_collection.create_index("date", name="date_idx")
-emails_collection.create_index("from", name="from_idx")
-emails_collection.create_index("labels", name="labels_idx")
+from services.metrics import timed_mongo
+from services.mongo import get_collection, get_emails_collection, get_responses_collection
+from services.write_buffer import BulkWriteBuffer, register_buffer
+from services.pagination import keyset_page
+from services.body_store import split_email, put_bodies, delete_bodies
+from services.stats_service import record_emails_inserted, record_emails_classified, record_emails_deleted
+from services.attachment_service import store_attachment_stream, release_attachments
+from services.thread_service import mark_threads_stale
+from config.settings import CLASSIFIER_MAX_ATTEMPTS
+
+logger = get_logger(__name__)
 
 # EMAIL SCHEMA
 class AttachmentModel(BaseModel):
@@ -41,6 +26,8 @@ class AttachmentModel(BaseModel):
     size: int = None
     attachmentId: str = None
     storage_id: str = None
+    sha256: str = None
+    status: str = None  # stored | deferred | failed, set by attachment_service
 
 class EmailModel(BaseModel):
     provider: str
@@ -53,9 +40,8 @@ class EmailModel(BaseModel):
     bcc: List[str] = []
     subject: str = ""
     snippet: str = ""
-    body_plain: str = ""
-    body_html: str = ""
-    headers: Dict[str, str] = {}
+    # body_plain, body_html and headers are kept compressed in the body store (services/body_store.py)
+    has_list_unsubscribe: bool = False
     labels: List[str] = []
     attachments: List[AttachmentModel] = []
     date: datetime.datetime = None
@@ -69,12 +55,27 @@ class EmailModel(BaseModel):
         arbitrary_types_allowed = True
         json_encoders = {datetime.datetime: lambda v: v.isoformat()}
 
+# Indexed classification state, maintained on upsert and on classification
+STATE_PENDING = "pending"
+STATE_CLASSIFIED = "classified"
+
+# Fields the classifier reads; everything else stays on the server
+CLASSIFICATION_PROJECTION = {
+    "_id": 0, "provider": 1, "provider_message_id": 1, "thread_id": 1, "from": 1, "to": 1,
+    "subject": 1, "snippet": 1, "has_list_unsubscribe": 1, "labels": 1, "date": 1,
+}
+
 # HELPER FUNCTIONS
 def _parse_date(value):
     if not value:
         return None
     if isinstance(value, datetime.datetime):
         return value
+    if isinstance(value, str) and value.isdigit():
+        # Gmail internalDate: epoch milliseconds as a string
+        value = int(value) / 1000
+    if isinstance(value, (int, float)):
+        return datetime.datetime.fromtimestamp(value, tz=datetime.timezone.utc)
     try:
         return parsedate_to_datetime(value)
     except Exception:
@@ -91,6 +92,7 @@ def _sanitize_email(raw: Dict[str, Any], provider: str) -> Dict[str, Any]:
     doc['thread_id'] = raw.get('threadId') or raw.get('thread_id')
     doc['mailbox'] = raw.get('mailbox') or raw.get('mail_to') or raw.get('to')
     doc['from'] = raw.get('from') or raw.get('sender') or raw.get('from_email')
+    doc['sender_address'] = parseaddr(doc['from'] or "")[1].lower()  # indexed for sender filters
     doc['to'] = raw.get('to') if isinstance(raw.get('to'), list) else (raw.get('to_list') or ([raw.get('to')] if raw.get('to') else []))
     doc['cc'] = raw.get('cc') or []
     doc['bcc'] = raw.get('bcc') or []
@@ -117,126 +119,323 @@ def _sanitize_email(raw: Dict[str, Any], provider: str) -> Dict[str, Any]:
 
 
 # CRUD OPERATIONS
-def bulk_upsert_emails(raw_emails: List[Dict[str, Any]], provider: str = "gmail") -> Dict[str,int]:
-    """Bulk upsert emails into MongoDB"""
-    ops = []
-    for raw in raw_emails:
-        doc = _sanitize_email(raw, provider)
-        if not doc.get('provider_message_id'):
-            continue
-
-        filter_q = {"provider": doc['provider'], "provider_message_id": doc['provider_message_id']}
-
-        update_doc = {k: v for k, v in doc.items() if k not in ["classifications", "metadata"]}
-        update = {
-            "$set": update_doc,
-            "$setOnInsert": {
-                "created_at": datetime.datetime.utcnow(),
-                "classifications": doc.get("classifications", {}),  # only set if new insert
-                "metadata": doc.get("metadata", {}),
-            }
+def _upsert_op(doc: Dict[str, Any]) -> UpdateOne:
+    filter_q = {"provider": doc['provider'], "provider_message_id": doc['provider_message_id']}
+
+    # attachments are only seeded on insert; ingestion fills in their storage_ids later
+    update_doc = {k: v for k, v in doc.items() if k not in ["classifications", "metadata", "attachments"]}
+    update = {
+        "$set": update_doc,
+        "$setOnInsert": {
+            "created_at": datetime.datetime.utcnow(),
+            "attachments": doc.get("attachments", []),
+            "classifications": doc.get("classifications", {}),  # only set if new insert
+            "classification_state": STATE_CLASSIFIED if doc.get("classifications", {}).get("category") else STATE_PENDING,
+            "metadata": doc.get("metadata", {}),
         }
+    }
+    return UpdateOne(filter_q, update, upsert=True)
 
-        ops.append(UpdateOne(filter_q, update, upsert=True))
+def iter_sanitized_emails(raw_emails: Iterable[Dict[str, Any]], provider: str = "gmail") -> Iterator[Dict[str, Any]]:
+    """Lazily sanitize raw emails, dropping ones without a message id"""
+    for raw in raw_emails:
+        doc = _sanitize_email(raw, provider)
+        if doc.get('provider_message_id'):
+            yield doc
 
-    if not ops:
+@timed_mongo
+def bulk_upsert_docs(docs: List[Dict[str, Any]]) -> Dict[str,int]:
+    """Bulk upsert already-sanitized email documents"""
+    if not docs:
         return {"upserted_count": 0, "modified_count": 0}
 
-    result = emails_collection.bulk_write(ops, ordered=False)
+    # Bodies first, so an email is never visible without its body
+    put_bodies(docs)
+    ops = [_upsert_op(split_email(doc)[0]) for doc in docs]
+
+    result = get_emails_collection().bulk_write(ops, ordered=False)
     print(f"\n\nBulk upsert complete: Upserted {result.upserted_count}, Modified {result.modified_count}")
+
+    # Only inserts change the counters; upserted_ids maps op index -> _id
+    inserted = [docs[i] for i in result.upserted_ids]
+    categories = [d["classifications"]["category"] for d in inserted if (d.get("classifications") or {}).get("category")]
+    record_emails_inserted(len(inserted) - len(categories), categories)
+    # New messages change their thread's context; summaries are refreshed later, off the ingest path
+    mark_threads_stale((d["provider"], d.get("thread_id")) for d in inserted)
     return {"upserted_count": result.upserted_count, "modified_count": result.modified_count}
 
+def bulk_upsert_emails(raw_emails: List[Dict[str, Any]], provider: str = "gmail") -> Dict[str,int]:
+    """Bulk upsert emails into MongoDB"""
+    return bulk_upsert_docs(list(iter_sanitized_emails(raw_emails, provider)))
+
 
 def store_attachment_gridfs(filename: str, data_bytes: bytes, content_type: str = None) -> str:
-    """Store attachment in GridFS and return storage_id"""
-    fs = GridFS(db)
-    grid_id = fs.put(data_bytes, filename=filename, contentType=content_type)
-    print(f"Stored attachment {filename} in GridFS with id {grid_id}")
-    return str(grid_id)
+    """Store attachment in GridFS (once per SHA-256) and return storage_id"""
+    return store_attachment_stream([data_bytes], filename, content_type)["storage_id"]
+
+# Remove emails that were deleted in the mailbox
+@timed_mongo
+def delete_emails(provider_message_ids: List[str], provider: str = "gmail") -> int:
+    if not provider_message_ids:
+        return 0
+    filter_q = {"provider": provider, "provider_message_id": {"$in": list(provider_message_ids)}}
+    # Read the states first so the per-category counters can be decremented
+    existing = list(get_emails_collection().find(
+        filter_q, {"_id": 0, "classification_state": 1, "classifications.category": 1, "attachments": 1}
+    ))
+    result = get_emails_collection().delete_many(filter_q)
+    delete_bodies([(provider, msg_id) for msg_id in provider_message_ids])
+    release_attachments(a for d in existing for a in d.get("attachments") or [])
+    print(f"Deleted {result.deleted_count} emails from MongoDB")
+
+    categories = [d["classifications"]["category"] for d in existing if d.get("classification_state") == STATE_CLASSIFIED and (d.get("classifications") or {}).get("category")]
+    record_emails_deleted(len(existing) - len(categories), categories)
+    return result.deleted_count
+
+# Apply label changes: {provider_message_id: {"added": [...], "removed": [...]}}
+@timed_mongo
+def update_email_labels(label_changes: Dict[str, Dict[str, List[str]]], provider: str = "gmail") -> int:
+    ops = []
+    for msg_id, change in label_changes.items():
+        filter_q = {"provider": provider, "provider_message_id": msg_id}
+        if change.get("added"):
+            ops.append(UpdateOne(filter_q, {"$addToSet": {"labels": {"$each": list(change["added"])}}}))
+        if change.get("removed"):
+            ops.append(UpdateOne(filter_q, {"$pull": {"labels": {"$in": list(change["removed"])}}}))
+
+    if not ops:
+        return 0
+
+    # Ordered so an add and a remove on the same message apply in sequence
+    result = get_emails_collection().bulk_write(ops, ordered=True)
+    print(f"Updated labels on {result.modified_count} emails")
+    return result.modified_count
+
+# Sync state (e.g. last Gmail historyId) per mailbox
+@timed_mongo
+def get_sync_state(mailbox: str) -> Dict[str, Any]:
+    return get_collection("sync_state").find_one({"_id": mailbox}) or {}
+
+@timed_mongo
+def save_sync_state(mailbox: str, **fields):
+    fields["updated_at"] = datetime.datetime.utcnow()
+    get_collection("sync_state").update_one({"_id": mailbox}, {"$set": fields}, upsert=True)
 
 # Get all emails
+@timed_mongo
 def get_all_emails() -> List[Dict[str, Any]]:
-    emails = list(emails_collection.find({}, {"_id": 0}))
+    emails = list(get_emails_collection().find({}, {"_id": 0}))
     print(f"Retrieved {len(emails)} emails from MongoDB")
     return emails
 
+# Pending emails still worth an LLM call: untried ones first, then the fewest failed attempts, newest first
+UNCLASSIFIED_QUERY = {"classification_state": STATE_PENDING, "classification_attempts": {"$not": {"$gte": CLASSIFIER_MAX_ATTEMPTS}}}
+UNCLASSIFIED_SORT = [("classification_attempts", 1), ("date", -1)]
+
 # Get emails that are not yet classified
-def get_unclassified_emails() -> List[Dict[str, Any]]:
-    query = {
-        "$or": [
-            {"classifications": {"$exists": False}},   # field missing
-            {"classifications": {}},                   # empty object
-            {"classifications.category": {"$exists": False}}  # no category yet
-        ]
-    }
-    emails = list(emails_collection.find(query, {"_id": 0}))
+@timed_mongo
+def get_unclassified_emails(limit: int = 0) -> List[Dict[str, Any]]:
+    # Served by the partial index on pending emails; limit 0 means no limit
+    cursor = get_emails_collection().find(UNCLASSIFIED_QUERY, CLASSIFICATION_PROJECTION).sort(UNCLASSIFIED_SORT).limit(limit)
+    emails = list(cursor)
     print(f"Retrieved {len(emails)} unclassified emails from MongoDB")
     return emails
 
+@timed_mongo
+def record_classification_attempts(emails: List[Dict[str, Any]]):
+    """Count a failed classification against each still-pending email, so failing emails stop crowding out the rest"""
+    by_provider: Dict[str, List[str]] = {}
+    for email in emails:
+        by_provider.setdefault(email.get("provider", "gmail"), []).append(email["provider_message_id"])
+    for provider, message_ids in by_provider.items():
+        get_emails_collection().update_many(
+            {"provider": provider, "provider_message_id": {"$in": message_ids}, "classification_state": STATE_PENDING},
+            {"$inc": {"classification_attempts": 1}, "$set": {"last_attempt_at": datetime.datetime.utcnow()}}
+        )
+
 # Update email with classification result
-def update_email_classification(provider_message_id: str, category: str, confidence: float, reasoning: str = "", summary: str = ""):
-    emails_collection.update_one(
-        {"provider_message_id": provider_message_id},
-        {"$set": {
-            "classifications": {
-                "category": category,
-                "confidence": confidence,
-                "reasoning": reasoning,
-                "summary": summary
-            },
-            "metadata.processed": True
-        }}
+def _classification_update(category: str, confidence: float, reasoning: str, summary: str, tier: str,
+                           write_id: str = None) -> Dict[str, Any]:
+    update = {"$set": {
+        "classifications": {
+            "category": category,
+            "confidence": confidence,
+            "reasoning": reasoning,
+            "summary": summary,
+            "tier": tier  # which stage decided: rules, local, cache or llm
+        },
+        "classification_state": STATE_CLASSIFIED,
+        "metadata.processed": True
+    }}
+    if write_id:
+        # Lets a buffered flush find which of its writes actually classified an email
+        update["$set"]["metadata.classification_write"] = write_id
+    return update
+
+@timed_mongo
+def update_email_classification(provider_message_id: str, category: str, confidence: float, reasoning: str = "", summary: str = "", tier: str = "llm", provider: str = "gmail"):
+    # Match the full unique key so the update is served by provider_msgid_unique
+    previous = get_emails_collection().find_one_and_update(
+        {"provider": provider, "provider_message_id": provider_message_id},
+        _classification_update(category, confidence, reasoning, summary, tier),
+        projection={"_id": 0, "classification_state": 1}
     )
+    if previous and previous.get("classification_state") != STATE_CLASSIFIED:
+        record_emails_classified([category])
     print(f"Updated email {provider_message_id} with category '{category}' and confidence {confidence}")
 
-# Get all classified emails
-from typing import List, Dict, Any
-from bson import ObjectId
-
-def get_all_classified_emails() -> List[Dict[str, Any]]:
-    query = {"classifications.category": {"$exists": True, "$ne": None}}
-    
-    emails = list(emails_collection.find(query))
-    result = []
-
-    for e in emails:
-        result.append({
-            "id": str(e.get("_id")),
-            "from": e.get("from"),
-            "to": e.get("to", []),
-            "subject": e.get("subject"),
-            "snippet": e.get("snippet"),
-            "date": e.get("date"),
-            "thread_id": e.get("thread_id"),
-            "category": e.get("classifications", {}).get("category"),
-            "confidence": e.get("classifications", {}).get("confidence"),
-            "reasoning": e.get("classifications", {}).get("reasoning"),
-            "summary": e.get("classifications", {}).get("summary"),
-        })
+def _count_classified(succeeded_keys, failures, counts):
+    # Buffered writes only match pending emails, so each modified document is one pending -> classified move
+    if counts["modified"] == len(succeeded_keys):
+        record_emails_classified(category for _, _, category, _ in succeeded_keys)
+    elif counts["modified"]:
+        # Some targets were classified by another writer or are gone; bulk_write does not say which,
+        # so count the emails that still carry this flush's write ids
+        applied = get_emails_collection().find(
+            {"provider": {"$in": list({provider for provider, _, _, _ in succeeded_keys})},
+             "provider_message_id": {"$in": [message_id for _, message_id, _, _ in succeeded_keys]},
+             "metadata.classification_write": {"$in": [write_id for _, _, _, write_id in succeeded_keys]}},
+            {"_id": 0, "classifications.category": 1}
+        )
+        categories = [doc["classifications"]["category"] for doc in applied]
+        logger.info(f"{len(succeeded_keys) - counts['modified']} buffered classifications matched no pending email")
+        record_emails_classified(categories)
+
+_classification_buffer = None
+_classification_buffer_lock = threading.Lock()
+
+def get_classification_buffer() -> BulkWriteBuffer:
+    """Shared write-behind buffer for classification results"""
+    global _classification_buffer
+    with _classification_buffer_lock:
+        if _classification_buffer is None:
+            _classification_buffer = register_buffer(BulkWriteBuffer(
+                "classification-writes", get_emails_collection, on_flush=_count_classified
+            ))
+    return _classification_buffer
+
+def buffer_email_classification(provider_message_id: str, category: str, confidence: float, reasoning: str = "", summary: str = "", tier: str = "llm", provider: str = "gmail"):
+    """Queue a classification write; it is applied with other results in one bulk_write"""
+    write_id = uuid.uuid4().hex
+    get_classification_buffer().add(
+        UpdateOne(
+            {"provider": provider, "provider_message_id": provider_message_id, "classification_state": STATE_PENDING},
+            _classification_update(category, confidence, reasoning, summary, tier, write_id)
+        ),
+        key=(provider, provider_message_id, category, write_id)
+    )
+
+# Classified emails, keyset-paginated on (date, _id)
+CLASSIFIED_LIST_PROJECTION = {
+    "from": 1, "to": 1, "subject": 1, "snippet": 1, "date": 1, "thread_id": 1,
+    "classifications.category": 1, "classifications.confidence": 1,
+    "classifications.reasoning": 1, "classifications.summary": 1,
+}
+
+def _classified_query(
+    category: str = None,
+    min_confidence: float = None,
+    max_confidence: float = None,
+    sender: str = None,
+    date_from: datetime.datetime = None,
+    date_to: datetime.datetime = None,
+) -> Dict[str, Any]:
+    query: Dict[str, Any] = {"classification_state": STATE_CLASSIFIED}
+    if category:
+        query["classifications.category"] = category
+    if min_confidence is not None or max_confidence is not None:
+        query["classifications.confidence"] = {}
+        if min_confidence is not None:
+            query["classifications.confidence"]["$gte"] = min_confidence
+        if max_confidence is not None:
+            query["classifications.confidence"]["$lte"] = max_confidence
+    if sender:
+        query["sender_address"] = parseaddr(sender)[1].lower() or sender.lower()
+    if date_from or date_to:
+        query["date"] = {}
+        if date_from:
+            query["date"]["$gte"] = date_from
+        if date_to:
+            query["date"]["$lt"] = date_to
+    return query
+
+def _classified_row(e: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "id": str(e.get("_id")),
+        "from": e.get("from"),
+        "to": e.get("to", []),
+        "subject": e.get("subject"),
+        "snippet": e.get("snippet"),
+        "date": e.get("date"),
+        "thread_id": e.get("thread_id"),
+        "category": e.get("classifications", {}).get("category"),
+        "confidence": e.get("classifications", {}).get("confidence"),
+        "reasoning": e.get("classifications", {}).get("reasoning"),
+        "summary": e.get("classifications", {}).get("summary"),
+    }
+
+@timed_mongo
+def list_classified_emails(limit: int = 50, cursor: str = None, **filters) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """One page of classified emails, newest first. Returns (emails, next_cursor)"""
+    query = _classified_query(**filters)
+    emails, next_cursor = keyset_page(get_emails_collection(), query, CLASSIFIED_LIST_PROJECTION, "date", limit, cursor)
+    result = [_classified_row(e) for e in emails]
 
     print(f"Retrieved {len(result)} classified emails from MongoDB")
-    return result
+    return result, next_cursor
+
+def iter_classified_emails(batch_size: int = 1000, **filters) -> Iterator[Dict[str, Any]]:
+    """Stream every matching classified email from a server-side cursor, in _id order"""
+    # Walks the _id index, so the order is fixed and no blocking sort is needed
+    cursor = get_emails_collection().find(_classified_query(**filters), CLASSIFIED_LIST_PROJECTION).sort("_id", 1)
+    with cursor.batch_size(batch_size) as cursor:
+        for e in cursor:
+            yield _classified_row(e)
+
+# Responses are paged the same way, keyed on (created_at, _id)
+RESPONDED_LIST_PROJECTION = {
+    "email_id": 1, "thread_id": 1, "to": 1, "from": 1, "subject": 1, "body": 1, "status": 1,
+    "edited_by_human": 1, "created_at": 1, "sent_at": 1, "gmail_response": 1,
+}
+
+def _responded_query(recipient: str = None, date_from: datetime.datetime = None, date_to: datetime.datetime = None) -> Dict[str, Any]:
+    query: Dict[str, Any] = {}
+    if recipient:
+        query["to"] = recipient
+    if date_from or date_to:
+        query["created_at"] = {}
+        if date_from:
+            query["created_at"]["$gte"] = date_from
+        if date_to:
+            query["created_at"]["$lt"] = date_to
+    return query
+
+def _responded_row(r: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "email_id": r.get("email_id"),
+        "thread_id": r.get("thread_id"),
+        "to": r.get("to"),
+        "from": r.get("from"),
+        "subject": r.get("subject"),
+        "body": r.get("body"),
+        "status": r.get("status"),
+        "edited_by_human": r.get("edited_by_human"),
+        "created_at": r.get("created_at"),
+        "sent_at": r.get("sent_at"),
+        "gmail_response": r.get("gmail_response"),
+    }
 
-# function to get responed emails from "responses" collection
-def get_responded_emails() -> List[Dict[str, Any]]:
-    responses_collection = db["responses"]
-    responses = list(responses_collection.find({}, {"_id": 0}))
+@timed_mongo
+def list_responded_emails(limit: int = 50, cursor: str = None, **filters) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """One page of sent responses, newest first. Returns (responses, next_cursor)"""
+    query = _responded_query(**filters)
+    responses, next_cursor = keyset_page(get_responses_collection(), query, RESPONDED_LIST_PROJECTION, "created_at", limit, cursor)
     print(f"Retrieved {len(responses)} responded emails from MongoDB")
-    # Fetch responses and map fields to match the inserted structure
-    result = []
-    for r in responses:
-        result.append({
-            "email_id": r.get("email_id"),
-            "thread_id": r.get("thread_id"),
-            "to": r.get("to"),
-            "from": r.get("from"),
-            "subject": r.get("subject"),
-            "body": r.get("body"),
-            "status": r.get("status"),
-            "edited_by_human": r.get("edited_by_human"),
-            "created_at": r.get("created_at"),
-            "sent_at": r.get("sent_at"),
-            "gmail_response": r.get("gmail_response"),
-        })
-    return result
+    return [_responded_row(r) for r in responses], next_cursor
 
+def iter_responded_emails(batch_size: int = 1000, **filters) -> Iterator[Dict[str, Any]]:
+    """Stream every matching response from a server-side cursor, in _id order"""
+    cursor = get_responses_collection().find(_responded_query(**filters), RESPONDED_LIST_PROJECTION).sort("_id", 1)
+    with cursor.batch_size(batch_size) as cursor:
+        for r in cursor:
+            yield _responded_row(r)
@@ -0,0 +1,63 @@
+"""
+NDJSON exports streamed straight from Mongo cursors.
+
+Rows are serialised one at a time and coalesced into chunks of roughly
+EXPORT_CHUNK_BYTES, optionally through a streaming gzip compressor, so memory
+stays flat and the first chunk goes out as soon as the first batch arrives.
+"""
+import datetime
+import json
+import zlib
+from typing import Any, Dict, Iterable, Iterator
+
+from bson import ObjectId
+
+from services.db_service import iter_classified_emails, iter_responded_emails
+from utils.parser import clean_email_text
+from config.settings import EXPORT_BATCH_SIZE, EXPORT_CHUNK_BYTES
+
+
+def _json_default(value: Any):
+    if isinstance(value, datetime.datetime):
+        return value.isoformat()
+    if isinstance(value, ObjectId):
+        return str(value)
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+def ndjson_chunks(rows: Iterable[Dict[str, Any]], chunk_bytes: int = EXPORT_CHUNK_BYTES) -> Iterator[bytes]:
+    """One JSON document per line, yielded in chunks of about chunk_bytes"""
+    buffer, size = [], 0
+    for row in rows:
+        line = (json.dumps(row, default=_json_default, ensure_ascii=False) + "\n").encode("utf-8")
+        buffer.append(line)
+        size += len(line)
+        if size >= chunk_bytes:
+            yield b"".join(buffer)
+            buffer, size = [], 0
+    if buffer:
+        yield b"".join(buffer)
+
+
+def gzip_chunks(chunks: Iterable[bytes], level: int = 6) -> Iterator[bytes]:
+    """Compress a byte stream incrementally into a single gzip member"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)  # wbits=31: gzip header and trailer
+    for chunk in chunks:
+        # Sync flush so each input chunk reaches the client now instead of after ~64KB of deflate output
+        yield compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+    yield compressor.flush()
+
+
+def export_classified_emails(**filters) -> Iterator[Dict[str, Any]]:
+    for row in iter_classified_emails(batch_size=EXPORT_BATCH_SIZE, **filters):
+        row["snippet"] = clean_email_text(row.get("snippet") or "")
+        yield row
+
+
+def export_responded_emails(**filters) -> Iterator[Dict[str, Any]]:
+    return iter_responded_emails(batch_size=EXPORT_BATCH_SIZE, **filters)
+
+
+def export_stream(rows: Iterable[Dict[str, Any]], compress: bool = False) -> Iterator[bytes]:
+    chunks = ndjson_chunks(rows)
+    return gzip_chunks(chunks) if compress else chunks
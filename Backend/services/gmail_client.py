@@ -0,0 +1,123 @@
+import json
+import os
+import threading
+
+import httplib2
+import google_auth_httplib2
+from google.auth.transport.requests import Request, AuthorizedSession
+from google.oauth2.credentials import Credentials
+from google_auth_oauthlib.flow import InstalledAppFlow
+from googleapiclient.discovery import build_from_document
+from googleapiclient.discovery_cache import get_static_doc
+from services.logger import get_logger
+from services.metrics import InstrumentedHttp
+from config.settings import GMAIL_TOKEN_PATH, GMAIL_CREDENTIALS_PATH, GMAIL_HTTP_TIMEOUT
+
+logger = get_logger(__name__)
+
+# Gmail API Scopes
+SCOPES = ["https://www.googleapis.com/auth/gmail.readonly", "https://www.googleapis.com/auth/gmail.send", "https://www.googleapis.com/auth/gmail.modify"]
+
+
+class GmailClientManager:
+    """
+    Process-wide owner of Gmail credentials and API clients.
+
+    Credentials are loaded once and refreshed lazily under a lock. Each worker
+    thread gets its own service object (httplib2 is not thread-safe) built from
+    the discovery document bundled with googleapiclient, with a keep-alive
+    HTTP transport that is reused for every call made on that thread. A
+    refresh updates the shared credentials in place; after a new login
+    replaces them, each thread rebuilds its clients on its next call.
+    """
+
+    def __init__(self, token_path: str = GMAIL_TOKEN_PATH, creds_path: str = GMAIL_CREDENTIALS_PATH, scopes=SCOPES):
+        self.token_path = token_path
+        self.creds_path = creds_path
+        self.scopes = scopes
+        self._creds = None
+        self._discovery_doc = None
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def _save_credentials(self):
+        with open(self.token_path, "w") as token_file:
+            token_file.write(self._creds.to_json())
+        logger.info("Saved Gmail token.json for future runs")
+
+    def _login(self):
+        logger.info("Performing Gmail login via OAuth flow...")
+        flow = InstalledAppFlow.from_client_secrets_file(self.creds_path, self.scopes)
+        self._creds = flow.run_local_server(port=0)
+        self._save_credentials()
+
+    def _load_credentials(self):
+        if os.path.exists(self.token_path):
+            self._creds = Credentials.from_authorized_user_file(self.token_path, self.scopes)
+            logger.info("Loaded existing Gmail token.json")
+        if not self._creds:
+            self._login()
+
+    def credentials(self) -> Credentials:
+        """Return valid credentials, loading or refreshing them only when needed"""
+        with self._lock:
+            if self._creds is None:
+                self._load_credentials()
+
+            if not self._creds.valid:
+                if self._creds.refresh_token:
+                    logger.info("Refreshing expired Gmail token...")
+                    try:
+                        self._creds.refresh(Request())
+                        logger.info("Token refreshed successfully")
+                        self._save_credentials()
+                    except Exception:
+                        logger.error("Failed to refresh token, performing login", exc_info=True)
+                        self._login()
+                else:
+                    self._login()
+
+            return self._creds
+
+    def discovery_document(self) -> dict:
+        """Static Gmail v1 discovery document, parsed once per process"""
+        if self._discovery_doc is None:
+            self._discovery_doc = json.loads(get_static_doc("gmail", "v1"))
+        return self._discovery_doc
+
+    def service(self):
+        """Gmail API client for the calling thread"""
+        creds = self.credentials()
+        service = getattr(self._local, "service", None)
+        # Built for credentials that a later login replaced
+        if service is None or getattr(self._local, "service_creds", None) is not creds:
+            http = google_auth_httplib2.AuthorizedHttp(creds, http=httplib2.Http(timeout=GMAIL_HTTP_TIMEOUT))
+            service = build_from_document(self.discovery_document(), http=InstrumentedHttp(http))
+            self._local.service, self._local.service_creds = service, creds
+            logger.info("Gmail API service initialized for thread %s", threading.current_thread().name)
+        return service
+
+    def session(self) -> AuthorizedSession:
+        """requests session for raw REST calls that need streaming (e.g. attachment downloads)"""
+        creds = self.credentials()
+        session = getattr(self._local, "session", None)
+        if session is None or session.credentials is not creds:
+            if session is not None:
+                session.close()
+            session = AuthorizedSession(creds)
+            self._local.session = session
+        return session
+
+
+_manager = None
+_manager_lock = threading.Lock()
+
+
+def get_gmail_client() -> GmailClientManager:
+    """Return the shared GmailClientManager, creating it on first use"""
+    global _manager
+    if _manager is None:
+        with _manager_lock:
+            if _manager is None:
+                _manager = GmailClientManager()
+    return _manager
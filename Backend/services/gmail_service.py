@@ -1,56 +1,59 @@
-import os
-from google.auth.transport.requests import Request
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
+import requests
+from googleapiclient.errors import HttpError
+from services.gmail_client import get_gmail_client
 from services.logger import get_logger
+from services.metrics import EMAILS_FETCHED
+from utils.parser import extract_plain_html_from_gmail_payload, parse_raw_message
+from config.settings import GMAIL_MESSAGE_FORMAT
 
 logger = get_logger(__name__)
 
-# Gmail API Scopes
-SCOPES = ["https://www.googleapis.com/auth/gmail.readonly", "https://www.googleapis.com/auth/gmail.send", "https://www.googleapis.com/auth/gmail.modify"]
+# Gmail accepts at most 100 sub-requests per batch HTTP request
+BATCH_SIZE = 100
+# History record types applied by incremental sync
+HISTORY_TYPES = ["messageAdded", "messageDeleted", "labelAdded", "labelRemoved"]
+# Only the headers we actually read, so messages.get can use format=metadata
+METADATA_HEADERS = ["Subject", "From", "To", "Date", "List-Unsubscribe"]
+
+class HistoryExpiredError(Exception):
+    """Raised when a stored startHistoryId is too old for users.history.list"""
+
 
 class GmailService:
-    def __init__(self):
+    def __init__(self, service=None, session=None):
         self.creds = None
-        self.service = None
-        self.authenticate()
+        self._service = service
+        self._session = session
+        self.client = None
+        # An injected service (e.g. pointed at a stub server) skips OAuth
+        if self._service is None:
+            self.authenticate()
 
     def authenticate(self):
-        """Authenticate Gmail API using OAuth2 and reuse token if valid"""
-        token_path = "./services/token.json"
-        creds_path = "./services/credentials.json"
-
-        # Load saved credentials
-        if os.path.exists(token_path):
-            self.creds = Credentials.from_authorized_user_file(token_path, SCOPES)
-            logger.info("Loaded existing Gmail token.json")
-
-        # If no valid credentials, login or refresh
-        if not self.creds or not self.creds.valid:
-            if self.creds and self.creds.expired and self.creds.refresh_token:
-                logger.info("Refreshing expired Gmail token...")
-                try:
-                    self.creds.refresh(Request())
-                    logger.info("Token refreshed successfully")
-                except Exception as e:
-                    logger.error("Failed to refresh token, performing login", exc_info=True)
-                    self.creds = None
-            if not self.creds:
-                logger.info("Performing Gmail login via OAuth flow...")
-                flow = InstalledAppFlow.from_client_secrets_file(creds_path, SCOPES)
-                self.creds = flow.run_local_server(port=0)
-
-            # Save updated credentials
-            with open(token_path, "w") as token_file:
-                token_file.write(self.creds.to_json())
-                logger.info("Saved Gmail token.json for future runs")
-
-        # Initialize Gmail service
-        self.service = build("gmail", "v1", credentials=self.creds)
-        logger.info("Gmail API service initialized successfully")
-
-    def fetch_inbox_emails(self, max_results=10):
+        """Attach to the shared Gmail client; credentials are loaded/refreshed once per process"""
+        self.client = get_gmail_client()
+        self.creds = self.client.credentials()
+
+    @property
+    def service(self):
+        # Resolved per call so each worker thread uses its own pooled transport
+        return self._service if self._service is not None else self.client.service()
+
+    def session(self):
+        """requests session for streamed REST calls (attachment downloads) on the same account as `service`"""
+        if self._service is None:
+            return self.client.session()
+        # An injected service comes with its own session, or a plain one (e.g. for a stub server)
+        if self._session is None:
+            self._session = requests.Session()
+        return self._session
+
+    @property
+    def root_url(self):
+        """Root URL the service's requests go to"""
+        return self.service._baseUrl
+
+    def fetch_inbox_emails(self, max_results=10, batched=True):
         """Fetch inbox emails from Gmail"""
         logger.info(f"Fetching {max_results} emails from Gmail inbox...")
         results = self.service.users().messages().list(
@@ -60,28 +63,149 @@ class GmailService:
         ).execute()
 
         messages = results.get("messages", [])
-        emails = []
-        for msg in messages:
-            msg_data = self.service.users().messages().get(userId="me", id=msg["id"]).execute()
-            headers = msg_data["payload"]["headers"]
-
-            # Extract common fields
-            subject = next((h["value"] for h in headers if h["name"] == "Subject"), "")
-            sender = next((h["value"] for h in headers if h["name"] == "From"), "")
-            snippet = msg_data.get("snippet", "")
-
-            emails.append({
-                "id": msg["id"],
-                "provider": "gmail",
-                "provider_message_id": msg["id"],
-                "thread_id": msg_data.get("threadId"),
-                "from": sender,
-                "to": "me",
-                "subject": subject,
-                "snippet": snippet,
-                "labels": msg_data.get("labelIds", []),
-                "date": msg_data.get("internalDate")
-            })
+        message_ids = [msg["id"] for msg in messages]
+
+        if batched:
+            emails = self.fetch_messages_batched(message_ids)
+        else:
+            emails = []
+            for msg_id in message_ids:
+                try:
+                    msg_data = self.service.users().messages().get(userId="me", id=msg_id).execute()
+                except HttpError as e:
+                    logger.warning(f"Failed to fetch message {msg_id}: {e}")
+                    continue
+                emails.append(self._parse_message(msg_data))
 
         logger.info(f"Fetched {len(emails)} emails successfully")
         return emails
+
+    def iter_inbox_pages(self, page_size=500, page_token=None):
+        """
+        Page through messages.list for the inbox, yielding (emails, next_page_token)
+        per page so callers never hold more than one page in memory.
+        """
+        while True:
+            results = self.service.users().messages().list(
+                userId="me",
+                labelIds=["INBOX"],
+                maxResults=page_size,
+                pageToken=page_token,
+                fields="messages/id,nextPageToken"
+            ).execute()
+
+            message_ids = [msg["id"] for msg in results.get("messages", [])]
+            page_token = results.get("nextPageToken")
+            yield self.fetch_messages_batched(message_ids), page_token
+
+            if not page_token:
+                break
+
+    def fetch_messages_batched(self, message_ids, batch_size=BATCH_SIZE, message_format=GMAIL_MESSAGE_FORMAT):
+        """
+        Fetch messages in Gmail batch requests of up to `batch_size` sub-requests.
+        `message_format` "full" or "raw" also returns the decoded bodies.
+        """
+        # metadataHeaders only applies to format=metadata
+        params = {"metadataHeaders": METADATA_HEADERS} if message_format == "metadata" else {}
+        fetched = {}
+        failed = {}
+
+        def on_response(request_id, response, exception):
+            if exception is not None:
+                failed[request_id] = exception
+            else:
+                fetched[request_id] = response
+
+        for start in range(0, len(message_ids), batch_size):
+            chunk = message_ids[start:start + batch_size]
+            batch = self.service.new_batch_http_request(callback=on_response)
+            for msg_id in chunk:
+                batch.add(
+                    self.service.users().messages().get(
+                        userId="me",
+                        id=msg_id,
+                        format=message_format,
+                        **params
+                    ),
+                    request_id=msg_id
+                )
+            batch.execute()
+
+        # A failed sub-request only affects its own message
+        for msg_id, error in failed.items():
+            logger.warning(f"Failed to fetch message {msg_id} in batch: {error}")
+
+        # Keep the order returned by messages.list
+        emails = [self._parse_message(fetched[msg_id]) for msg_id in message_ids if msg_id in fetched]
+        EMAILS_FETCHED.inc(len(emails))
+        return emails
+
+    def get_history_id(self):
+        """Return the mailbox's current historyId"""
+        profile = self.service.users().getProfile(userId="me").execute()
+        return profile["historyId"]
+
+    def list_history(self, start_history_id):
+        """
+        Page through users.history.list starting at `start_history_id`.
+        Returns (history_records, latest_history_id).
+        Raises HistoryExpiredError if Gmail no longer has history that far back.
+        """
+        records = []
+        latest_history_id = start_history_id
+        page_token = None
+        while True:
+            try:
+                response = self.service.users().history().list(
+                    userId="me",
+                    startHistoryId=start_history_id,
+                    historyTypes=HISTORY_TYPES,
+                    pageToken=page_token
+                ).execute()
+            except HttpError as e:
+                if e.resp.status == 404:
+                    raise HistoryExpiredError(f"historyId {start_history_id} has expired") from e
+                raise
+            records.extend(response.get("history", []))
+            latest_history_id = response.get("historyId", latest_history_id)
+            page_token = response.get("nextPageToken")
+            if not page_token:
+                break
+
+        logger.info(f"Read {len(records)} history records since historyId {start_history_id}")
+        return records, latest_history_id
+
+    @staticmethod
+    def _parse_message(msg_data):
+        """Map a Gmail message resource (format metadata, full or raw) to our raw email dict"""
+        if "raw" in msg_data:
+            headers, body_plain, body_html = parse_raw_message(msg_data["raw"])
+        else:
+            payload = msg_data.get("payload", {})
+            headers = {}
+            for h in payload.get("headers", []):
+                headers.setdefault(h["name"], h["value"])
+            body_plain, body_html = extract_plain_html_from_gmail_payload(payload)
+
+        # Extract common fields
+        subject = headers.get("Subject", "")
+        sender = headers.get("From", "")
+        recipient = headers.get("To", "")
+        snippet = msg_data.get("snippet", "")
+
+        return {
+            "id": msg_data["id"],
+            "provider": "gmail",
+            "provider_message_id": msg_data["id"],
+            "thread_id": msg_data.get("threadId"),
+            "from": sender,
+            "to": recipient or "me",
+            "subject": subject,
+            "snippet": snippet,
+            "labels": msg_data.get("labelIds", []),
+            "headers": {name: value for name, value in headers.items() if name in METADATA_HEADERS},
+            "body_plain": body_plain,
+            "body_html": body_html,
+            "date": msg_data.get("internalDate")
+        }
@@ -0,0 +1,254 @@
+"""
+Background jobs with their state in Mongo.
+
+Handlers run on a bounded thread pool in the API process. Job documents
+(status, progress, result) live in the `jobs` collection so any worker can
+answer a poll. A unique partial index on `dedup_key` over active jobs stops
+repeated requests from starting overlapping runs. Each process heartbeats
+its queued and running jobs, so only a job whose process died goes stale.
+"""
+import datetime
+import os
+import socket
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Set
+
+from pymongo.errors import DuplicateKeyError
+
+from services.mongo import get_collection
+from services.logger import get_logger
+from config.settings import JOB_MAX_WORKERS, JOB_MAX_QUEUED, JOB_STALE_SECONDS, JOB_PROGRESS_INTERVAL_SECONDS, JOB_HEARTBEAT_SECONDS
+
+logger = get_logger(__name__)
+
+JOBS_COLLECTION = "jobs"
+
+STATUS_QUEUED = "queued"
+STATUS_RUNNING = "running"
+STATUS_SUCCEEDED = "succeeded"
+STATUS_FAILED = "failed"
+STATUS_CANCELLED = "cancelled"
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class JobQueueFullError(Exception):
+    pass
+
+
+def _now() -> datetime.datetime:
+    return datetime.datetime.utcnow()
+
+
+class JobContext:
+    """Handed to a running handler for progress reporting and cancellation checks."""
+
+    def __init__(self, job_id: str, progress_interval: float = JOB_PROGRESS_INTERVAL_SECONDS):
+        self.job_id = job_id
+        self.progress_interval = progress_interval
+        self.progress: Dict[str, Any] = {}
+        self._started = time.perf_counter()
+        self._last_write = 0.0
+        self._last_cancel_check = 0.0
+        self._cancelled = False
+
+    def update_progress(self, force: bool = False, **counters):
+        """Merge counters into the job's progress; written at most once per interval."""
+        self.progress.update(counters)
+        elapsed = time.perf_counter() - self._started
+        self.progress["elapsed_seconds"] = round(elapsed, 2)
+        if "processed" in self.progress and elapsed:
+            self.progress["items_per_sec"] = round(self.progress["processed"] / elapsed, 2)
+
+        if force or time.perf_counter() - self._last_write >= self.progress_interval:
+            self._last_write = time.perf_counter()
+            get_collection(JOBS_COLLECTION).update_one(
+                {"_id": self.job_id},
+                {"$set": {"progress": self.progress, "updated_at": _now()}}
+            )
+        self.check_cancelled()
+
+    def check_cancelled(self):
+        """Raise JobCancelled if a cancel was requested (polled at most once per interval)."""
+        if not self._cancelled and time.perf_counter() - self._last_cancel_check >= self.progress_interval:
+            self._last_cancel_check = time.perf_counter()
+            job = get_collection(JOBS_COLLECTION).find_one({"_id": self.job_id}, {"cancel_requested": 1})
+            self._cancelled = bool(job and job.get("cancel_requested"))
+        if self._cancelled:
+            raise JobCancelled(self.job_id)
+
+
+class JobManager:
+    def __init__(self, max_workers: int = JOB_MAX_WORKERS, max_queued: int = JOB_MAX_QUEUED, heartbeat_interval: float = JOB_HEARTBEAT_SECONDS):
+        self.max_queued = max_queued
+        self.heartbeat_interval = heartbeat_interval
+        self._handlers: Dict[str, Callable[..., Any]] = {}
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+        # Ids of this process's queued and running jobs
+        self._outstanding: Set[str] = set()
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._heartbeat_thread: Optional[threading.Thread] = None
+        self.worker = f"{socket.gethostname()}:{os.getpid()}"
+
+    def register(self, job_type: str, handler: Callable[..., Any]):
+        """handler(ctx, **params) -> JSON/BSON-serialisable result"""
+        self._handlers[job_type] = handler
+
+    def _heartbeat(self):
+        # Keeps updated_at fresh while a job waits in the executor or runs without reporting progress
+        while not self._stopped.wait(self.heartbeat_interval):
+            with self._lock:
+                job_ids = list(self._outstanding)
+            if not job_ids:
+                continue
+            try:
+                get_collection(JOBS_COLLECTION).update_many(
+                    {"_id": {"$in": job_ids}, "active": True},
+                    {"$set": {"updated_at": _now()}}
+                )
+            except Exception:
+                logger.error("Job heartbeat failed", exc_info=True)
+
+    def _ensure_heartbeat(self):
+        if self._heartbeat_thread is None:
+            self._heartbeat_thread = threading.Thread(target=self._heartbeat, name="job-heartbeat", daemon=True)
+            self._heartbeat_thread.start()
+
+    def _release_stale(self, dedup_key: str) -> bool:
+        """Free a dedup key held by a job whose worker stopped reporting."""
+        cutoff = _now() - datetime.timedelta(seconds=JOB_STALE_SECONDS)
+        result = get_collection(JOBS_COLLECTION).update_one(
+            {"dedup_key": dedup_key, "active": True, "updated_at": {"$lt": cutoff}},
+            {"$set": {"status": STATUS_FAILED, "active": False, "error": "Abandoned by its worker", "finished_at": _now()}}
+        )
+        return result.modified_count > 0
+
+    def submit(self, job_type: str, params: Optional[Dict[str, Any]] = None, dedup_key: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Enqueue a job and return its document. If an active job already holds
+        `dedup_key`, that job is returned instead with `deduplicated: True`.
+        """
+        if job_type not in self._handlers:
+            raise ValueError(f"Unknown job type {job_type!r}")
+        with self._lock:
+            if len(self._outstanding) >= self.max_queued:
+                raise JobQueueFullError(f"{len(self._outstanding)} jobs already queued or running")
+
+            job = {
+                "_id": uuid.uuid4().hex,
+                "type": job_type,
+                "params": params or {},
+                "status": STATUS_QUEUED,
+                "active": True,
+                "cancel_requested": False,
+                "progress": {},
+                "result": None,
+                "error": None,
+                "worker": self.worker,
+                "created_at": _now(),
+                "updated_at": _now(),
+            }
+            if dedup_key:
+                job["dedup_key"] = dedup_key
+
+            jobs_collection = get_collection(JOBS_COLLECTION)
+            try:
+                jobs_collection.insert_one(job)
+            except DuplicateKeyError:
+                existing = None
+                if not self._release_stale(dedup_key):
+                    existing = jobs_collection.find_one({"dedup_key": dedup_key, "active": True})
+                if existing is None:
+                    try:
+                        jobs_collection.insert_one(job)
+                    except DuplicateKeyError:
+                        # Another submitter took the released key first; its job is the one to report
+                        existing = jobs_collection.find_one({"dedup_key": dedup_key, "active": True})
+                        if existing is None:
+                            raise
+                if existing is not None:
+                    logger.info(f"Job {job_type} already active as {existing['_id']}; not starting another")
+                    return {**existing, "deduplicated": True}
+
+            self._outstanding.add(job["_id"])
+            self._ensure_heartbeat()
+        self._executor.submit(self._run, job["_id"], job_type, job["params"])
+        logger.info(f"Queued job {job['_id']} ({job_type})")
+        return {**job, "deduplicated": False}
+
+    def _finish(self, job_id: str, status: str, **fields):
+        fields.update({"status": status, "active": False, "finished_at": _now(), "updated_at": _now()})
+        # A job already released as abandoned keeps that outcome; its dedup key may belong to a newer run
+        result = get_collection(JOBS_COLLECTION).update_one({"_id": job_id, "active": True}, {"$set": fields})
+        if result.matched_count == 0:
+            logger.warning(f"Job {job_id} was no longer active; not recording it as {status}")
+
+    def _run(self, job_id: str, job_type: str, params: Dict[str, Any]):
+        ctx = JobContext(job_id)
+        try:
+            # Cancelled while still queued: never start
+            started = get_collection(JOBS_COLLECTION).find_one_and_update(
+                {"_id": job_id, "active": True, "cancel_requested": False},
+                {"$set": {"status": STATUS_RUNNING, "started_at": _now(), "updated_at": _now()}}
+            )
+            if started is None:
+                self._finish(job_id, STATUS_CANCELLED)
+                return
+
+            result = self._handlers[job_type](ctx, **params)
+            self._finish(job_id, STATUS_SUCCEEDED, result=result, progress=ctx.progress)
+            logger.info(f"Job {job_id} ({job_type}) succeeded")
+        except JobCancelled:
+            self._finish(job_id, STATUS_CANCELLED, progress=ctx.progress)
+            logger.info(f"Job {job_id} ({job_type}) cancelled")
+        except Exception as e:
+            logger.error(f"Job {job_id} ({job_type}) failed", exc_info=True)
+            self._finish(job_id, STATUS_FAILED, error=str(e), progress=ctx.progress)
+        finally:
+            with self._lock:
+                self._outstanding.discard(job_id)
+
+    def shutdown(self):
+        """Stop taking work; jobs still queued in this process are marked failed."""
+        self._stopped.set()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        get_collection(JOBS_COLLECTION).update_many(
+            {"worker": self.worker, "status": STATUS_QUEUED, "active": True},
+            {"$set": {"status": STATUS_FAILED, "active": False, "error": "Worker shut down before the job started", "finished_at": _now()}}
+        )
+
+
+def get_job(job_id: str) -> Optional[Dict[str, Any]]:
+    return get_collection(JOBS_COLLECTION).find_one({"_id": job_id})
+
+
+def list_jobs(job_type: Optional[str] = None, limit: int = 20) -> List[Dict[str, Any]]:
+    query = {"type": job_type} if job_type else {}
+    return list(get_collection(JOBS_COLLECTION).find(query, {"result": 0}).sort("created_at", -1).limit(limit))
+
+
+def cancel_job(job_id: str) -> Optional[Dict[str, Any]]:
+    """Request cancellation; the handler stops at its next progress update or check."""
+    get_collection(JOBS_COLLECTION).update_one(
+        {"_id": job_id, "active": True},
+        {"$set": {"cancel_requested": True, "updated_at": _now()}}
+    )
+    return get_job(job_id)
+
+
+_manager = None
+_manager_lock = threading.Lock()
+
+
+def get_job_manager() -> JobManager:
+    global _manager
+    with _manager_lock:
+        if _manager is None:
+            _manager = JobManager()
+    return _manager
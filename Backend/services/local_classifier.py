@@ -0,0 +1,272 @@
+"""
+CPU-only first-tier classifier trained on stored LLM classifications.
+
+Hashed bag-of-words features over subject, sender and snippet feed a
+multinomial logistic regression fitted with L-BFGS. Scoring one email is a
+sparse gather over the weight matrix, so it stays in the microsecond range.
+
+Retrain and print the evaluation report:
+    python -m services.local_classifier train
+"""
+import argparse
+import datetime
+import json
+import os
+import re
+import threading
+import zlib
+from email.utils import parseaddr
+from typing import Dict, Any, List, Optional, Tuple
+
+import numpy as np
+from scipy import sparse
+from scipy.optimize import minimize
+
+from services.mongo import get_emails_collection
+from services.logger import get_logger
+from config.settings import LOCAL_CLASSIFIER_PATH, LOCAL_CLASSIFIER_THRESHOLD
+
+logger = get_logger(__name__)
+
+N_FEATURES = 2 ** 17
+_TOKEN = re.compile(r"[a-z0-9][a-z0-9'_-]+")
+
+
+def _tokens(email: Dict[str, Any]) -> List[str]:
+    subject_words = _TOKEN.findall((email.get("subject") or "").lower())
+    snippet_words = _TOKEN.findall((email.get("snippet") or "").lower())
+    address = parseaddr(email.get("from") or "")[1].lower()
+    local_part, _, domain = address.partition("@")
+
+    tokens = ["s:" + w for w in subject_words]
+    tokens += ["s2:" + a + "_" + b for a, b in zip(subject_words, subject_words[1:])]
+    tokens += ["b:" + w for w in snippet_words]
+    tokens += ["f:" + address, "fl:" + local_part, "fd:" + domain]
+    # Parent domain so mail.example.com and news.example.com share weight
+    tokens += ["fd:" + ".".join(domain.split(".")[-2:])]
+    return tokens
+
+
+def hash_features(email: Dict[str, Any]) -> Tuple[np.ndarray, np.ndarray]:
+    """Signed feature hashing; returns (indices, L2-normalised values)."""
+    counts: Dict[int, float] = {}
+    for token in _tokens(email):
+        h = zlib.crc32(token.encode("utf-8"))
+        index = h % N_FEATURES
+        counts[index] = counts.get(index, 0.0) + (1.0 if h & 0x80000000 else -1.0)
+    indices = np.fromiter(counts.keys(), dtype=np.int64, count=len(counts))
+    values = np.fromiter(counts.values(), dtype=np.float64, count=len(counts))
+    norm = np.linalg.norm(values)
+    if norm:
+        values /= norm
+    return indices, values
+
+
+def vectorize(emails: List[Dict[str, Any]]) -> sparse.csr_matrix:
+    indptr = [0]
+    all_indices, all_values = [], []
+    for email in emails:
+        indices, values = hash_features(email)
+        all_indices.append(indices)
+        all_values.append(values)
+        indptr.append(indptr[-1] + len(indices))
+    return sparse.csr_matrix(
+        (np.concatenate(all_values) if all_values else np.array([]),
+         np.concatenate(all_indices) if all_indices else np.array([], dtype=np.int64),
+         np.array(indptr)),
+        shape=(len(emails), N_FEATURES),
+    )
+
+
+def _softmax(z: np.ndarray) -> np.ndarray:
+    z = z - z.max(axis=1, keepdims=True)
+    e = np.exp(z)
+    return e / e.sum(axis=1, keepdims=True)
+
+
+class LocalClassifier:
+    def __init__(self, weights: np.ndarray, bias: np.ndarray, classes: List[str], report: Dict[str, Any] = None):
+        self.weights = weights.astype(np.float32)
+        self.bias = bias.astype(np.float32)
+        self.classes = list(classes)
+        self.report = report or {}
+
+    @classmethod
+    def fit(cls, emails: List[Dict[str, Any]], labels: List[str], sample_weight: Optional[np.ndarray] = None,
+            l2: float = 1e-4, max_iter: int = 200) -> "LocalClassifier":
+        classes = sorted(set(labels))
+        class_index = {c: i for i, c in enumerate(classes)}
+        X = vectorize(emails)
+        y = np.array([class_index[label] for label in labels])
+        n, k = X.shape[0], len(classes)
+        Y = np.zeros((n, k))
+        Y[np.arange(n), y] = 1.0
+        w = np.ones(n) if sample_weight is None else np.asarray(sample_weight, dtype=np.float64)
+        w = w / w.sum()
+
+        def loss_and_grad(theta):
+            W = theta[:-k].reshape(N_FEATURES, k)
+            b = theta[-k:]
+            P = _softmax(X @ W + b)
+            loss = -np.sum(w * np.log(P[np.arange(n), y] + 1e-12)) + 0.5 * l2 * np.sum(W * W)
+            G = (P - Y) * w[:, None]
+            grad_W = X.T @ G + l2 * W
+            grad_b = G.sum(axis=0)
+            return loss, np.concatenate([np.asarray(grad_W).ravel(), grad_b])
+
+        theta0 = np.zeros(N_FEATURES * k + k)
+        result = minimize(loss_and_grad, theta0, jac=True, method="L-BFGS-B", options={"maxiter": max_iter})
+        logger.info(f"Local classifier fitted on {n} emails ({result.nit} iterations, loss {result.fun:.4f})")
+        return cls(result.x[:-k].reshape(N_FEATURES, k), result.x[-k:], classes)
+
+    def predict_proba_batch(self, emails: List[Dict[str, Any]]) -> np.ndarray:
+        return _softmax(np.asarray(vectorize(emails) @ self.weights) + self.bias)
+
+    def predict(self, email: Dict[str, Any]) -> Tuple[str, float]:
+        """Most likely category and its probability for a single email."""
+        indices, values = hash_features(email)
+        z = values @ self.weights[indices] + self.bias
+        z = np.exp(z - z.max())
+        p = z / z.sum()
+        best = int(p.argmax())
+        return self.classes[best], float(p[best])
+
+    def classify(self, email: Dict[str, Any], threshold: float = LOCAL_CLASSIFIER_THRESHOLD) -> Optional[Dict[str, Any]]:
+        """Classification if the model is confident enough, otherwise None to escalate."""
+        category, probability = self.predict(email)
+        if probability < threshold:
+            return None
+        return {
+            "category": category,
+            "confidence": round(probability, 4),
+            "reasoning": f"Local model prediction (p={probability:.2f})",
+            "summary": (email.get("snippet") or "")[:200],
+            "tier": "local",
+        }
+
+    def save(self, path: str = LOCAL_CLASSIFIER_PATH):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        np.savez_compressed(
+            path,
+            weights=self.weights,
+            bias=self.bias,
+            classes=np.array(self.classes),
+            n_features=np.array(N_FEATURES),
+            report=np.array(json.dumps(self.report, default=str)),
+        )
+        logger.info(f"Saved local classifier to {path}")
+
+    @classmethod
+    def load(cls, path: str = LOCAL_CLASSIFIER_PATH) -> "LocalClassifier":
+        data = np.load(path, allow_pickle=False)
+        if int(data["n_features"]) != N_FEATURES:
+            raise ValueError(f"Model at {path} was trained with a different feature size")
+        return cls(data["weights"], data["bias"], [str(c) for c in data["classes"]], json.loads(str(data["report"])))
+
+
+def evaluate(model: LocalClassifier, emails: List[Dict[str, Any]], labels: List[str], threshold: float) -> Dict[str, Any]:
+    """Agreement with the LLM labels overall, per category and for the confident (locally handled) share."""
+    if not emails:
+        return {"samples": 0}
+    probs = model.predict_proba_batch(emails)
+    predicted = [model.classes[i] for i in probs.argmax(axis=1)]
+    confidence = probs.max(axis=1)
+    agree = np.array([p == t for p, t in zip(predicted, labels)])
+    confident = confidence >= threshold
+
+    per_category = {}
+    for category in sorted(set(labels) | set(predicted)):
+        true_pos = sum(1 for p, t in zip(predicted, labels) if p == t == category)
+        predicted_count = predicted.count(category)
+        actual_count = labels.count(category)
+        per_category[category] = {
+            "support": actual_count,
+            "precision": round(true_pos / predicted_count, 3) if predicted_count else None,
+            "recall": round(true_pos / actual_count, 3) if actual_count else None,
+        }
+
+    return {
+        "samples": len(labels),
+        "agreement": round(float(agree.mean()), 4),
+        "threshold": threshold,
+        "coverage_at_threshold": round(float(confident.mean()), 4),
+        "agreement_at_threshold": round(float(agree[confident].mean()), 4) if confident.any() else None,
+        "per_category": per_category,
+    }
+
+
+def load_training_data(min_confidence: float = 0.6) -> Tuple[List[Dict[str, Any]], List[str], np.ndarray]:
+    """LLM-labelled emails only, so the model never learns from its own or the rules' output."""
+    query = {
+        "classifications.category": {"$exists": True, "$ne": None},
+        "classifications.confidence": {"$gte": min_confidence},
+        "classifications.tier": {"$in": ["llm", "cache", None]},
+    }
+    projection = {"_id": 0, "subject": 1, "from": 1, "snippet": 1, "classifications.category": 1, "classifications.confidence": 1}
+    emails, labels, weights = [], [], []
+    for doc in get_emails_collection().find(query, projection).batch_size(1000):
+        emails.append(doc)
+        labels.append(doc["classifications"]["category"])
+        weights.append(float(doc["classifications"]["confidence"]))
+    return emails, labels, np.array(weights)
+
+
+def train(min_confidence: float = 0.6, holdout: float = 0.2, threshold: float = LOCAL_CLASSIFIER_THRESHOLD,
+          path: str = LOCAL_CLASSIFIER_PATH, seed: int = 13) -> Dict[str, Any]:
+    emails, labels, weights = load_training_data(min_confidence)
+    if len(set(labels)) < 2:
+        raise ValueError("Need LLM-labelled emails from at least two categories to train")
+
+    order = np.random.default_rng(seed).permutation(len(emails))
+    split = int(len(order) * (1 - holdout))
+    train_idx, test_idx = order[:split], order[split:]
+
+    model = LocalClassifier.fit([emails[i] for i in train_idx], [labels[i] for i in train_idx], weights[train_idx])
+    report = evaluate(model, [emails[i] for i in test_idx], [labels[i] for i in test_idx], threshold)
+    report.update({"trained_on": int(len(train_idx)), "trained_at": datetime.datetime.utcnow().isoformat()})
+
+    # Ship a model fitted on everything, with the holdout report from the split above
+    final = LocalClassifier.fit(emails, labels, weights)
+    final.report = report
+    final.save(path)
+    return report
+
+
+_model = None
+_model_loaded = False
+_model_lock = threading.Lock()
+
+
+def load_local_classifier(path: str = LOCAL_CLASSIFIER_PATH) -> Optional[LocalClassifier]:
+    """(Re)load the persisted model; returns None when no artifact exists yet."""
+    global _model, _model_loaded
+    with _model_lock:
+        _model_loaded = True
+        if not os.path.exists(path):
+            logger.info(f"No local classifier at {path}; every ambiguous email goes to the LLM")
+            _model = None
+        else:
+            _model = LocalClassifier.load(path)
+            logger.info(f"Loaded local classifier from {path} ({len(_model.classes)} classes)")
+    return _model
+
+
+def get_local_classifier() -> Optional[LocalClassifier]:
+    if not _model_loaded:
+        load_local_classifier()
+    return _model
+
+
+# Run Script
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local email classifier")
+    parser.add_argument("task", choices=["train", "report"])
+    parser.add_argument("--min-confidence", type=float, default=0.6)
+    parser.add_argument("--holdout", type=float, default=0.2)
+    args = parser.parse_args()
+
+    if args.task == "train":
+        print(json.dumps(train(min_confidence=args.min_confidence, holdout=args.holdout), indent=2))
+    else:
+        model = load_local_classifier()
+        print(json.dumps(model.report if model else {}, indent=2))
@@ -0,0 +1,202 @@
+"""
+Prometheus metrics.
+
+Histograms cover where a request can spend its time: the endpoint itself,
+Gmail API calls by method, LLM calls (with token counts from the provider's
+usage metadata), Mongo operations by db_service function and rate-limiter
+waits. Counters track emails fetched, classified, served from the
+classification cache and sent. `render()` produces the /metrics body; with
+PROMETHEUS_MULTIPROC_DIR set (several uvicorn workers) it aggregates every
+worker's samples.
+"""
+import functools
+import inspect
+import os
+import re
+import time
+from typing import Any, Dict, Optional
+from urllib.parse import urlparse
+
+from langchain_core.callbacks import BaseCallbackHandler
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Histogram, generate_latest, multiprocess
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+MONGO_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0)
+TOKEN_BUCKETS = (16, 32, 64, 128, 256, 512, 1024, 2048, 4096, 8192, 16384)
+
+HTTP_REQUEST_SECONDS = Histogram(
+    "http_request_duration_seconds", "API request latency until the response body is sent",
+    ["method", "route", "status"], buckets=LATENCY_BUCKETS,
+)
+GMAIL_REQUEST_SECONDS = Histogram(
+    "gmail_api_request_duration_seconds", "Gmail API HTTP request latency by API method",
+    ["method", "status"], buckets=LATENCY_BUCKETS,
+)
+LLM_REQUEST_SECONDS = Histogram(
+    "llm_request_duration_seconds", "Chat model call latency by calling service",
+    ["caller", "outcome"], buckets=LATENCY_BUCKETS,
+)
+LLM_TOKENS = Histogram(
+    "llm_request_tokens", "Prompt and response tokens per chat model call",
+    ["caller", "kind"], buckets=TOKEN_BUCKETS,
+)
+MONGO_OPERATION_SECONDS = Histogram(
+    "mongo_operation_duration_seconds", "Latency of database functions",
+    ["function"], buckets=MONGO_BUCKETS,
+)
+RATE_LIMIT_WAIT_SECONDS = Histogram(
+    "rate_limit_wait_seconds", "Time spent waiting for a rate limiter slot",
+    ["limiter"], buckets=LATENCY_BUCKETS,
+)
+
+EMAILS_FETCHED = Counter("emails_fetched", "Messages fetched from Gmail")
+EMAILS_CLASSIFIED = Counter("emails_classified", "Emails classified, by the tier that decided", ["tier"])
+CLASSIFICATION_CACHE_HITS = Counter("classification_cache_hits", "Classification cache hits", ["tier"])
+CLASSIFICATION_CACHE_MISSES = Counter("classification_cache_misses", "Classification cache misses")
+EMAILS_SENT = Counter("emails_sent", "Replies delivered through the send queue")
+
+# Most specific first; matched against the URL path
+GMAIL_METHODS = [
+    (re.compile(r"^/batch"), "batch"),
+    (re.compile(r"/messages/send$"), "messages.send"),
+    (re.compile(r"/messages/[^/]+/attachments/[^/]+$"), "messages.attachments.get"),
+    (re.compile(r"/messages/[^/]+$"), "messages.get"),
+    (re.compile(r"/messages$"), "messages.list"),
+    (re.compile(r"/history$"), "history.list"),
+    (re.compile(r"/profile$"), "getProfile"),
+]
+
+
+def render() -> bytes:
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry)
+    return generate_latest(REGISTRY)
+
+
+def _status_class(status: Optional[int]) -> str:
+    # Classes rather than codes keep the label set small; "error" means no response
+    return f"{int(status) // 100}xx" if status else "error"
+
+
+def gmail_method(url: str) -> str:
+    path = urlparse(url).path
+    for pattern, method in GMAIL_METHODS:
+        if pattern.search(path):
+            return method
+    return "other"
+
+
+def observe_gmail(url: str, started: float, status: Optional[int]):
+    GMAIL_REQUEST_SECONDS.labels(gmail_method(url), _status_class(status)).observe(time.perf_counter() - started)
+
+
+class InstrumentedHttp:
+    """Wraps the httplib2-style object googleapiclient sends through; every request (batches included) is timed"""
+
+    def __init__(self, http):
+        self._http = http
+
+    def request(self, uri, method="GET", *args, **kwargs):
+        started = time.perf_counter()
+        status = None
+        try:
+            response, content = self._http.request(uri, method, *args, **kwargs)
+            status = response.status
+            return response, content
+        finally:
+            observe_gmail(uri, started, status)
+
+    def __getattr__(self, name):
+        # credentials, close() etc. come from the wrapped object
+        return getattr(self._http, name)
+
+
+def timed_mongo(fn):
+    """Record a database function's latency under its module-qualified name"""
+    histogram = MONGO_OPERATION_SECONDS.labels(f"{fn.__module__.rsplit('.', 1)[-1]}.{fn.__name__}")
+
+    if inspect.iscoroutinefunction(fn):
+        @functools.wraps(fn)
+        async def async_wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return await fn(*args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - started)
+        return async_wrapper
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            histogram.observe(time.perf_counter() - started)
+    return wrapper
+
+
+class LLMMetricsHandler(BaseCallbackHandler):
+    """LangChain callback timing each chat model call and recording its token usage"""
+
+    # Called on the event loop for async runs instead of through a thread pool
+    run_inline = True
+
+    def __init__(self, caller: str):
+        self.caller = caller
+        self._started: Dict[Any, float] = {}
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        self._started[run_id] = time.perf_counter()
+
+    def on_llm_start(self, serialized, prompts, *, run_id, **kwargs):
+        self._started[run_id] = time.perf_counter()
+
+    def _observe(self, run_id, outcome: str):
+        started = self._started.pop(run_id, None)
+        if started is not None:
+            LLM_REQUEST_SECONDS.labels(self.caller, outcome).observe(time.perf_counter() - started)
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        self._observe(run_id, "ok")
+        for generations in response.generations:
+            for generation in generations:
+                usage = getattr(getattr(generation, "message", None), "usage_metadata", None)
+                if usage:
+                    LLM_TOKENS.labels(self.caller, "prompt").observe(usage.get("input_tokens", 0))
+                    LLM_TOKENS.labels(self.caller, "response").observe(usage.get("output_tokens", 0))
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._observe(run_id, "error")
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware recording request latency per route template (not raw path,
+    which would give every email id its own series). Streaming responses are
+    timed until their last chunk is sent.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        started = time.perf_counter()
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            # The router stores the matched route in the shared scope
+            route = getattr(scope.get("route"), "path", None) or "unmatched"
+            HTTP_REQUEST_SECONDS.labels(scope["method"], route, str(status)).observe(time.perf_counter() - started)
@@ -0,0 +1,209 @@
+"""
+Explicit schema migrations (indexes and data backfills).
+
+Run once per deployment, not on import:
+    python -m services.migrations
+"""
+import datetime
+from email.utils import parseaddr
+
+from pymongo import UpdateOne
+
+from services.mongo import get_collection, get_emails_collection, get_responses_collection
+from services.classification_cache import CACHE_COLLECTION
+from services.job_service import JOBS_COLLECTION
+from services.send_queue import OUTBOUND_COLLECTION
+from services.thread_service import THREADS_COLLECTION
+from services.body_store import COLD_FIELDS, put_bodies, split_email
+from services.db_service import STATE_PENDING, STATE_CLASSIFIED
+from config.settings import CLASSIFICATION_CACHE_TTL_SECONDS
+from services.logger import get_logger
+
+logger = get_logger(__name__)
+
+MIGRATIONS_COLLECTION = "schema_migrations"
+
+
+def _email_indexes():
+    emails_collection = get_emails_collection()
+    emails_collection.create_index(
+        [("provider", 1), ("provider_message_id", 1)],
+        unique=True,
+        name="provider_msgid_unique"
+    )
+    emails_collection.create_index("date", name="date_idx")
+    emails_collection.create_index("from", name="from_idx")
+    emails_collection.create_index("labels", name="labels_idx")
+
+
+def _classification_cache_ttl():
+    get_collection(CACHE_COLLECTION).create_index(
+        "created_at",
+        expireAfterSeconds=CLASSIFICATION_CACHE_TTL_SECONDS,
+        name="created_at_ttl"
+    )
+
+
+def _classification_state():
+    emails_collection = get_emails_collection()
+    # Backfill the explicit state from the old "has a category" test
+    classified = emails_collection.update_many(
+        {"classification_state": {"$exists": False}, "classifications.category": {"$exists": True, "$ne": None}},
+        {"$set": {"classification_state": STATE_CLASSIFIED}}
+    )
+    pending = emails_collection.update_many(
+        {"classification_state": {"$exists": False}},
+        {"$set": {"classification_state": STATE_PENDING}}
+    )
+    logger.info(f"Backfilled classification_state: {classified.modified_count} classified, {pending.modified_count} pending")
+
+    # Only pending emails are indexed, so the index stays as small as the backlog
+    emails_collection.create_index(
+        [("date", -1)],
+        partialFilterExpression={"classification_state": STATE_PENDING},
+        name="pending_date_idx"
+    )
+
+
+def _list_indexes():
+    emails_collection = get_emails_collection()
+    # Backfill the normalised sender address used by the sender filter
+    ops, backfilled = [], 0
+    for doc in emails_collection.find({"sender_address": {"$exists": False}}, {"from": 1}).batch_size(1000):
+        ops.append(UpdateOne({"_id": doc["_id"]}, {"$set": {"sender_address": parseaddr(doc.get("from") or "")[1].lower()}}))
+        if len(ops) >= 1000:
+            backfilled += emails_collection.bulk_write(ops, ordered=False).modified_count
+            ops = []
+    if ops:
+        backfilled += emails_collection.bulk_write(ops, ordered=False).modified_count
+    logger.info(f"Backfilled sender_address on {backfilled} emails")
+
+    # Keyset pages sort on (date, _id); equality filters lead, range-only fields trail
+    classified = {"classification_state": STATE_CLASSIFIED}
+    emails_collection.create_index(
+        [("date", -1), ("_id", -1)],
+        partialFilterExpression=classified,
+        name="classified_date_idx"
+    )
+    emails_collection.create_index(
+        [("classifications.category", 1), ("date", -1), ("_id", -1), ("classifications.confidence", 1)],
+        partialFilterExpression=classified,
+        name="classified_category_date_idx"
+    )
+    emails_collection.create_index(
+        [("sender_address", 1), ("date", -1), ("_id", -1)],
+        partialFilterExpression=classified,
+        name="classified_sender_date_idx"
+    )
+
+    responses_collection = get_responses_collection()
+    responses_collection.create_index([("created_at", -1), ("_id", -1)], name="created_at_idx")
+    responses_collection.create_index([("to", 1), ("created_at", -1), ("_id", -1)], name="to_created_at_idx")
+
+
+def _job_indexes():
+    jobs_collection = get_collection(JOBS_COLLECTION)
+    # At most one active job per dedup key; finished jobs drop out of the index
+    jobs_collection.create_index(
+        "dedup_key",
+        unique=True,
+        partialFilterExpression={"active": True, "dedup_key": {"$exists": True}},
+        name="active_dedup_key_unique"
+    )
+    jobs_collection.create_index([("type", 1), ("created_at", -1)], name="type_created_at_idx")
+    jobs_collection.create_index([("created_at", -1)], name="created_at_idx")
+
+
+def _split_bodies(batch_size: int = 500):
+    emails_collection = get_emails_collection()
+    # Move inline bodies and headers into the compressed body store, a batch at a time.
+    # One pass in _id order: each batch resumes after the last _id instead of rescanning from the start
+    has_cold = {"$or": [{field: {"$exists": True}} for field in COLD_FIELDS]}
+    projection = {"provider": 1, "provider_message_id": 1, **{field: 1 for field in COLD_FIELDS}}
+    moved = 0
+    last_id = None
+    while True:
+        query = {**has_cold, "_id": {"$gt": last_id}} if last_id is not None else has_cold
+        docs = list(emails_collection.find(query, projection).sort("_id", 1).limit(batch_size))
+        if not docs:
+            break
+        last_id = docs[-1]["_id"]
+        put_bodies(docs)
+        emails_collection.bulk_write([
+            UpdateOne(
+                {"_id": doc["_id"]},
+                {"$set": {"has_list_unsubscribe": split_email(doc)[0]["has_list_unsubscribe"]},
+                 "$unset": {field: "" for field in COLD_FIELDS}}
+            )
+            for doc in docs
+        ], ordered=False)
+        moved += len(docs)
+    emails_collection.update_many({"has_list_unsubscribe": {"$exists": False}}, {"$set": {"has_list_unsubscribe": False}})
+    logger.info(f"Moved bodies of {moved} emails to the body store")
+
+
+def _outbound_indexes():
+    # Serves the send queue's claim query
+    get_collection(OUTBOUND_COLLECTION).create_index([("status", 1), ("next_attempt_at", 1)], name="status_next_attempt_idx")
+    # At most one response per idempotency key
+    get_responses_collection().create_index(
+        "idempotency_key",
+        unique=True,
+        partialFilterExpression={"idempotency_key": {"$exists": True}},
+        name="idempotency_key_unique"
+    )
+
+
+def _thread_indexes():
+    # Messages of one thread in date order, for summary refreshes
+    get_emails_collection().create_index([("provider", 1), ("thread_id", 1), ("date", 1)], name="provider_thread_date_idx")
+    # Only stale threads are indexed, so the refresh queue stays small
+    get_collection(THREADS_COLLECTION).create_index(
+        "marked_at",
+        partialFilterExpression={"stale": True},
+        name="stale_marked_at_idx"
+    )
+
+
+def _classification_attempts():
+    emails_collection = get_emails_collection()
+    # The unclassified query orders pending emails by failed attempts before date
+    emails_collection.create_index(
+        [("classification_attempts", 1), ("date", -1)],
+        partialFilterExpression={"classification_state": STATE_PENDING},
+        name="pending_attempts_date_idx"
+    )
+    emails_collection.drop_index("pending_date_idx")
+
+
+# Applied in order; never rename or reorder an entry once it has shipped
+MIGRATIONS = [
+    ("0001_email_indexes", _email_indexes),
+    ("0002_classification_cache_ttl", _classification_cache_ttl),
+    ("0003_classification_state", _classification_state),
+    ("0004_list_indexes", _list_indexes),
+    ("0005_job_indexes", _job_indexes),
+    ("0006_split_bodies", _split_bodies),
+    ("0007_outbound_indexes", _outbound_indexes),
+    ("0008_thread_indexes", _thread_indexes),
+    ("0009_classification_attempts", _classification_attempts),
+]
+
+
+def run_migrations():
+    """Apply every migration that has not been recorded yet"""
+    migrations_collection = get_collection(MIGRATIONS_COLLECTION)
+    applied = {m["_id"] for m in migrations_collection.find({}, {"_id": 1})}
+
+    for name, migrate in MIGRATIONS:
+        if name in applied:
+            continue
+        logger.info(f"Applying migration {name}...")
+        migrate()
+        migrations_collection.insert_one({"_id": name, "applied_at": datetime.datetime.utcnow()})
+        logger.info(f"Migration {name} applied")
+
+
+# Run Script
+if __name__ == "__main__":
+    run_migrations()
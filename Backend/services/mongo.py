@@ -0,0 +1,99 @@
+import threading
+
+from pymongo import MongoClient, AsyncMongoClient
+from pymongo.asynchronous.collection import AsyncCollection
+from pymongo.asynchronous.database import AsyncDatabase
+from pymongo.collection import Collection
+from pymongo.database import Database
+from services.logger import get_logger
+from config.settings import (
+    MONGO_URI, MONGO_DB, MONGO_COLLECTION, MONGO_MAX_POOL_SIZE, MONGO_MIN_POOL_SIZE,
+    MONGO_SERVER_SELECTION_TIMEOUT_MS, MONGO_CONNECT_TIMEOUT_MS, MONGO_SOCKET_TIMEOUT_MS
+)
+
+logger = get_logger(__name__)
+
+_client = None
+_async_client = None
+_lock = threading.Lock()
+
+
+def _client_options() -> dict:
+    return dict(
+        maxPoolSize=MONGO_MAX_POOL_SIZE,
+        minPoolSize=MONGO_MIN_POOL_SIZE,
+        serverSelectionTimeoutMS=MONGO_SERVER_SELECTION_TIMEOUT_MS,
+        connectTimeoutMS=MONGO_CONNECT_TIMEOUT_MS,
+        socketTimeoutMS=MONGO_SOCKET_TIMEOUT_MS,
+    )
+
+
+def get_client() -> MongoClient:
+    """Return the process-wide MongoClient, creating it on first use"""
+    global _client
+    if _client is None:
+        with _lock:
+            if _client is None:
+                # MongoClient connects in the background; nothing blocks until the first operation
+                _client = MongoClient(MONGO_URI, **_client_options())
+                logger.info(f"MongoDB client created (maxPoolSize={MONGO_MAX_POOL_SIZE})")
+    return _client
+
+
+def get_db() -> Database:
+    return get_client()[MONGO_DB]
+
+
+def get_collection(name: str) -> Collection:
+    return get_db()[name]
+
+
+def get_emails_collection() -> Collection:
+    return get_collection(MONGO_COLLECTION)
+
+
+def get_responses_collection() -> Collection:
+    return get_collection("responses")
+
+
+def close_client():
+    global _client
+    with _lock:
+        if _client is not None:
+            _client.close()
+            _client = None
+
+
+def get_async_client() -> AsyncMongoClient:
+    """Process-wide AsyncMongoClient for async handlers; bound to the event loop that first uses it"""
+    global _async_client
+    if _async_client is None:
+        with _lock:
+            if _async_client is None:
+                _async_client = AsyncMongoClient(MONGO_URI, **_client_options())
+                logger.info(f"Async MongoDB client created (maxPoolSize={MONGO_MAX_POOL_SIZE})")
+    return _async_client
+
+
+def get_async_db() -> AsyncDatabase:
+    return get_async_client()[MONGO_DB]
+
+
+def get_async_collection(name: str) -> AsyncCollection:
+    return get_async_db()[name]
+
+
+def get_async_emails_collection() -> AsyncCollection:
+    return get_async_collection(MONGO_COLLECTION)
+
+
+def get_async_responses_collection() -> AsyncCollection:
+    return get_async_collection("responses")
+
+
+async def close_async_client():
+    global _async_client
+    with _lock:
+        client, _async_client = _async_client, None
+    if client is not None:
+        await client.close()
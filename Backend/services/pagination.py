@@ -0,0 +1,100 @@
+"""
+Keyset (seek) pagination over a (sort field, _id) pair, newest first.
+
+Pages are fetched with a range predicate on the last seen key instead of
+skip(), so every page is an index seek no matter how deep the client goes.
+The position is handed to clients as an opaque urlsafe base64 token.
+"""
+import base64
+import datetime
+import json
+from typing import Dict, Any, List, Optional, Tuple
+
+from bson import ObjectId
+from bson.errors import InvalidId
+from pymongo.collection import Collection
+from pymongo.asynchronous.collection import AsyncCollection
+
+MAX_PAGE_SIZE = 500
+
+
+class InvalidCursorError(ValueError):
+    pass
+
+
+def encode_cursor(value: Any, _id: ObjectId) -> str:
+    if isinstance(value, datetime.datetime):
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=datetime.timezone.utc)
+        value = {"ms": int(value.timestamp() * 1000)}
+    raw = json.dumps([value, str(_id)], separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(token: str) -> Tuple[Any, ObjectId]:
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+        value, _id = json.loads(raw)
+        if isinstance(value, dict):
+            value = datetime.datetime.fromtimestamp(value["ms"] / 1000, tz=datetime.timezone.utc)
+        return value, ObjectId(_id)
+    except (ValueError, TypeError, KeyError, InvalidId) as e:
+        raise InvalidCursorError(f"Invalid cursor: {token!r}") from e
+
+
+def _after(field: str, value: Any, _id: ObjectId) -> Dict[str, Any]:
+    """Everything strictly after (value, _id) in (field desc, _id desc) order."""
+    if value is None:
+        # Missing values sort last; only the _id tiebreak is left
+        return {field: None, "_id": {"$lt": _id}}
+    return {"$or": [
+        {field: {"$lt": value}},
+        {field: value, "_id": {"$lt": _id}},
+        {field: None},
+    ]}
+
+
+def _page_find_args(query: Dict[str, Any], projection: Dict[str, Any], sort_field: str, limit: int, cursor: Optional[str]):
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    if cursor:
+        query = {"$and": [query, _after(sort_field, *decode_cursor(cursor))]}
+    # Both keys must be projected to build the next cursor
+    projection = {**projection, sort_field: 1, "_id": 1}
+    return query, projection, [(sort_field, -1), ("_id", -1)], limit
+
+
+def _page_result(docs: List[Dict[str, Any]], sort_field: str, limit: int) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    next_cursor = None
+    if len(docs) > limit:
+        docs = docs[:limit]
+        last = docs[-1]
+        next_cursor = encode_cursor(last.get(sort_field), last["_id"])
+    return docs, next_cursor
+
+
+def keyset_page(
+    collection: Collection,
+    query: Dict[str, Any],
+    projection: Dict[str, Any],
+    sort_field: str,
+    limit: int,
+    cursor: Optional[str] = None,
+) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """Return (documents, next_cursor); next_cursor is None on the last page."""
+    query, projection, sort, limit = _page_find_args(query, projection, sort_field, limit, cursor)
+    docs = list(collection.find(query, projection).sort(sort).limit(limit + 1))
+    return _page_result(docs, sort_field, limit)
+
+
+async def async_keyset_page(
+    collection: AsyncCollection,
+    query: Dict[str, Any],
+    projection: Dict[str, Any],
+    sort_field: str,
+    limit: int,
+    cursor: Optional[str] = None,
+) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """keyset_page for an AsyncCollection"""
+    query, projection, sort, limit = _page_find_args(query, projection, sort_field, limit, cursor)
+    docs = await collection.find(query, projection).sort(sort).limit(limit + 1).to_list(length=limit + 1)
+    return _page_result(docs, sort_field, limit)
@@ -1,73 +1,24 @@
-from google.auth.transport.requests import Request
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
 import os
-import datetime
-from typing import Dict, Any
-from pymongo import MongoClient
-from pymongo.errors import ServerSelectionTimeoutError
-from email.mime.text import MIMEText
-import base64
+import asyncio
+from typing import Dict, Any, List, AsyncIterator
 from bson import ObjectId
 
 from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain.prompts import ChatPromptTemplate
-from langchain_core.runnables import RunnablePassthrough
-from config.settings import MONGO_URI as SETTINGS_MONGO_URI, MONGO_DB as SETTINGS_MONGO_DB, MONGO_COLLECTION as SETTINGS_MONGO_COLLECTION
-
-MONGO_URI = SETTINGS_MONGO_URI
-MONGO_DB = SETTINGS_MONGO_DB
-MONGO_COLLECTION = SETTINGS_MONGO_COLLECTION
-token_path = "./services/token.json"
-creds_path = "./services/credentials.json"
-
-try:
-    client = MongoClient(MONGO_URI, serverSelectionTimeoutMS=5000)
-    client.server_info()  # verify connection
-    db = client[MONGO_DB]
-    emails_collection = db[MONGO_COLLECTION]
-    responses_collection = db["responses"]
-    print("Mongodb connected")
-    
-except ServerSelectionTimeoutError as e:
-    print("Mongodb connection failed")
-    raise e
-
-# Gmail API Setup
-SCOPES = ["https://www.googleapis.com/auth/gmail.send"]
-
-def get_gmail_service():
-    creds = None
-    if os.path.exists(token_path):
-        creds = Credentials.from_authorized_user_file(token_path, SCOPES)
-    if not creds or not creds.valid:
-        if creds and creds.expired and creds.refresh_token:
-            creds.refresh(Request())
-        else:
-            flow = InstalledAppFlow.from_client_secrets_file(creds_path, SCOPES)
-            creds = flow.run_local_server(port=0)
-        with open(token_path, "w") as token:
-            token.write(creds.to_json())
-    service = build("gmail", "v1", credentials=creds)
-    return service
-
-def send_email(to: str, subject: str, body: str):
-    message = MIMEText(body)
-    message["to"] = to
-    message["subject"] = subject
-    raw = base64.urlsafe_b64encode(message.as_bytes()).decode()
-
-    service = get_gmail_service()
-    sent = service.users().messages().send(userId="me", body={"raw": raw}).execute()
-    return sent
+from services.body_store import get_bodies
+from services.mongo import get_emails_collection
+from services.send_queue import get_send_queue, request_key
+from services.thread_service import get_thread_contexts, build_prompt_context
+from services.metrics import LLMMetricsHandler
+from config.settings import RESPONDER_CONCURRENCY, RESPOND_SEND_WAIT_SECONDS
 
 
 # Gemini + LangChain Setup
 llm = ChatGoogleGenerativeAI(
     model="gemini-2.5-flash",
     google_api_key=os.getenv("GEMINI_API_KEY"),
-    temperature=0.4
+    temperature=0.4,
+    callbacks=[LLMMetricsHandler("responder")]
 )
 
 prompt = ChatPromptTemplate.from_template("""
@@ -78,26 +29,192 @@ From: {sender}
 To: {recipient}
 Subject: {subject}
 
+Earlier in this thread (summary):
+{thread_summary}
+
 Email Body:
 {email_body}
 
+Later in this thread (sent after this email):
+{later_messages}
+
 Reply in 3-5 sentences and ensure clarity and relevance.
 Your response should address the main points of the email and provide any necessary information or clarification.
 Reply:
 """)
 
 # Build Runnable pipeline
-responder_chain = (
-    {"sender": RunnablePassthrough(),
-     "recipient": RunnablePassthrough(),
-     "subject": RunnablePassthrough(),
-     "email_body": RunnablePassthrough()}
-    | prompt
-    | llm
-)
+responder_chain = prompt | llm
+
+# Email fields a reply needs
+REPLY_PROJECTION = {"provider": 1, "provider_message_id": 1, "thread_id": 1, "from": 1, "to": 1, "subject": 1, "snippet": 1, "body_plain": 1,
+                    "has_list_unsubscribe": 1}
+
+def load_reply_contexts(email_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+    """
+    Reply context (addresses, subject, thread context, body) for many email ids with one
+    emails query, one body-store query and the thread-context queries; no LLM calls.
+    Ids that are invalid or not found map to {"error": ...}.
+    """
+    contexts: Dict[str, Dict[str, Any]] = {}
+    oids = {}
+    for email_id in email_ids:
+        try:
+            oids[ObjectId(email_id)] = email_id
+        except Exception:
+            contexts[email_id] = {"error": "Invalid ObjectId format"}
+
+    docs = {oids[doc["_id"]]: doc for doc in get_emails_collection().find({"_id": {"$in": list(oids)}}, REPLY_PROJECTION)}
+    # Bodies live in the compressed body store; older documents may still carry them inline
+    bodies = get_bodies([(doc.get("provider", "gmail"), doc.get("provider_message_id")) for doc in docs.values()])
+    threads = get_thread_contexts([
+        (doc.get("provider", "gmail"), doc.get("thread_id"), doc.get("provider_message_id")) for doc in docs.values()
+    ])
+
+    for email_id in oids.values():
+        email_doc = docs.get(email_id)
+        if not email_doc:
+            contexts[email_id] = {"error": "Email not found!"}
+            continue
+        provider = email_doc.get("provider", "gmail")
+        stored_body = bodies.get((provider, email_doc.get("provider_message_id")), {})
+        thread = threads.get((provider, email_doc.get("thread_id"), email_doc.get("provider_message_id")), {})
+        contexts[email_id] = {
+            "email_id": email_id,
+            "thread_id": email_doc.get("thread_id"),
+            "sender": email_doc.get("from", ""),
+            "recipient": email_doc.get("to", [])[0] if email_doc.get("to") else "unknown@example.com",
+            "subject": "Re: " + (email_doc.get("subject") or "No Subject"),
+            # The thread before and after this message, plus the message itself, within a fixed token budget
+            **build_prompt_context(
+                thread.get("summary", ""),
+                stored_body.get("body_plain") or email_doc.get("body_plain", ""),
+                stored_body.get("body_html", ""),
+                email_doc.get("snippet", ""),
+                earlier=thread.get("earlier", []),
+                later=thread.get("later", []),
+                bulk=bool(email_doc.get("has_list_unsubscribe")),
+            ),
+        }
+    return contexts
+
+def _chain_inputs(context: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "sender": context["sender"],
+        "recipient": context["recipient"],
+        "subject": context["subject"],
+        "thread_summary": context["thread_summary"],
+        "email_body": context["email_body"],
+        "later_messages": context["later_messages"]
+    }
+
+def load_reply_context(email_id: str) -> Dict[str, Any]:
+    context = load_reply_contexts([email_id])[email_id]
+    if "error" in context:
+        raise ValueError(context["error"])
+    return context
+
+async def generate_drafts_async(email_ids: List[str], concurrency: int = RESPONDER_CONCURRENCY) -> List[Dict[str, Any]]:
+    """
+    Draft replies for many emails with at most `concurrency` LLM calls in flight.
+    Results are aligned with `email_ids`; failures carry status "error" instead of raising.
+    """
+    contexts = await asyncio.to_thread(load_reply_contexts, email_ids)
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+
+    async def draft_one(email_id: str) -> Dict[str, Any]:
+        context = contexts[email_id]
+        if "error" in context:
+            return {"email_id": email_id, "status": "error", "error": context["error"]}
+        try:
+            async with semaphore:
+                result = await responder_chain.ainvoke(_chain_inputs(context))
+        except Exception as e:
+            print(f"[ERROR] Draft generation failed for {email_id}: {e}")
+            return {"email_id": email_id, "status": "error", "error": str(e)}
+        return {
+            "email_id": email_id,
+            "thread_id": context["thread_id"],
+            "to": context["sender"],
+            "from": context["recipient"],
+            "subject": context["subject"],
+            "draft": result.content,
+            "status": "draft_generated",
+        }
+
+    return list(await asyncio.gather(*(draft_one(email_id) for email_id in email_ids)))
+
+def _chunk_text(chunk) -> str:
+    # Chunk content is a string, or a list of parts for multimodal models
+    content = chunk.content
+    if isinstance(content, str):
+        return content
+    return "".join(part.get("text", "") if isinstance(part, dict) else str(part) for part in content)
+
+async def astream_draft(context: Dict[str, Any]) -> AsyncIterator[str]:
+    """Yield the reply draft for a loaded reply context as the LLM streams it"""
+    async for chunk in responder_chain.astream(_chain_inputs(context)):
+        text = _chunk_text(chunk)
+        if text:
+            yield text
+
+def _send(context: Dict[str, Any], body: str, edited_by_human: bool, idempotency_key: str = None) -> Dict[str, Any]:
+    """Queue a reply and wait up to RESPOND_SEND_WAIT_SECONDS for delivery"""
+    queue = get_send_queue()
+    outbound = queue.enqueue(
+        email_id=context["email_id"],
+        to=context["sender"],
+        subject=context["subject"],
+        body=body,
+        sender=context["recipient"],
+        thread_id=context["thread_id"],
+        edited_by_human=edited_by_human,
+        key=idempotency_key,
+    )
+    # "queued" or "sending" after the wait means delivery continues in the background
+    return queue.wait(outbound["_id"], RESPOND_SEND_WAIT_SECONDS)
+
+def send_reply(email_id: str, body: str, edited_by_human: bool = True, idempotency_key: str = None) -> Dict[str, Any]:
+    """Send final reply text as given (e.g. a streamed draft after the user edited it), without calling the LLM"""
+    if not body or not body.strip():
+        raise ValueError("Reply body is empty")
+    context = load_reply_context(email_id)
+    outbound = _send(context, body, edited_by_human, idempotency_key)
+    return {
+        "email_id": email_id,
+        "to": context["sender"],
+        "from": context["recipient"],
+        "subject": context["subject"],
+        "draft": body,
+        "status": outbound["status"],
+        "outbound_id": outbound["_id"],
+        "gmail_response": outbound.get("gmail_response")
+    }
+
+def queue_drafts(drafts: List[Dict[str, Any]], client_key: str = None) -> List[Dict[str, Any]]:
+    """
+    Put generated drafts on the outbound send queue; adds outbound_id and the queue status to each.
+    `client_key` is the request's Idempotency-Key, applied per email.
+    """
+    queue = get_send_queue()
+    for draft in drafts:
+        if draft["status"] != "draft_generated":
+            continue
+        outbound = queue.enqueue(
+            email_id=draft["email_id"],
+            to=draft["to"],
+            subject=draft["subject"],
+            body=draft["draft"],
+            sender=draft["from"],
+            thread_id=draft.get("thread_id"),
+            key=request_key(draft["email_id"], client_key),
+        )
+        draft["outbound_id"] = outbound["_id"]
+        draft["status"] = outbound["status"]
+    return drafts
 
 # Responder Agent
-def generate_response(email_id: str, human_input: str = None, send_email_flag: bool = True):
+def generate_response(email_id: str, human_input: str = None, send_email_flag: bool = True, idempotency_key: str = None):
     """
     Generate and optionally send a response to an email.
 
@@ -105,60 +222,45 @@ def generate_response(email_id: str, human_input: str = None, send_email_flag: b
         email_id (str): MongoDB ObjectId of the email.
         human_input (str, optional): Edited draft to merge with AI draft.
         send_email_flag (bool): If True, send the email. If False, just generate draft.
+        idempotency_key (str, optional): Key for the send queue; a retried request with the same key returns
+            the reply already queued instead of sending a new draft. Without one, every call is a new reply.
     
     Returns:
         dict: Contains merged draft, email metadata, and status info.
     """
-    try:
-        oid = ObjectId(email_id)
-    except Exception:
-        raise ValueError("Invalid ObjectId format")
-    
-    email_doc: Dict[str, Any] = emails_collection.find_one({"_id": oid})
-    if not email_doc:
-        raise ValueError("Email not found!")
-
-    sender = email_doc.get("from", "")
-    recipient = email_doc.get("to", [])[0] if email_doc.get("to") else "unknown@example.com"
-    subject = "Re: " + (email_doc.get("subject") or "No Subject")
-    body = email_doc.get("body_plain") or email_doc.get("snippet") or ""
-
-    # Step 1: Generate draft using AI
-    ai_draft = responder_chain.invoke({
-        "sender": sender,
-        "recipient": recipient,
-        "subject": subject,
-        "email_body": body
-    }).content
-
-    # Step 2: Merge AI draft with human input if provided
-    if human_input:
-        # Merge: AI draft first, then human edits separated by a line
-        if human_input=="string":
-            human_input=""
-        merged_draft = f"{ai_draft}\n{human_input}"
+    context = load_reply_context(email_id)
+    sender = context["sender"]
+    recipient = context["recipient"]
+    subject = context["subject"]
+    if human_input == "string":
+        human_input = ""
+    # The draft differs on every call, so the key comes from the request rather than the reply text
+    idempotency_key = idempotency_key or request_key(email_id)
+    existing = get_send_queue().get(idempotency_key) if send_email_flag else None
+
+    if existing:
+        # Retried request: reuse the reply already queued (a failed one is queued again) instead of drafting another
+        merged_draft = existing["body"]
     else:
-        merged_draft = ai_draft
+        # Step 1: Generate draft using AI
+        ai_draft = responder_chain.invoke(_chain_inputs(context)).content
+
+        # Step 2: Merge AI draft with human input if provided
+        if human_input:
+            # Merge: AI draft first, then human edits separated by a line
+            merged_draft = f"{ai_draft}\n{human_input}"
+        else:
+            merged_draft = ai_draft
 
-    # Step 3: Optionally send email
+    # Step 3: Optionally send through the outbound queue and wait for delivery
     result = None
+    outbound_id = None
     status = "draft_generated"
     if send_email_flag:
-        result = send_email(sender, subject, merged_draft)
-        responses_collection.insert_one({
-            "email_id": email_id,
-            "thread_id": email_doc.get("thread_id"),
-            "to": sender,
-            "from": recipient,
-            "subject": subject,
-            "body": merged_draft,
-            "status": "sent",
-            "edited_by_human": bool(human_input),
-            "created_at": datetime.datetime.utcnow(),
-            "sent_at": datetime.datetime.utcnow(),
-            "gmail_response": result
-        })
-        status = "sent"
+        outbound = _send(context, merged_draft, bool(human_input), idempotency_key)
+        outbound_id = outbound["_id"]
+        status = outbound["status"]
+        result = outbound.get("gmail_response")
 
     return {
         "email_id": email_id,
@@ -167,5 +269,6 @@ def generate_response(email_id: str, human_input: str = None, send_email_flag: b
         "subject": subject,
         "draft": merged_draft,
         "status": status,
+        "outbound_id": outbound_id,
         "gmail_response": result
     }
@@ -0,0 +1,86 @@
+import json
+import re
+from email.utils import parseaddr
+from typing import Dict, Any, List, Optional
+
+from services.logger import get_logger
+from config.settings import CLASSIFIER_RULES_PATH
+
+logger = get_logger(__name__)
+
+
+class Rule:
+    """
+    One deterministic classification rule. Every condition present must match:
+    - labels_any: at least one of these Gmail labels is set
+    - sender_patterns: regex matched against the lowercased sender address
+    - subject_patterns: regex matched against the subject
+    - has_list_unsubscribe: presence of the List-Unsubscribe header
+    """
+
+    def __init__(self, spec: Dict[str, Any], categories: List[str]):
+        if spec["category"] not in categories:
+            raise ValueError(f"Rule {spec.get('name')} uses unknown category {spec['category']!r}")
+        self.name = spec["name"]
+        self.category = spec["category"]
+        self.confidence = float(spec.get("confidence", 0.9))
+        self.labels_any = set(spec.get("labels_any", []))
+        self.sender_patterns = [re.compile(p) for p in spec.get("sender_patterns", [])]
+        self.subject_patterns = [re.compile(p) for p in spec.get("subject_patterns", [])]
+        self.has_list_unsubscribe = spec.get("has_list_unsubscribe")
+
+    def matches(self, email: Dict[str, Any], sender: str) -> bool:
+        if self.labels_any and not self.labels_any.intersection(email.get("labels") or []):
+            return False
+        if self.sender_patterns and not any(p.search(sender) for p in self.sender_patterns):
+            return False
+        subject = email.get("subject") or ""
+        if self.subject_patterns and not any(p.search(subject) for p in self.subject_patterns):
+            return False
+        if self.has_list_unsubscribe is not None:
+            # Hot flag on stored emails; raw headers only on freshly fetched ones
+            has_header = bool(email.get("has_list_unsubscribe") or (email.get("headers") or {}).get("List-Unsubscribe"))
+            if has_header != self.has_list_unsubscribe:
+                return False
+        return True
+
+
+class RuleEngine:
+    """Ordered rule list; the first matching rule decides."""
+
+    def __init__(self, rules: List[Rule]):
+        self.rules = rules
+
+    @classmethod
+    def from_file(cls, path: str, categories: List[str]) -> "RuleEngine":
+        with open(path, encoding="utf-8") as f:
+            specs = json.load(f)
+        logger.info(f"Loaded {len(specs)} classification rules from {path}")
+        return cls([Rule(spec, categories) for spec in specs])
+
+    def classify(self, email: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Return a classification for confidently matched mail, or None to defer to the LLM."""
+        sender = parseaddr(email.get("from") or "")[1].lower()
+        for rule in self.rules:
+            if rule.matches(email, sender):
+                return {
+                    "category": rule.category,
+                    "confidence": rule.confidence,
+                    "reasoning": f"Matched rule '{rule.name}'",
+                    "summary": (email.get("snippet") or "")[:200],
+                    "tier": "rules",
+                }
+        return None
+
+
+_engine = None
+
+
+def get_rule_engine(categories: List[str]) -> Optional[RuleEngine]:
+    """Shared engine loaded from CLASSIFIER_RULES_PATH; None when rules are disabled."""
+    global _engine
+    if not CLASSIFIER_RULES_PATH:
+        return None
+    if _engine is None:
+        _engine = RuleEngine.from_file(CLASSIFIER_RULES_PATH, categories)
+    return _engine
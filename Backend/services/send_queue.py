@@ -0,0 +1,319 @@
+"""
+Outbound email queue.
+
+A reply is recorded in `outbound_emails` under an idempotency key before
+anything is sent, so enqueueing the same reply twice is a no-op; only an item
+that failed permanently is queued again under its key. One worker
+thread per process claims due items, spaces sends to SEND_RATE_PER_MINUTE and
+retries transient Gmail errors with exponential backoff. Every message carries
+a Message-ID derived from its key; before a retry Gmail is searched for that
+Message-ID, so an attempt that reached Gmail but was never recorded (timeout,
+crash) is not sent again. Sent replies are written to `responses` through a
+BulkWriteBuffer.
+"""
+import base64
+import datetime
+import hashlib
+import random
+import threading
+import time
+import uuid
+from email.mime.text import MIMEText
+from typing import Any, Dict, List, Optional
+
+from pymongo import InsertOne, ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from services.gmail_client import get_gmail_client
+from services.mongo import get_collection, get_responses_collection
+from services.write_buffer import BulkWriteBuffer, register_buffer
+from services.stats_service import record_response_sent
+from services.logger import get_logger
+from services.metrics import EMAILS_SENT, RATE_LIMIT_WAIT_SECONDS
+from config.settings import (
+    SEND_RATE_PER_MINUTE, SEND_MAX_ATTEMPTS, SEND_BACKOFF_BASE_SECONDS, SEND_BACKOFF_MAX_SECONDS, SEND_LOCK_SECONDS
+)
+
+logger = get_logger(__name__)
+
+OUTBOUND_COLLECTION = "outbound_emails"
+MESSAGE_ID_DOMAIN = "smart-email-assistant"
+
+STATUS_QUEUED = "queued"
+STATUS_SENDING = "sending"
+STATUS_SENT = "sent"
+STATUS_FAILED = "failed"
+
+# HTTP statuses from Gmail worth retrying; errors without a status are network failures
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+# How long an idle worker sleeps before looking for due retries
+IDLE_POLL_SECONDS = 1.0
+
+
+def _now() -> datetime.datetime:
+    return datetime.datetime.utcnow()
+
+
+def idempotency_key(email_id: str, body: str) -> str:
+    """Default key: the same reply text to the same email is the same send"""
+    return hashlib.sha256(f"{email_id}\n{body}".encode("utf-8")).hexdigest()[:32]
+
+
+def request_key(email_id: str, client_key: Optional[str] = None) -> str:
+    """
+    Key for a reply drafted by the LLM: the client's Idempotency-Key scoped to
+    the email, or a fresh key so every request without one is its own reply.
+    """
+    if not client_key:
+        return uuid.uuid4().hex
+    return hashlib.sha256(f"request\n{email_id}\n{client_key}".encode("utf-8")).hexdigest()[:32]
+
+
+def message_id_for(key: str) -> str:
+    return f"<{key}@{MESSAGE_ID_DOMAIN}>"
+
+
+def build_raw_message(to: str, subject: str, body: str, message_id: str) -> str:
+    message = MIMEText(body)
+    message["to"] = to
+    message["subject"] = subject
+    message["Message-ID"] = message_id
+    return base64.urlsafe_b64encode(message.as_bytes()).decode()
+
+
+def _count_sent(succeeded: List[Any], failures: List[Dict[str, Any]], counts: Dict[str, int]):
+    if succeeded:
+        record_response_sent(len(succeeded))
+
+
+# Sent replies are appended to `responses` in bulk
+responses_buffer = register_buffer(
+    BulkWriteBuffer("responses", get_responses_collection, on_flush=_count_sent)
+)
+
+
+class SendQueue:
+    def __init__(
+        self,
+        rate_per_minute: int = SEND_RATE_PER_MINUTE,
+        max_attempts: int = SEND_MAX_ATTEMPTS,
+        backoff_base: float = SEND_BACKOFF_BASE_SECONDS,
+        backoff_max: float = SEND_BACKOFF_MAX_SECONDS,
+        service=None,
+    ):
+        self.interval = 60.0 / rate_per_minute if rate_per_minute > 0 else 0.0
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        # An injected Gmail service (e.g. pointed at a stub server) skips OAuth
+        self._service = service
+        self._next_slot = 0.0
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = False
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def collection(self):
+        return get_collection(OUTBOUND_COLLECTION)
+
+    def _gmail(self):
+        return self._service if self._service is not None else get_gmail_client().service()
+
+    def start(self):
+        """Start the worker; also picks up items left queued by a previous process."""
+        with self._lock:
+            if self._thread is None:
+                self._stopped = False
+                self._thread = threading.Thread(target=self._run, name="send-queue", daemon=True)
+                self._thread.start()
+
+    def stop(self, timeout: float = 10.0):
+        self._stopped = True
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def enqueue(self, email_id: str, to: str, subject: str, body: str, sender: str = None, thread_id: str = None,
+                edited_by_human: bool = False, key: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Queue a reply for sending. Returns the outbound document; `deduplicated`
+        is True when an item with the same idempotency key already existed.
+        An existing item that failed is queued again with this reply instead.
+        """
+        key = key or idempotency_key(email_id, body)
+        now = _now()
+        item = {
+            "_id": key,
+            "message_id": message_id_for(key),
+            "email_id": email_id,
+            "thread_id": thread_id,
+            "to": to,
+            "from": sender,
+            "subject": subject,
+            "body": body,
+            "edited_by_human": edited_by_human,
+            "status": STATUS_QUEUED,
+            "attempts": 0,
+            "next_attempt_at": now,
+            "created_at": now,
+            "updated_at": now,
+        }
+        try:
+            self.collection.insert_one(item)
+            item["deduplicated"] = False
+        except DuplicateKeyError:
+            requeued = self.collection.find_one_and_update(
+                {"_id": key, "status": STATUS_FAILED},
+                {"$set": {**{field: item[field] for field in ("to", "from", "subject", "body", "edited_by_human")},
+                          "status": STATUS_QUEUED, "attempts": 0, "next_attempt_at": now,
+                          "requeued_at": now, "updated_at": now},
+                 "$unset": {"last_error": ""}},
+                return_document=ReturnDocument.AFTER,
+            )
+            if requeued is not None:
+                logger.info(f"Outbound {key} had failed; queued again")
+                item = requeued
+                item["deduplicated"] = False
+            else:
+                item = self.collection.find_one({"_id": key})
+                item["deduplicated"] = True
+        self.start()
+        self._wakeup.set()
+        return item
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        return self.collection.find_one({"_id": key})
+
+    def wait(self, key: str, timeout: float) -> Optional[Dict[str, Any]]:
+        """Poll until the item is sent or failed, or `timeout` seconds pass; returns its latest state."""
+        deadline = time.monotonic() + timeout
+        while True:
+            item = self.collection.find_one({"_id": key})
+            if item is None or item["status"] in (STATUS_SENT, STATUS_FAILED) or time.monotonic() >= deadline:
+                return item
+            time.sleep(0.2)
+
+    def _claim(self) -> Optional[Dict[str, Any]]:
+        """Atomically take the next due item, or one whose sender died mid-send."""
+        now = _now()
+        return self.collection.find_one_and_update(
+            {"$or": [
+                {"status": STATUS_QUEUED, "next_attempt_at": {"$lte": now}},
+                {"status": STATUS_SENDING, "locked_at": {"$lt": now - datetime.timedelta(seconds=SEND_LOCK_SECONDS)}},
+            ]},
+            {"$set": {"status": STATUS_SENDING, "locked_at": now, "updated_at": now}, "$inc": {"attempts": 1}},
+            sort=[("next_attempt_at", 1)],
+            return_document=ReturnDocument.AFTER,
+        )
+
+    def _wait_for_slot(self):
+        if not self.interval:
+            return
+        now = time.monotonic()
+        wait = self._next_slot - now
+        self._next_slot = max(now, self._next_slot) + self.interval
+        RATE_LIMIT_WAIT_SECONDS.labels("send_queue").observe(max(0.0, wait))
+        if wait > 0:
+            time.sleep(wait)
+
+    def _already_sent(self, service, item: Dict[str, Any]) -> Optional[str]:
+        """Gmail id of a message already sent with this item's Message-ID, if any"""
+        found = service.users().messages().list(
+            userId="me", q=f"rfc822msgid:{item['message_id'].strip('<>')}", maxResults=1
+        ).execute()
+        messages = found.get("messages", [])
+        return messages[0]["id"] if messages else None
+
+    def _deliver(self, item: Dict[str, Any]) -> Dict[str, Any]:
+        service = self._gmail()
+        # A requeued item may have reached Gmail on an earlier round of attempts
+        if item["attempts"] > 1 or item.get("requeued_at"):
+            existing_id = self._already_sent(service, item)
+            if existing_id:
+                logger.info(f"Outbound {item['_id']} was already sent as {existing_id}; not resending")
+                return {"id": existing_id, "recovered": True}
+        raw = build_raw_message(item["to"], item["subject"], item["body"], item["message_id"])
+        return service.users().messages().send(userId="me", body={"raw": raw}).execute()
+
+    def _retry_delay(self, attempts: int) -> float:
+        # Full jitter keeps retries from many items from lining up
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** (attempts - 1)))
+
+    def _process(self, item: Dict[str, Any]):
+        self._wait_for_slot()
+        try:
+            result = self._deliver(item)
+        except Exception as e:
+            status = getattr(getattr(e, "resp", None), "status", None)
+            transient = status is None or int(status) in RETRYABLE_STATUSES
+            if transient and item["attempts"] < self.max_attempts:
+                delay = self._retry_delay(item["attempts"])
+                logger.warning(f"Send of {item['_id']} failed (attempt {item['attempts']}), retrying in {delay:.1f}s: {e}")
+                update = {"status": STATUS_QUEUED, "next_attempt_at": _now() + datetime.timedelta(seconds=delay)}
+            else:
+                logger.error(f"Send of {item['_id']} failed permanently after {item['attempts']} attempts: {e}")
+                update = {"status": STATUS_FAILED}
+            self.collection.update_one(
+                {"_id": item["_id"], "status": STATUS_SENDING},
+                {"$set": {**update, "last_error": str(e), "updated_at": _now()}, "$unset": {"locked_at": ""}}
+            )
+            return
+
+        sent_at = _now()
+        marked = self.collection.update_one(
+            {"_id": item["_id"], "status": STATUS_SENDING},
+            {"$set": {"status": STATUS_SENT, "gmail_id": result.get("id"), "gmail_response": result,
+                      "sent_at": sent_at, "updated_at": sent_at}, "$unset": {"locked_at": ""}}
+        )
+        # Only the worker that moved the item to sent records the response
+        if marked.modified_count:
+            EMAILS_SENT.inc()
+            responses_buffer.add(InsertOne({
+                "email_id": item["email_id"],
+                "thread_id": item.get("thread_id"),
+                "to": item["to"],
+                "from": item.get("from"),
+                "subject": item["subject"],
+                "body": item["body"],
+                "status": STATUS_SENT,
+                "edited_by_human": item.get("edited_by_human", False),
+                "idempotency_key": item["_id"],
+                "created_at": item["created_at"],
+                "sent_at": sent_at,
+                "gmail_response": result,
+            }), key=item["_id"])
+
+    def _run(self):
+        while not self._stopped:
+            try:
+                item = self._claim()
+            except Exception:
+                logger.error("send-queue: claim failed", exc_info=True)
+                item = None
+            if item is None:
+                self._wakeup.wait(IDLE_POLL_SECONDS)
+                self._wakeup.clear()
+                continue
+            try:
+                self._process(item)
+            except Exception:
+                # Left in "sending"; reclaimed once its lock expires
+                logger.error(f"send-queue: processing {item['_id']} failed", exc_info=True)
+
+
+def get_outbound(key: str) -> Optional[Dict[str, Any]]:
+    return get_collection(OUTBOUND_COLLECTION).find_one({"_id": key})
+
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def get_send_queue() -> SendQueue:
+    global _queue
+    with _queue_lock:
+        if _queue is None:
+            _queue = SendQueue()
+    return _queue
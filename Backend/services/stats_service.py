@@ -0,0 +1,125 @@
+"""
+Maintained email counters so API handlers never count whole collections.
+
+Counters live in a single document and are $inc-ed as emails are upserted,
+classified, deleted and responded to. `reconcile_stats()` recomputes them
+from the collections and corrects any drift:
+    python -m services.stats_service reconcile
+"""
+import datetime
+from collections import Counter
+from typing import Dict, Any, Iterable
+
+from services.mongo import get_collection, get_emails_collection, get_responses_collection
+from services.logger import get_logger
+
+logger = get_logger(__name__)
+
+STATS_COLLECTION = "stats"
+EMAIL_STATS_ID = "emails"
+
+
+def _inc(increments: Dict[str, int]):
+    increments = {k: v for k, v in increments.items() if v}
+    if not increments:
+        return
+    get_collection(STATS_COLLECTION).update_one(
+        {"_id": EMAIL_STATS_ID},
+        {"$inc": increments, "$set": {"updated_at": datetime.datetime.utcnow()}},
+        upsert=True
+    )
+
+
+def record_emails_inserted(pending: int, categories: Iterable[str] = ()):
+    """New documents: `pending` unclassified ones plus any that arrived already classified."""
+    categories = list(categories)
+    increments = {"total": pending + len(categories), "unclassified": pending}
+    for category, count in Counter(categories).items():
+        increments[f"categories.{category}"] = count
+    _inc(increments)
+
+
+def record_emails_classified(categories: Iterable[str]):
+    """Pending emails that just received a category."""
+    counts = Counter(categories)
+    increments = {f"categories.{category}": count for category, count in counts.items()}
+    increments["unclassified"] = -sum(counts.values())
+    _inc(increments)
+
+
+def record_emails_deleted(pending: int, categories: Iterable[str] = ()):
+    categories = list(categories)
+    increments = {"total": -(pending + len(categories)), "unclassified": -pending}
+    for category, count in Counter(categories).items():
+        increments[f"categories.{category}"] = -count
+    _inc(increments)
+
+
+def record_response_sent(count: int = 1):
+    _inc({"responded": count})
+
+
+def compute_stats() -> Dict[str, Any]:
+    """Exact counts straight from the collections (used by the consistency check)."""
+    emails_collection = get_emails_collection()
+    categories = {
+        row["_id"]: row["count"]
+        for row in emails_collection.aggregate([
+            {"$match": {"classification_state": "classified"}},
+            {"$group": {"_id": "$classifications.category", "count": {"$sum": 1}}},
+        ])
+        if row["_id"]
+    }
+    return {
+        "total": emails_collection.count_documents({}),
+        "unclassified": emails_collection.count_documents({"classification_state": "pending"}),
+        "categories": categories,
+        "responded": get_responses_collection().estimated_document_count(),
+    }
+
+
+def reconcile_stats() -> Dict[str, Any]:
+    """Overwrite the counters with exact values; returns the drift that was corrected."""
+    current = get_collection(STATS_COLLECTION).find_one({"_id": EMAIL_STATS_ID}) or {}
+    exact = compute_stats()
+
+    drift = {key: exact[key] - current.get(key, 0) for key in ("total", "unclassified", "responded")}
+    old_categories = current.get("categories", {})
+    drift["categories"] = {
+        category: exact["categories"].get(category, 0) - old_categories.get(category, 0)
+        for category in set(exact["categories"]) | set(old_categories)
+        if exact["categories"].get(category, 0) != old_categories.get(category, 0)
+    }
+
+    get_collection(STATS_COLLECTION).replace_one(
+        {"_id": EMAIL_STATS_ID},
+        {**exact, "updated_at": datetime.datetime.utcnow(), "reconciled_at": datetime.datetime.utcnow()},
+        upsert=True
+    )
+    logger.info(f"Reconciled email stats, drift: {drift}")
+    return drift
+
+
+def get_email_stats() -> Dict[str, Any]:
+    """Counters from the stats document; one primary-key read regardless of collection size."""
+    stats = get_collection(STATS_COLLECTION).find_one({"_id": EMAIL_STATS_ID}, {"_id": 0})
+    if stats is None:
+        # First use on an existing database: seed the counters once
+        reconcile_stats()
+        stats = get_collection(STATS_COLLECTION).find_one({"_id": EMAIL_STATS_ID}, {"_id": 0})
+    return {
+        "total": stats.get("total", 0),
+        "unclassified": stats.get("unclassified", 0),
+        "categories": {k: v for k, v in stats.get("categories", {}).items() if v},
+        "responded": stats.get("responded", 0),
+        "updated_at": stats.get("updated_at"),
+        "reconciled_at": stats.get("reconciled_at"),
+    }
+
+
+# Run Script
+if __name__ == "__main__":
+    import sys
+    if len(sys.argv) > 1 and sys.argv[1] == "reconcile":
+        print(reconcile_stats())
+    print(get_email_stats())
@@ -0,0 +1,198 @@
+import argparse
+import datetime
+import time
+from typing import Dict, Any, List, Iterator, Tuple, Callable, Optional
+
+from services.gmail_service import GmailService, HistoryExpiredError
+from services.db_service import (
+    bulk_upsert_emails, bulk_upsert_docs, iter_sanitized_emails, delete_emails,
+    update_email_labels, get_sync_state, save_sync_state
+)
+from services.logger import get_logger
+from config.settings import GMAIL_FULL_RESYNC_LIMIT, BACKFILL_PAGE_SIZE, BACKFILL_CHUNK_SIZE
+
+logger = get_logger(__name__)
+
+GMAIL_SYNC_KEY = "gmail:me"
+GMAIL_BACKFILL_KEY = "gmail:me:backfill"
+
+
+def _fold_history(records: List[Dict[str, Any]]):
+    """
+    Collapse history records (oldest first) into the net set of changes.
+    Returns (added_ids, deleted_ids, label_changes).
+    """
+    added = {}
+    deleted = set()
+    label_changes: Dict[str, Dict[str, set]] = {}
+
+    for record in records:
+        for item in record.get("messagesAdded", []):
+            msg = item["message"]
+            deleted.discard(msg["id"])
+            if "INBOX" in msg.get("labelIds", []):
+                added[msg["id"]] = True
+
+        for item in record.get("messagesDeleted", []):
+            msg_id = item["message"]["id"]
+            added.pop(msg_id, None)
+            label_changes.pop(msg_id, None)
+            deleted.add(msg_id)
+
+        for key, direction, opposite in (("labelsAdded", "added", "removed"), ("labelsRemoved", "removed", "added")):
+            for item in record.get(key, []):
+                msg_id = item["message"]["id"]
+                if msg_id in deleted:
+                    continue
+                change = label_changes.setdefault(msg_id, {"added": set(), "removed": set()})
+                for label in item.get("labelIds", []):
+                    change[opposite].discard(label)
+                    change[direction].add(label)
+                # A message moved into the inbox has to be fetched like a new one
+                if direction == "added" and "INBOX" in item.get("labelIds", []):
+                    added[msg_id] = True
+
+    # Newly fetched messages already carry their current labels
+    for msg_id in added:
+        label_changes.pop(msg_id, None)
+
+    return list(added), deleted, label_changes
+
+
+def full_resync(gmail: GmailService, limit: int = GMAIL_FULL_RESYNC_LIMIT) -> Dict[str, Any]:
+    """Re-list the newest `limit` inbox messages and restart history tracking from now"""
+    # Read the history id first so changes made while listing are picked up next time
+    history_id = gmail.get_history_id()
+    emails = gmail.fetch_inbox_emails(max_results=limit)
+    upsert_result = bulk_upsert_emails(emails, provider="gmail") if emails else {"upserted_count": 0, "modified_count": 0}
+    save_sync_state(GMAIL_SYNC_KEY, history_id=history_id)
+    logger.info(f"Full resync stored {len(emails)} emails, historyId now {history_id}")
+    return {
+        "mode": "full",
+        "emails": emails,
+        "upsert_result": upsert_result,
+        "deleted": 0,
+        "relabeled": 0,
+        "history_id": history_id,
+    }
+
+
+def sync_mailbox(gmail: GmailService, full_resync_limit: int = GMAIL_FULL_RESYNC_LIMIT) -> Dict[str, Any]:
+    """
+    Apply mailbox changes since the stored historyId.
+    Falls back to a bounded full resync when there is no stored id or it has expired.
+    """
+    state = get_sync_state(GMAIL_SYNC_KEY)
+    start_history_id = state.get("history_id")
+    if not start_history_id:
+        logger.info("No stored historyId, performing full resync")
+        return full_resync(gmail, limit=full_resync_limit)
+
+    try:
+        records, latest_history_id = gmail.list_history(start_history_id)
+    except HistoryExpiredError:
+        logger.warning(f"Stored historyId {start_history_id} expired, performing full resync")
+        return full_resync(gmail, limit=full_resync_limit)
+
+    added_ids, deleted_ids, label_changes = _fold_history(records)
+
+    emails = gmail.fetch_messages_batched(added_ids) if added_ids else []
+    upsert_result = bulk_upsert_emails(emails, provider="gmail") if emails else {"upserted_count": 0, "modified_count": 0}
+    deleted = delete_emails(list(deleted_ids), provider="gmail")
+    relabeled = update_email_labels(label_changes, provider="gmail")
+
+    save_sync_state(GMAIL_SYNC_KEY, history_id=latest_history_id)
+    logger.info(f"Incremental sync: {len(emails)} added, {deleted} deleted, {relabeled} relabeled, historyId now {latest_history_id}")
+    return {
+        "mode": "incremental",
+        "emails": emails,
+        "upsert_result": upsert_result,
+        "deleted": deleted,
+        "relabeled": relabeled,
+        "history_id": latest_history_id,
+    }
+
+
+# Backfill pipeline: pages -> sanitized docs -> fixed-size bulk_write chunks
+def _sanitized_pages(gmail: GmailService, page_size: int, page_token: Optional[str]) -> Iterator[Tuple[List[Dict[str, Any]], Optional[str]]]:
+    for emails, next_page_token in gmail.iter_inbox_pages(page_size=page_size, page_token=page_token):
+        yield list(iter_sanitized_emails(emails, provider="gmail")), next_page_token
+
+def _chunks(docs: List[Dict[str, Any]], size: int) -> Iterator[List[Dict[str, Any]]]:
+    for start in range(0, len(docs), size):
+        yield docs[start:start + size]
+
+def backfill_mailbox(
+    gmail: GmailService,
+    page_size: int = BACKFILL_PAGE_SIZE,
+    chunk_size: int = BACKFILL_CHUNK_SIZE,
+    resume: bool = True,
+    max_messages: Optional[int] = None,
+    progress_callback: Optional[Callable[[Dict[str, Any]], None]] = None,
+) -> Dict[str, Any]:
+    """
+    Stream the whole inbox into MongoDB one page at a time.
+    Memory is bounded by a single page; the next page token is checkpointed after
+    every page so an interrupted run resumes where it stopped.
+    """
+    state = get_sync_state(GMAIL_BACKFILL_KEY) if resume else {}
+    page_token = state.get("page_token")
+    processed = state.get("processed", 0) if page_token else 0
+    if page_token:
+        logger.info(f"Resuming backfill after {processed} messages")
+    else:
+        save_sync_state(GMAIL_BACKFILL_KEY, page_token=None, processed=0, started_at=datetime.datetime.utcnow(), completed_at=None)
+
+    upserted = modified = 0
+    session_processed = 0
+    start = time.perf_counter()
+    progress: Dict[str, Any] = {"processed": processed, "completed": False}
+
+    for docs, next_page_token in _sanitized_pages(gmail, page_size, page_token):
+        for chunk in _chunks(docs, chunk_size):
+            result = bulk_upsert_docs(chunk)
+            upserted += result["upserted_count"]
+            modified += result["modified_count"]
+
+        processed += len(docs)
+        session_processed += len(docs)
+        save_sync_state(GMAIL_BACKFILL_KEY, page_token=next_page_token, processed=processed)
+
+        elapsed = time.perf_counter() - start
+        progress = {
+            "processed": processed,
+            "upserted": upserted,
+            "modified": modified,
+            "elapsed_seconds": round(elapsed, 2),
+            "messages_per_sec": round(session_processed / elapsed, 1) if elapsed else 0.0,
+        }
+        logger.info(f"Backfill progress: {progress['processed']} messages, {progress['messages_per_sec']} msg/s")
+        if progress_callback:
+            progress_callback(progress)
+
+        if not next_page_token:
+            save_sync_state(GMAIL_BACKFILL_KEY, completed_at=datetime.datetime.utcnow())
+            progress["completed"] = True
+            break
+        if max_messages is not None and session_processed >= max_messages:
+            logger.info("Backfill stopped at max_messages; rerun to resume")
+            progress["completed"] = False
+            break
+
+    return progress
+
+
+# Run Script
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Gmail mailbox sync")
+    parser.add_argument("task", choices=["backfill", "sync"])
+    parser.add_argument("--restart", action="store_true", help="ignore the saved backfill checkpoint")
+    parser.add_argument("--max-messages", type=int, default=None)
+    args = parser.parse_args()
+
+    if args.task == "backfill":
+        print(backfill_mailbox(GmailService(), resume=not args.restart, max_messages=args.max_messages))
+    else:
+        result = sync_mailbox(GmailService())
+        result.pop("emails")
+        print(result)
@@ -0,0 +1,339 @@
+"""
+Rolling per-thread summaries for reply context.
+
+`thread_summaries` holds one document per (provider, thread_id) with a summary
+of every message in the thread except the newest, plus the last few
+intermediate summaries (checkpoints) from earlier folds. Ingestion only marks
+the thread stale. A refresh then folds just the messages not yet in the summary
+into it, a few per LLM call, so the work grows with new messages rather than
+with thread length.
+
+The reply context is built relative to the message being answered: the newest
+checkpoint that ends before it, the messages between that checkpoint and it,
+the message itself in full and the messages that came after it, capped at
+RESPONDER_PROMPT_TOKEN_BUDGET tokens. Building it never calls the LLM; stale or
+missing summaries are left to the background refresh job.
+
+    python -m services.thread_service refresh --limit 100
+"""
+import argparse
+import datetime
+import os
+import threading
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from pymongo import UpdateOne
+from pymongo.errors import DuplicateKeyError
+from langchain_google_genai import ChatGoogleGenerativeAI
+from langchain.prompts import ChatPromptTemplate
+
+from services.mongo import get_collection, get_emails_collection
+from services.body_store import get_bodies
+from services.logger import get_logger
+from services.metrics import LLMMetricsHandler
+from services.job_service import get_job_manager, JobQueueFullError
+from utils.parser import compact_email_text, truncate_to_token_budget, CHARS_PER_TOKEN
+from config.settings import (
+    THREAD_SUMMARY_MAX_TOKENS, THREAD_SUMMARY_MESSAGE_TOKENS, THREAD_FOLD_TOKEN_BUDGET, RESPONDER_PROMPT_TOKEN_BUDGET,
+    THREAD_SUMMARY_CHECKPOINTS
+)
+
+logger = get_logger(__name__)
+
+THREADS_COLLECTION = "thread_summaries"
+THREAD_MESSAGE_PROJECTION = {"provider": 1, "thread_id": 1, "provider_message_id": 1, "from": 1, "subject": 1, "snippet": 1, "date": 1,
+                             "has_list_unsubscribe": 1}
+# Job type of the background refresh (registered by the API, queued by /threads/refresh and /fetch)
+REFRESH_JOB_TYPE = "threads"
+# Unsummarized messages on each side of the answered one considered for the reply context
+CONTEXT_MESSAGES_PER_SIDE = 10
+# Below this many tokens a further message excerpt is not worth including
+MIN_EXCERPT_TOKENS = 24
+
+summary_prompt = ChatPromptTemplate.from_template("""
+You maintain a running summary of an email thread for an assistant that drafts replies.
+
+Current summary (empty if this is the start of the thread):
+{summary}
+
+New messages, oldest first:
+{messages}
+
+Rewrite the summary so it also covers the new messages. Keep who asked for what, commitments,
+decisions, dates, figures and open questions; drop greetings and pleasantries.
+Use at most {max_words} words. Return only the summary text.
+""")
+
+_summary_chain = None
+_summary_chain_lock = threading.Lock()
+
+
+def get_summary_chain():
+    """Summarizer chain, built on first use so ingestion-side imports stay cheap"""
+    global _summary_chain
+    with _summary_chain_lock:
+        if _summary_chain is None:
+            llm = ChatGoogleGenerativeAI(
+                model="gemini-2.5-flash", google_api_key=os.getenv("GEMINI_API_KEY"), temperature=0.2,
+                callbacks=[LLMMetricsHandler("thread_summary")]
+            )
+            _summary_chain = summary_prompt | llm
+    return _summary_chain
+
+
+def thread_key(provider: str, thread_id: str) -> str:
+    return f"{provider}:{thread_id}"
+
+
+def _tokens(text: str) -> int:
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def mark_threads_stale(threads: Iterable[Tuple[str, str]]) -> int:
+    """Flag threads that received messages; bumping the version voids any refresh already in flight"""
+    now = datetime.datetime.utcnow()
+    ops = [
+        UpdateOne(
+            {"_id": thread_key(provider, thread_id)},
+            {"$set": {"provider": provider, "thread_id": thread_id, "stale": True, "marked_at": now}, "$inc": {"version": 1}},
+            upsert=True
+        )
+        for provider, thread_id in set(threads) if thread_id
+    ]
+    if ops:
+        get_collection(THREADS_COLLECTION).bulk_write(ops, ordered=False)
+    return len(ops)
+
+
+def _message_text(message: Dict[str, Any], body: Dict[str, Any]) -> str:
+    text = compact_email_text(body.get("body_plain", ""), body.get("body_html", ""), THREAD_SUMMARY_MESSAGE_TOKENS,
+                              bulk=bool(message.get("has_list_unsubscribe")))
+    return (
+        f"From: {message.get('from', '')} | Date: {message.get('date')} | Subject: {message.get('subject', '')}\n"
+        f"{text or message.get('snippet', '')}"
+    )
+
+
+def schedule_refresh():
+    """Queue the background refresh job; deduplicated while one is already queued or running"""
+    try:
+        get_job_manager().submit(REFRESH_JOB_TYPE, {}, dedup_key=REFRESH_JOB_TYPE)
+    except (JobQueueFullError, ValueError) as e:
+        # ValueError: no handler registered (e.g. CLI use); the next /threads/refresh picks the threads up
+        logger.warning(f"Could not queue a thread summary refresh: {e}")
+
+
+def _fold_groups(texts: List[str]) -> List[List[str]]:
+    """Group message texts so each fold prompt stays within THREAD_FOLD_TOKEN_BUDGET"""
+    groups: List[List[str]] = []
+    current: List[str] = []
+    current_tokens = 0
+    for text in texts:
+        tokens = _tokens(text)
+        if current and current_tokens + tokens > THREAD_FOLD_TOKEN_BUDGET:
+            groups.append(current)
+            current, current_tokens = [], 0
+        current.append(text)
+        current_tokens += tokens
+    if current:
+        groups.append(current)
+    return groups
+
+
+def refresh_thread_summary(provider: str, thread_id: str) -> Dict[str, Any]:
+    """Fold messages not yet in the thread's summary into it; returns the (possibly unchanged) summary document"""
+    collection = get_collection(THREADS_COLLECTION)
+    key = thread_key(provider, thread_id)
+    doc = collection.find_one({"_id": key}) or {}
+    folded = set(doc.get("folded_ids", []))
+
+    messages = list(
+        get_emails_collection()
+        .find({"provider": provider, "thread_id": thread_id}, THREAD_MESSAGE_PROJECTION)
+        .sort([("date", 1), ("_id", 1)])
+    )
+    # The newest message goes into the prompt in full, so it is not summarized yet
+    new = [m for m in messages[:-1] if m["provider_message_id"] not in folded]
+
+    summary = doc.get("summary", "")
+    # One checkpoint per fold call: the summary up to and including message `through`
+    checkpoints = []
+    if new:
+        bodies = get_bodies([(provider, m["provider_message_id"]) for m in new])
+        texts = [_message_text(m, bodies.get((provider, m["provider_message_id"]), {})) for m in new]
+        chain = get_summary_chain()
+        folded_so_far = 0
+        for group in _fold_groups(texts):
+            summary = chain.invoke({
+                "summary": summary or "(none)",
+                "messages": "\n\n---\n\n".join(group),
+                "max_words": int(THREAD_SUMMARY_MAX_TOKENS * 0.75),
+            }).content.strip()
+            summary = truncate_to_token_budget(summary, THREAD_SUMMARY_MAX_TOKENS)
+            folded_so_far += len(group)
+            checkpoints.append({"through": new[folded_so_far - 1]["provider_message_id"], "summary": summary})
+
+    update = {
+        "$set": {
+            "provider": provider,
+            "thread_id": thread_id,
+            "summary": summary,
+            "message_count": len(messages),
+            "summarized_count": len(folded) + len(new),
+            "stale": False,
+            "updated_at": datetime.datetime.utcnow(),
+        },
+        "$addToSet": {"folded_ids": {"$each": [m["provider_message_id"] for m in new]}},
+        "$inc": {"version": 1},
+    }
+    if checkpoints:
+        update["$push"] = {"checkpoints": {"$each": checkpoints, "$slice": -THREAD_SUMMARY_CHECKPOINTS}}
+    # Written only if nobody marked or refreshed the thread since it was read
+    try:
+        if doc:
+            collection.update_one({"_id": key, "version": doc.get("version", 0)}, update)
+        else:
+            collection.update_one({"_id": key, "version": {"$exists": False}}, update, upsert=True)
+    except DuplicateKeyError:
+        pass
+    if new:
+        logger.info(f"Folded {len(new)} messages into the summary of thread {key}")
+    return {**doc, **update["$set"]}
+
+
+def _summary_before(doc: Dict[str, Any], positions: Dict[str, int], target: int) -> Tuple[str, int]:
+    """Newest stored summary covering only messages before position `target`, and the position it ends at (-1: none)"""
+    best = ("", -1)
+    for checkpoint in doc.get("checkpoints", []):
+        end = positions.get(checkpoint["through"], target)
+        if best[1] < end < target:
+            best = (checkpoint["summary"], end)
+    # Summaries written before checkpoints existed cover everything but the newest message
+    if best[1] < 0 and not doc.get("checkpoints") and doc.get("summary") and target == len(positions) - 1:
+        best = (doc["summary"], target - 1)
+    return best
+
+
+def get_thread_contexts(targets: Iterable[Tuple[str, str, str]], refresh: bool = True) -> Dict[Tuple[str, str, str], Dict[str, Any]]:
+    """
+    Thread context for replying to each (provider, thread_id, provider_message_id) target:
+    `summary` of the thread before it, `earlier` messages between that summary and the
+    target and `later` messages after it (compact text, oldest first, nearest
+    CONTEXT_MESSAGES_PER_SIDE each). One query each for summaries, thread messages and
+    bodies. With `refresh`, threads whose summary is stale or missing are queued for the
+    background refresh job; the messages fill the gap meanwhile.
+    """
+    targets = [t for t in set(targets) if t[1]]
+    if not targets:
+        return {}
+    threads = {(provider, thread_id) for provider, thread_id, _ in targets}
+    docs = {
+        d["_id"]: d
+        for d in get_collection(THREADS_COLLECTION).find({"_id": {"$in": [thread_key(*t) for t in threads]}}, {"folded_ids": 0})
+    }
+    if refresh:
+        missing = [t for t in threads if thread_key(*t) not in docs]
+        if missing:
+            mark_threads_stale(missing)
+        if missing or any(doc.get("stale") for doc in docs.values()):
+            schedule_refresh()
+
+    messages: Dict[Tuple[str, str], List[Dict[str, Any]]] = {}
+    cursor = get_emails_collection().find(
+        {"$or": [{"provider": provider, "thread_id": thread_id} for provider, thread_id in threads]},
+        THREAD_MESSAGE_PROJECTION
+    ).sort([("date", 1), ("_id", 1)])
+    for message in cursor:
+        messages.setdefault((message.get("provider", "gmail"), message["thread_id"]), []).append(message)
+
+    plans = {}
+    for provider, thread_id, message_id in targets:
+        thread = messages.get((provider, thread_id), [])
+        positions = {m["provider_message_id"]: i for i, m in enumerate(thread)}
+        target = positions.get(message_id)
+        if target is None:
+            continue
+        summary, end = _summary_before(docs.get(thread_key(provider, thread_id), {}), positions, target)
+        earlier = thread[max(end + 1, target - CONTEXT_MESSAGES_PER_SIDE):target]
+        later = thread[target + 1:target + 1 + CONTEXT_MESSAGES_PER_SIDE]
+        plans[(provider, thread_id, message_id)] = (summary, earlier, later)
+
+    bodies = get_bodies(list({
+        (provider, m["provider_message_id"])
+        for (provider, _, _), (_, earlier, later) in plans.items() for m in earlier + later
+    }))
+
+    def texts(provider: str, thread_messages: List[Dict[str, Any]]) -> List[str]:
+        return [_message_text(m, bodies.get((provider, m["provider_message_id"]), {})) for m in thread_messages]
+
+    return {
+        key: {"summary": summary, "earlier": texts(key[0], earlier), "later": texts(key[0], later)}
+        for key, (summary, earlier, later) in plans.items()
+    }
+
+
+def _fit(texts: List[str], budget: int) -> Tuple[List[str], int]:
+    """Take texts in order, truncating the last one that fits partly; returns them and the budget left"""
+    taken = []
+    for text in texts:
+        if budget < MIN_EXCERPT_TOKENS:
+            break
+        text = truncate_to_token_budget(text, budget)
+        taken.append(text)
+        budget -= _tokens(text)
+    return taken, budget
+
+
+def build_prompt_context(summary: str, plain: str, html_body: str = "", snippet: str = "",
+                         earlier: List[str] = (), later: List[str] = (), bulk: bool = False) -> Dict[str, str]:
+    """
+    Reply prompt context within RESPONDER_PROMPT_TOKEN_BUDGET. The thread part (summary up to
+    THREAD_SUMMARY_MAX_TOKENS, then the unsummarized earlier messages and the later ones,
+    nearest the answered message first) gets at most half; the message itself gets the rest.
+    `bulk`: the message has List-Unsubscribe, so a one-line footer is stripped too.
+    """
+    thread_budget = RESPONDER_PROMPT_TOKEN_BUDGET // 2
+    summary = truncate_to_token_budget(summary or "", min(THREAD_SUMMARY_MAX_TOKENS, thread_budget))
+    remaining = thread_budget - (_tokens(summary) if summary else 0)
+    earlier_part, remaining = _fit(list(reversed(earlier)), remaining)
+    later_part, remaining = _fit(list(later), remaining)
+
+    body_budget = RESPONDER_PROMPT_TOKEN_BUDGET - thread_budget + remaining
+    body = compact_email_text(plain, html_body, body_budget, bulk) or truncate_to_token_budget(snippet or "", body_budget)
+    thread = [summary] if summary else []
+    thread += list(reversed(earlier_part))
+    return {
+        "thread_summary": "\n\n---\n\n".join(thread) or "(no earlier messages)",
+        "email_body": body,
+        "later_messages": "\n\n---\n\n".join(later_part) or "(none)",
+    }
+
+
+def refresh_stale_threads(limit: int = 100, progress_callback: Optional[Callable[[Dict[str, Any]], None]] = None) -> Dict[str, Any]:
+    """Refresh up to `limit` stale threads, oldest mark first"""
+    stale = list(
+        get_collection(THREADS_COLLECTION)
+        .find({"stale": True}, {"provider": 1, "thread_id": 1})
+        .sort("marked_at", 1)
+        .limit(limit)
+    )
+    counts = {"total": len(stale), "processed": 0, "failed": 0}
+    for doc in stale:
+        try:
+            refresh_thread_summary(doc["provider"], doc["thread_id"])
+        except Exception as e:
+            counts["failed"] += 1
+            logger.warning(f"Could not refresh summary of thread {doc['_id']}: {e}")
+        counts["processed"] += 1
+        if progress_callback:
+            progress_callback(dict(counts))
+    return counts
+
+
+# Run Script
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Thread summaries")
+    parser.add_argument("task", choices=["refresh"])
+    parser.add_argument("--limit", type=int, default=100)
+    args = parser.parse_args()
+    print(refresh_stale_threads(limit=args.limit))
@@ -0,0 +1,145 @@
+import atexit
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+from pymongo.collection import Collection
+from pymongo.errors import BulkWriteError
+from services.logger import get_logger
+from services.metrics import MONGO_OPERATION_SECONDS
+from config.settings import WRITE_BUFFER_MAX_OPS, WRITE_BUFFER_MAX_DELAY_SECONDS
+
+logger = get_logger(__name__)
+
+
+class BulkWriteBuffer:
+    """
+    Write-behind buffer for pymongo write operations.
+
+    `add()` only appends to memory. A background thread flushes the queued
+    operations with one unordered bulk_write once `max_ops` are waiting or the
+    oldest has waited `max_delay` seconds. Each operation carries a `key`
+    (e.g. the message id) so per-item failures can be reported back;
+    `on_flush(succeeded_keys, failures, counts)` also gets the server's
+    matched/modified/inserted/upserted totals for the flush.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        collection_getter: Callable[[], Collection],
+        max_ops: int = WRITE_BUFFER_MAX_OPS,
+        max_delay: float = WRITE_BUFFER_MAX_DELAY_SECONDS,
+        on_flush: Optional[Callable[[List[Any], List[Dict[str, Any]], Dict[str, int]], None]] = None,
+    ):
+        self.name = name
+        self.collection_getter = collection_getter
+        self.max_ops = max_ops
+        self.max_delay = max_delay
+        self.on_flush = on_flush
+        self._ops: List[Any] = []
+        self._keys: List[Any] = []
+        self._oldest: Optional[float] = None
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = False
+        self._thread: Optional[threading.Thread] = None
+        self.stats = {"flushes": 0, "written": 0, "failed": 0}
+
+    def _ensure_thread(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name=f"{self.name}-flusher", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while not self._stopped:
+            self._wakeup.wait(self.max_delay)
+            self._wakeup.clear()
+            with self._lock:
+                due = self._ops and (len(self._ops) >= self.max_ops or time.monotonic() - self._oldest >= self.max_delay)
+            if due:
+                try:
+                    self.flush()
+                except Exception:
+                    logger.error(f"{self.name}: background flush failed", exc_info=True)
+
+    def add(self, op: Any, key: Any = None):
+        """Queue a write; never blocks on Mongo."""
+        with self._lock:
+            if not self._ops:
+                self._oldest = time.monotonic()
+            self._ops.append(op)
+            self._keys.append(key)
+            full = len(self._ops) >= self.max_ops
+            self._ensure_thread()
+        if full:
+            self._wakeup.set()
+
+    def flush(self) -> Dict[str, Any]:
+        """Write everything queued so far. Returns counts and per-item failures."""
+        with self._flush_lock:
+            with self._lock:
+                ops, keys = self._ops, self._keys
+                self._ops, self._keys, self._oldest = [], [], None
+            if not ops:
+                return {"written": 0, "failures": []}
+
+            failed_indexes = set()
+            failures: List[Dict[str, Any]] = []
+            counts = {"matched": 0, "modified": 0, "inserted": 0, "upserted": 0}
+            started = time.perf_counter()
+            try:
+                result = self.collection_getter().bulk_write(ops, ordered=False)
+                counts = {"matched": result.matched_count, "modified": result.modified_count,
+                          "inserted": result.inserted_count, "upserted": result.upserted_count}
+            except BulkWriteError as e:
+                # Unordered: every op without a writeError was applied
+                counts = {"matched": e.details.get("nMatched", 0), "modified": e.details.get("nModified", 0),
+                          "inserted": e.details.get("nInserted", 0), "upserted": e.details.get("nUpserted", 0)}
+                for error in e.details.get("writeErrors", []):
+                    failed_indexes.add(error["index"])
+                    failures.append({"key": keys[error["index"]], "code": error.get("code"), "error": error.get("errmsg")})
+            except Exception as e:
+                failed_indexes = set(range(len(keys)))
+                failures = [{"key": key, "code": None, "error": str(e)} for key in keys]
+
+            MONGO_OPERATION_SECONDS.labels(f"write_buffer.{self.name}").observe(time.perf_counter() - started)
+            succeeded = [key for i, key in enumerate(keys) if i not in failed_indexes]
+
+            self.stats["flushes"] += 1
+            self.stats["written"] += len(succeeded)
+            self.stats["failed"] += len(failures)
+            for failure in failures:
+                logger.error(f"{self.name}: write failed for {failure['key']}: {failure['error']}")
+            logger.info(f"{self.name}: flushed {len(ops)} writes in one bulk_write ({len(failures)} failed)")
+
+            if self.on_flush:
+                self.on_flush(succeeded, failures, counts)
+            return {"written": len(succeeded), "failures": failures}
+
+    def close(self):
+        """Stop the background thread and flush what is left."""
+        self._stopped = True
+        self._wakeup.set()
+        return self.flush()
+
+
+_buffers: List[BulkWriteBuffer] = []
+
+
+def register_buffer(buffer: BulkWriteBuffer) -> BulkWriteBuffer:
+    _buffers.append(buffer)
+    return buffer
+
+
+def close_all_buffers():
+    """Flush every registered buffer; called on app shutdown and interpreter exit."""
+    for buffer in _buffers:
+        try:
+            buffer.close()
+        except Exception:
+            logger.error(f"{buffer.name}: final flush failed", exc_info=True)
+
+
+atexit.register(close_all_buffers)
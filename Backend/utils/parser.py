@@ -1,49 +1,261 @@
 import base64
+import email
+import html
+import re
+from email.header import decode_header, make_header
+from email.message import Message
 from email.utils import parsedate_to_datetime
-from typing import Tuple
+from typing import Dict, List, Optional, Tuple, Union
+
+# Prompt budgeting uses the same ~4 characters per token estimate as the classifier
+CHARS_PER_TOKEN = 4
+
+# Charset labels seen in real mail that Python does not know, or that mail clients decode as a superset
+_CHARSET_ALIASES = {
+    "iso-8859-1": "cp1252",
+    "latin1": "cp1252",
+    "latin-1": "cp1252",
+    "us-ascii": "utf-8",
+    "ascii": "utf-8",
+    "gb2312": "gb18030",
+    "gbk": "gb18030",
+    "ks_c_5601-1987": "cp949",
+    "x-sjis": "shift_jis",
+    "unicode-1-1-utf-7": "utf-7",
+    "utf8": "utf-8",
+}
 
 def b64url_decode(data_b64url: str) -> bytes:
     # Gmail uses url-safe base64 without padding sometimes
-    import base64
     data = data_b64url.encode("ascii")
     rem = len(data) % 4
     if rem:
         data += b"=" * (4 - rem)
     return base64.urlsafe_b64decode(data)
 
+def decode_text(data: bytes, charset: Optional[str] = None) -> str:
+    """Decode with the declared charset, falling back to UTF-8 and then Windows-1252"""
+    charset = (charset or "utf-8").strip().strip('"').lower()
+    charset = _CHARSET_ALIASES.get(charset, charset)
+    for candidate in (charset, "utf-8"):
+        try:
+            return data.decode(candidate)
+        except (LookupError, UnicodeDecodeError):
+            continue
+    return data.decode("cp1252", errors="replace")
+
+_CHARSET_PARAM = re.compile(r'charset\s*=\s*"?([^";\s]+)', re.I)
+
+def _part_charset(part: dict) -> Optional[str]:
+    for header in part.get("headers", []) or []:
+        if header.get("name", "").lower() == "content-type":
+            match = _CHARSET_PARAM.search(header.get("value", ""))
+            return match.group(1) if match else None
+    return None
+
 def extract_plain_html_from_gmail_payload(payload: dict) -> Tuple[str, str]:
     """
-    Walks payload parts to find 'text/plain' and 'text/html' bodies.
+    Walks a format=full payload to find 'text/plain' and 'text/html' bodies,
+    decoding each part with its declared charset. Attachments are skipped.
     Returns (plain_text, html_text)
     """
-    plain = ""
-    html = ""
-    def walk(part):
-        nonlocal plain, html
-        if not part:
-            return
-        mime = part.get("mimeType", "")
-        body = part.get("body", {})
-        data = body.get("data")
-        if data:
-            try:
-                text = b64url_decode(data).decode("utf-8", errors="replace")
-            except Exception:
-                text = ""
+    plain, html_parts = [], []
+    stack = [payload] if payload else []
+    while stack:
+        part = stack.pop()
+        data = part.get("body", {}).get("data")
+        if data and not part.get("filename"):
+            mime = part.get("mimeType", "").lower()
+            text = decode_text(b64url_decode(data), _part_charset(part))
             if mime == "text/plain":
-                plain += text
+                plain.append(text)
             elif mime == "text/html":
-                html += text
-            else:
+                html_parts.append(text)
+            elif not plain and mime.startswith("text/"):
                 # sometimes top-level body with mimeType "text/plain"
-                if not plain and mime.startswith("text/"):
-                    plain += text
-        # parts
-        for p in part.get("parts", []) or []:
-            walk(p)
-    walk(payload)
-    return plain.strip(), html.strip()
+                plain.append(text)
+        # depth first, in document order
+        stack.extend(reversed(part.get("parts", []) or []))
+    return "".join(plain).strip(), "".join(html_parts).strip()
+
+def _decode_header_value(value: str) -> str:
+    try:
+        return str(make_header(decode_header(value)))
+    except Exception:
+        return value
+
+def parse_raw_message(raw: Union[str, bytes, Message]) -> Tuple[Dict[str, str], str, str]:
+    """
+    Parse a format=raw message (base64url string), RFC 822 bytes or a parsed Message.
+    Returns (headers, plain_text, html_text) with RFC 2047 headers decoded.
+    """
+    if isinstance(raw, Message):
+        message = raw
+    else:
+        message = email.message_from_bytes(b64url_decode(raw) if isinstance(raw, str) else raw)
+
+    headers = {}
+    for name, value in message.items():
+        headers.setdefault(name, _decode_header_value(value))
+
+    plain, html_parts = [], []
+    for part in message.walk():
+        if part.is_multipart() or part.get_filename() or part.get_content_disposition() == "attachment":
+            continue
+        mime = part.get_content_type()
+        if not mime.startswith("text/"):
+            continue
+        text = decode_text(part.get_payload(decode=True) or b"", part.get_content_charset())
+        if mime == "text/plain":
+            plain.append(text)
+        elif mime == "text/html":
+            html_parts.append(text)
+        elif not plain:
+            plain.append(text)
+    return headers, "".join(plain).strip(), "".join(html_parts).strip()
+
+# HTML -> text. Regexes rather than an HTML parser: this runs on every fetched message.
+_HTML_DROP = re.compile(r"<(script|style|head|title|noscript|template)\b.*?</\1\s*>|<!--.*?-->", re.I | re.S)
+# Where clients start the quoted original in an HTML reply; everything after it is the old thread
+_HTML_QUOTE_START = re.compile(
+    r'<(?:div|blockquote)\b[^>]*(?:class="[^"]*\b(?:gmail_quote|moz-cite-prefix|yahoo_quoted)\b'
+    r'|id="(?:divRplyFwdMsg|appendonsend)"|type="cite")', re.I)
+_HTML_LIST_ITEM = re.compile(r"<li\b[^>]*>", re.I)
+_HTML_BREAK = re.compile(r"<(?:br|hr|/p|/div|/tr|/h[1-6]|/li|/ul|/ol|/table|/blockquote)\b[^>]*>", re.I)
+_HTML_CELL = re.compile(r"</t[dh]\s*>", re.I)
+_HTML_TAG = re.compile(r"<[^>]*>")
+
+# Zero-width and other invisible characters used as preheader padding in marketing mail
+_INVISIBLE = re.compile(r"[\u00ad\u034f\u200b-\u200f\u2060\ufeff]")
+_SPACES = re.compile(r"[ \t\f\v\u00a0\u2007\u202f]+")
+_BLANK_LINES = re.compile(r"\n{3,}")
+
+def normalize_whitespace(text: str) -> str:
+    text = _INVISIBLE.sub("", text.replace("\r\n", "\n").replace("\r", "\n"))
+    text = "\n".join(_SPACES.sub(" ", line).strip() for line in text.split("\n"))
+    return _BLANK_LINES.sub("\n\n", text).strip()
+
+def html_to_text(markup: str, strip_quotes: bool = False) -> str:
+    """Fast, lossy HTML to text: drops non-content elements and tags, keeps block breaks"""
+    if strip_quotes:
+        match = _HTML_QUOTE_START.search(markup)
+        if match and markup[:match.start()].strip():
+            markup = markup[:match.start()]
+    markup = _HTML_DROP.sub(" ", markup)
+    markup = _HTML_LIST_ITEM.sub("\n- ", markup)
+    markup = _HTML_BREAK.sub("\n", markup)
+    markup = _HTML_CELL.sub(" ", markup)
+    return normalize_whitespace(html.unescape(_HTML_TAG.sub("", markup)))
+
+# Plain-text quoted replies: "On <date>, <name> wrote:" (often wrapped onto two lines) and Outlook headers
+_REPLY_HEADER = re.compile(r"^(?:on\b.{0,300}\bwrote:|-{2,} ?original message ?-{2,}|_{20,})$", re.I | re.S)
+_OUTLOOK_FROM = re.compile(r"^\*?from:\*? ", re.I)
+_OUTLOOK_SENT = re.compile(r"^\*?(?:sent|date):\*? ", re.I)
+
+def strip_quoted_replies(text: str) -> str:
+    """Drop '>' quoted lines and everything from the reply header of the quoted original onwards"""
+    lines = text.split("\n")
+    kept = []
+    for i, line in enumerate(lines):
+        if line.startswith(">"):
+            continue
+        joined = f"{line} {lines[i + 1]}" if i + 1 < len(lines) else line
+        if _REPLY_HEADER.match(line) or (line.lower().startswith("on ") and _REPLY_HEADER.match(joined)):
+            break
+        if _OUTLOOK_FROM.match(line) and any(_OUTLOOK_SENT.match(l) for l in lines[i + 1:i + 4]):
+            break
+        kept.append(line)
+    stripped = "\n".join(kept).strip()
+    # A message that is nothing but a quote keeps it
+    return stripped or text
+
+_SIGNATURE_START = re.compile(
+    r"^(?:--|__|sent from my \w+.*|sent from (?:outlook|mail) for \w+.*|get outlook for \w+.*)$", re.I)
+
+def strip_signature(text: str) -> str:
+    """Cut at the '-- ' delimiter or a mobile client signature line"""
+    lines = text.split("\n")
+    for i, line in enumerate(lines):
+        if i and _SIGNATURE_START.match(line):
+            return "\n".join(lines[:i]).strip()
+    return text
+
+_BOILERPLATE_LINE = re.compile(
+    r"unsubscribe|view (?:this|it|the) (?:email|message|newsletter)? ?(?:in|on) (?:your|a|the) (?:web )?browser|view (?:it )?online"
+    r"|(?:manage|update) (?:your )?(?:email |subscription |notification )?(?:preferences|settings)|privacy (?:policy|notice)"
+    r"|you (?:are )?receiv(?:ed|ing) this|this (?:e-?mail|message) was sent to|all rights reserved|^(?:©|\(c\)) ?\d{4}"
+    r"|to stop receiving|add us to your address book",
+    re.I)
+_DIVIDER_LINE = re.compile(r"^\s*([-_=*~#])\1{2,}\s*$")
+_LONG_URL = re.compile(r"<?https?://([^/\s>]+)[^\s>]{40,}>?")
+# Non-boilerplate lines (company name, postal address) allowed between footer lines
+FOOTER_GAP_LINES = 2
+
+def _footer_start(lines: List[str], bulk: bool) -> Optional[int]:
+    """
+    Index where the trailing footer block starts, or None. The block must end the
+    message; outside bulk mail it needs two boilerplate lines or a divider, so a
+    sentence that mentions unsubscribing is never taken for a footer.
+    """
+    start = None
+    markers = dividers = gap = 0
+    for i in range(len(lines) - 1, -1, -1):
+        line = lines[i]
+        if not line.strip():
+            continue
+        if _DIVIDER_LINE.match(line):
+            dividers += 1
+        elif _BOILERPLATE_LINE.search(line):
+            markers += 1
+        elif start is not None and gap < FOOTER_GAP_LINES:
+            gap += 1
+            continue
+        else:
+            break
+        start, gap = i, 0
+    if start is None or not markers or not (bulk or markers >= 2 or dividers):
+        return None
+    return start
+
+def strip_boilerplate(text: str, bulk: bool = False) -> str:
+    """
+    Drop the footer block at the end of the message and shorten tracking links.
+    `bulk` (the message has List-Unsubscribe) lets a single boilerplate line count
+    as a footer. A marker replaces the removed lines, since a marketing footer is
+    itself a classification signal. Lines in the body are never removed.
+    """
+    lines = text.split("\n")
+    start = _footer_start(lines, bulk)
+    # A message that is nothing but footer keeps it
+    if start is not None and "\n".join(lines[:start]).strip():
+        lines = lines[:start] + ["[footer removed]"]
+    return _BLANK_LINES.sub("\n\n", "\n".join(_LONG_URL.sub(r"[link: \1]", line) for line in lines)).strip()
+
+def truncate_to_token_budget(text: str, max_tokens: int) -> str:
+    """Truncate at a word boundary to roughly `max_tokens` tokens"""
+    max_chars = max_tokens * CHARS_PER_TOKEN
+    if max_tokens <= 0 or len(text) <= max_chars:
+        return text
+    cut = text.rfind(" ", 0, max_chars)
+    if cut < max_chars * 0.8:
+        cut = max_chars
+    return text[:cut].rstrip() + " …"
+
+def compact_email_text(plain: str = "", html_body: str = "", max_tokens: int = 0, bulk: bool = False) -> str:
+    """
+    Prompt-ready body text: the plain part (or the HTML rendered to text when there is
+    no usable plain part) without quoted replies, signatures or a trailing footer,
+    truncated to `max_tokens` (0 = no limit). `bulk`: the message has List-Unsubscribe.
+    """
+    if plain and plain.strip():
+        text = normalize_whitespace(plain)
+    elif html_body:
+        text = html_to_text(html_body, strip_quotes=True)
+    else:
+        return ""
+    text = strip_boilerplate(strip_signature(strip_quoted_replies(text)), bulk)
+    return truncate_to_token_budget(text, max_tokens)
 
 def clean_email_text(snippet: str) -> str:
     """Remove unwanted characters from snippet"""
-    return snippet.strip().replace("\n", " ")
\ No newline at end of file
+    return snippet.strip().replace("\n", " ")
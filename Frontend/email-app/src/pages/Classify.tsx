@@ -1,18 +1,19 @@
-import React, { useEffect, useState } from 'react';
-interface RespondResult {
-  status: string;
-  email_id: string;
+import React, { useEffect, useRef, useState } from 'react';
+import '../styles/Classify.css';
+import { runJob } from '../utils/jobs';
+import { streamDraft, sendReply } from '../utils/drafts';
+import type { SendResult } from '../utils/drafts';
+
+interface Compose {
+  emailId: string;
   to: string;
-  from: string;
   subject: string;
-  draft: string;
-  gmail_response: {
-    id: string;
-    threadId: string;
-    labelIds: string[];
-  };
+  text: string;
+  aiDraft: string;
+  streaming: boolean;
+  sending: boolean;
+  error: string | null;
 }
-import '../styles/Classify.css';
 
 interface ClassifiedEmail {
   id: string;
@@ -29,23 +30,29 @@ interface ClassifiedEmail {
 }
 
 const LOCAL_KEY = 'classified_emails_cache';
+const PAGE_SIZE = 50;
 
 const Classify: React.FC = () => {
-  const [respondModal, setRespondModal] = useState<null | RespondResult>(null);
+  const [respondModal, setRespondModal] = useState<null | SendResult>(null);
+  const [compose, setCompose] = useState<null | Compose>(null);
+  const stopDraft = useRef<null | (() => void)>(null);
   const [emails, setEmails] = useState<ClassifiedEmail[]>([]);
   const [loading, setLoading] = useState(true);
   const [error, setError] = useState<string | null>(null);
   const [alert, setAlert] = useState<string | null>(null);
+  const [nextCursor, setNextCursor] = useState<string | null>(null);
+  const [loadingMore, setLoadingMore] = useState(false);
 
 
   // On mount, fetch classified emails from MongoDB (GET endpoint)
   useEffect(() => {
     setLoading(true);
     setError(null);
-    fetch('http://127.0.0.1:8000/classified-emails')
+    fetch(`http://127.0.0.1:8000/classified-emails?limit=${PAGE_SIZE}`)
       .then(res => res.json())
       .then(data => {
         setEmails(data.classified_emails || []);
+        setNextCursor(data.next_cursor || null);
         localStorage.setItem(LOCAL_KEY, JSON.stringify(data.classified_emails || []));
         setLoading(false);
       })
@@ -60,12 +67,11 @@ const Classify: React.FC = () => {
     setLoading(true);
     setError(null);
     setAlert(null);
-    fetch('http://127.0.0.1:8000/classify', {
+    runJob('/classify', {
       method: 'POST',
       headers: { 'Content-Type': 'application/json' },
       body: JSON.stringify({}),
     })
-      .then(res => res.json())
       .then(data => {
         // Merge new classified emails with existing, avoiding duplicates by id
         const newEmails: ClassifiedEmail[] = data.classified_emails || [];
@@ -90,8 +96,61 @@ const Classify: React.FC = () => {
       });
   };
 
+  // Fetch the next page using the cursor returned by the previous one
+  const handleLoadMore = () => {
+    if (!nextCursor) return;
+    setLoadingMore(true);
+    fetch(`http://127.0.0.1:8000/classified-emails?limit=${PAGE_SIZE}&cursor=${encodeURIComponent(nextCursor)}`)
+      .then(res => res.json())
+      .then(data => {
+        const existingById = new Map(emails.map(e => [e.id, e]));
+        (data.classified_emails || []).forEach((e: ClassifiedEmail) => existingById.set(e.id, e));
+        setEmails(Array.from(existingById.values()));
+        setNextCursor(data.next_cursor || null);
+        setLoadingMore(false);
+      })
+      .catch(() => {
+        setError('Failed to fetch classified emails from database.');
+        setLoadingMore(false);
+      });
+  };
+
   const [expanded, setExpanded] = useState<string | null>(null);
 
+  // Open the reply editor and stream the AI draft into it as it is generated
+  const handleRespond = (email: ClassifiedEmail) => {
+    stopDraft.current?.();
+    setCompose({ emailId: email.id, to: email.from, subject: `Re: ${email.subject}`, text: '', aiDraft: '', streaming: true, sending: false, error: null });
+    stopDraft.current = streamDraft(email.id, {
+      onMeta: meta => setCompose(c => c && { ...c, to: meta.to, subject: meta.subject }),
+      onDelta: text => setCompose(c => c && { ...c, text: c.text + text, aiDraft: c.aiDraft + text }),
+      onDone: () => setCompose(c => c && { ...c, streaming: false }),
+      onError: message => setCompose(c => c && { ...c, streaming: false, error: message }),
+    });
+  };
+
+  const closeCompose = () => {
+    stopDraft.current?.();
+    stopDraft.current = null;
+    setCompose(null);
+  };
+
+  const handleSend = async () => {
+    if (!compose || !compose.text.trim()) return;
+    setCompose({ ...compose, sending: true, error: null });
+    try {
+      const result = await sendReply(compose.emailId, compose.text, compose.text !== compose.aiDraft);
+      if (result.status === 'sent' || result.status === 'queued' || result.status === 'sending') {
+        setCompose(null);
+        setRespondModal(result);
+      } else {
+        setCompose(c => c && { ...c, sending: false, error: 'Failed to send response.' });
+      }
+    } catch {
+      setCompose(c => c && { ...c, sending: false, error: 'Failed to send response.' });
+    }
+  };
+
   if (loading) return <div className="loader">Loading classified emails...</div>;
   if (error) return <div className="error">{error}</div>;
 
@@ -144,40 +203,47 @@ const Classify: React.FC = () => {
                 <div className="classify-card-footer">
                   <button
                     className="respond-btn"
-                    onClick={async e => {
+                    onClick={e => {
                       e.stopPropagation();
-                      const draft = window.prompt('Enter your response:', '');
-                      if (!draft) return;
-                      try {
-                        const res = await fetch('http://127.0.0.1:8000/respond', {
-                          method: 'POST',
-                          headers: { 'Content-Type': 'application/json' },
-                          body: JSON.stringify({ email_id: email.id, draft }),
-                        });
-                        const data: RespondResult = await res.json();
-                        if (data.status === 'sent') {
-                          setRespondModal(data);
-                        } else {
-                          window.alert('Failed to send response.');
-                        }
-                      } catch {
-                        window.alert('Failed to send response.');
-                      }
+                      handleRespond(email);
                     }}
                     tabIndex={0}
                     title="Respond"
                   >Respond</button>
                 </div>
+      {compose && (
+        <div className="respond-modal-overlay" onClick={closeCompose}>
+          <div className="respond-modal" onClick={e => e.stopPropagation()}>
+            <h2>Reply</h2>
+            <div><b>To:</b> {compose.to}</div>
+            <div><b>Subject:</b> {compose.subject}</div>
+            <textarea
+              className="respond-editor"
+              value={compose.text}
+              placeholder={compose.streaming ? 'Drafting...' : ''}
+              readOnly={compose.streaming}
+              onChange={e => setCompose({ ...compose, text: e.target.value })}
+            />
+            {compose.error && <div className="error">{compose.error}</div>}
+            <div style={{ display: 'flex', gap: '0.8rem', marginTop: '1.2em' }}>
+              <button onClick={handleSend} disabled={compose.streaming || compose.sending || !compose.text.trim()}>
+                {compose.sending ? 'Sending...' : 'Send'}
+              </button>
+              <button onClick={closeCompose}>Cancel</button>
+            </div>
+          </div>
+        </div>
+      )}
       {respondModal && (
         <div className="respond-modal-overlay" onClick={() => setRespondModal(null)}>
           <div className="respond-modal" onClick={e => e.stopPropagation()}>
-            <h2>Response Sent!</h2>
+            <h2>{respondModal.status === 'sent' ? 'Response Sent!' : 'Response Queued'}</h2>
             <div><b>To:</b> {respondModal.to}</div>
             <div><b>Subject:</b> {respondModal.subject}</div>
             <div><b>Draft:</b>
               <pre style={{ background: '#f4f6fa', padding: '0.7em', borderRadius: '6px', marginTop: '0.3em' }}>{respondModal.draft}</pre>
             </div>
-            <div><b>Gmail Message ID:</b> {respondModal.gmail_response.id}</div>
+            {respondModal.gmail_response && <div><b>Gmail Message ID:</b> {respondModal.gmail_response.id}</div>}
             <button style={{ marginTop: '1.2em' }} onClick={() => setRespondModal(null)}>Close</button>
           </div>
         </div>
@@ -186,6 +252,13 @@ const Classify: React.FC = () => {
             );
           })}
       </div>
+      {nextCursor && (
+        <div style={{ display: 'flex', justifyContent: 'center', margin: '1rem 0' }}>
+          <button onClick={handleLoadMore} className="refresh-btn" disabled={loadingMore}>
+            {loadingMore ? 'Loading...' : 'Load more'}
+          </button>
+        </div>
+      )}
     </div>
   );
 };
@@ -1,5 +1,6 @@
 import React, { useEffect, useState } from 'react';
 import '../styles/Inbox.css';
+import { runJob } from '../utils/jobs';
 
 interface Email {
   id: string;
@@ -41,14 +42,13 @@ const Inbox: React.FC = () => {
   const fetchEmails = () => {
     setLoading(true);
     setError(null);
-    fetch('http://127.0.0.1:8000/fetch', {
+    runJob('/fetch', {
       method: 'POST',
       headers: {
         'Content-Type': 'application/json',
       },
       body: JSON.stringify({}),
     })
-      .then(res => res.json())
       .then(data => {
         setEmails(data.emails || []);
         localStorage.setItem(LOCAL_KEY, JSON.stringify(data.emails || []));
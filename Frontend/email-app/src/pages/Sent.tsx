@@ -20,16 +20,21 @@ interface RespondedEmail {
   gmail_response: GmailResponse;
 }
 
+const PAGE_SIZE = 50;
+
 const Sent: React.FC = () => {
   const [emails, setEmails] = useState<RespondedEmail[]>([]);
   const [loading, setLoading] = useState(true);
   const [error, setError] = useState<string | null>(null);
+  const [nextCursor, setNextCursor] = useState<string | null>(null);
+  const [loadingMore, setLoadingMore] = useState(false);
 
   useEffect(() => {
-    fetch('http://127.0.0.1:8000/responded-emails')
+    fetch(`http://127.0.0.1:8000/responded-emails?limit=${PAGE_SIZE}`)
       .then(res => res.json())
       .then(data => {
         setEmails(data.responded_emails || []);
+        setNextCursor(data.next_cursor || null);
         setLoading(false);
       })
       .catch(() => {
@@ -38,6 +43,22 @@ const Sent: React.FC = () => {
       });
   }, []);
 
+  const handleLoadMore = () => {
+    if (!nextCursor) return;
+    setLoadingMore(true);
+    fetch(`http://127.0.0.1:8000/responded-emails?limit=${PAGE_SIZE}&cursor=${encodeURIComponent(nextCursor)}`)
+      .then(res => res.json())
+      .then(data => {
+        setEmails(prev => [...prev, ...(data.responded_emails || [])]);
+        setNextCursor(data.next_cursor || null);
+        setLoadingMore(false);
+      })
+      .catch(() => {
+        setError('Failed to fetch sent emails.');
+        setLoadingMore(false);
+      });
+  };
+
   if (loading) return <div className="loader">Loading sent emails...</div>;
   if (error) return <div className="error">{error}</div>;
 
@@ -59,6 +80,11 @@ const Sent: React.FC = () => {
           </div>
         </div>
       ))}
+      {nextCursor && (
+        <button onClick={handleLoadMore} className="refresh-btn" disabled={loadingMore}>
+          {loadingMore ? 'Loading...' : 'Load more'}
+        </button>
+      )}
     </div>
   );
 };
@@ -0,0 +1,68 @@
+const API_BASE = 'http://127.0.0.1:8000';
+
+export interface DraftMeta {
+  email_id: string;
+  to: string;
+  from: string;
+  subject: string;
+}
+
+export interface SendResult {
+  status: string;
+  email_id: string;
+  to: string;
+  from: string;
+  subject: string;
+  draft: string;
+  outbound_id: string;
+  gmail_response: { id: string; threadId: string; labelIds: string[] } | null;
+}
+
+// Stream a reply draft over SSE; onDelta receives each token chunk as it arrives.
+// Returns a function that stops the stream.
+export function streamDraft(
+  emailId: string,
+  handlers: {
+    onMeta?: (meta: DraftMeta) => void;
+    onDelta: (text: string) => void;
+    onDone?: (draft: string) => void;
+    onError?: (message: string) => void;
+  },
+): () => void {
+  const source = new EventSource(`${API_BASE}/respond/draft/stream?email_id=${encodeURIComponent(emailId)}`);
+  let finished = false;
+  const finish = () => {
+    finished = true;
+    source.close();
+  };
+
+  source.addEventListener('meta', e => handlers.onMeta?.(JSON.parse((e as MessageEvent).data)));
+  source.addEventListener('delta', e => handlers.onDelta(JSON.parse((e as MessageEvent).data).text));
+  source.addEventListener('done', e => {
+    finish();
+    handlers.onDone?.(JSON.parse((e as MessageEvent).data).draft);
+  });
+  source.addEventListener('draft_error', e => {
+    finish();
+    handlers.onError?.(JSON.parse((e as MessageEvent).data).detail || 'Draft generation failed');
+  });
+  // Connection errors; without this EventSource would reconnect and draft again
+  source.onerror = () => {
+    if (finished) return;
+    finish();
+    handlers.onError?.('Lost connection while drafting');
+  };
+  return finish;
+}
+
+// Send the final reply text as-is; no draft is regenerated on the server
+export async function sendReply(emailId: string, body: string, editedByHuman: boolean): Promise<SendResult> {
+  const res = await fetch(`${API_BASE}/respond/send`, {
+    method: 'POST',
+    headers: { 'Content-Type': 'application/json' },
+    body: JSON.stringify({ email_id: emailId, body, edited_by_human: editedByHuman }),
+  });
+  const data = await res.json();
+  if (!res.ok) throw new Error(data.detail || 'Failed to send response');
+  return data;
+}
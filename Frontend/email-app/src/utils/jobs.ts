@@ -0,0 +1,31 @@
+const API_BASE = 'http://127.0.0.1:8000';
+const POLL_INTERVAL_MS = 1000;
+
+export interface Job<T = any> {
+  _id: string;
+  type: string;
+  status: 'queued' | 'running' | 'succeeded' | 'failed' | 'cancelled';
+  progress: Record<string, any>;
+  result: T | null;
+  error: string | null;
+}
+
+// Enqueue a background job and poll /jobs/{id} until it finishes; resolves with the job result
+export async function runJob<T = any>(
+  path: string,
+  init: RequestInit,
+  onProgress?: (job: Job<T>) => void,
+): Promise<T> {
+  const queued = await fetch(`${API_BASE}${path}`, init).then(res => res.json());
+  if (!queued.job_id) throw new Error(queued.detail || 'Failed to start job');
+
+  for (;;) {
+    const job: Job<T> = await fetch(`${API_BASE}/jobs/${queued.job_id}`).then(res => res.json());
+    if (onProgress) onProgress(job);
+    if (job.status === 'succeeded') return job.result as T;
+    if (job.status === 'failed' || job.status === 'cancelled') {
+      throw new Error(job.error || `Job ${job.status}`);
+    }
+    await new Promise(resolve => setTimeout(resolve, POLL_INTERVAL_MS));
+  }
+}